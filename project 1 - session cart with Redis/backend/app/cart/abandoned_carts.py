@@ -0,0 +1,144 @@
+# abandoned_carts.py
+"""
+Abandoned-cart aggregates, built from Redis expired-key notifications by
+`python manage.py track_abandoned_carts`.
+
+When settings.CART_SHADOW_GRACE is set, every cart write also maintains
+
+    abandoned:shadow:{sid}    hash    product_id -> quantity
+
+with a TTL of CART_TTL + CART_SHADOW_GRACE (see set_qty() and touch() in
+lua_scripts.py). Clearing a cart deletes its shadow, and so does removing its
+last line, so only carts that expire with items in them leave one behind.
+
+The worker subscribes to __keyevent@<db>__:expired, maps each expired cart
+key to its session, and every `batch_size` events (or `batch_timeout`
+seconds) pops the shadows of the batch and looks up the prices in the product
+index, two round trips per batch. The batch is folded into a running
+Aggregate, saved as one AbandonedCartWindow row and a bulk insert of its top
+AbandonedCartProduct rows every `window` seconds.
+
+Memory is bounded by the batch size and the number of distinct products in a
+window, whatever the number of carts. Notifications are fire-and-forget: a
+cart that expires while no worker is listening is not counted, and its shadow
+expires on its own after the grace period. Run a single worker, each
+subscriber receives every event.
+"""
+
+from collections import Counter
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from inventory import product_cache
+
+from . import redis_cart
+from .models import AbandonedCartProduct, AbandonedCartWindow
+
+
+def expired_channel(client=None):
+    db = (client or redis_cart.r).connection_pool.connection_kwargs.get("db", 0)
+    return f"__keyevent@{db}__:expired"
+
+
+def session_id_from_expired_key(key):
+    """Session of the cart an expired key belonged to, None for other keys."""
+    # cart:{sid} in the compact layout, cart:{sid}:qty in the split one. The
+    # other keys of a cart expire with these and are ignored, so each cart is
+    # seen once.
+    parts = key.split(":")
+    if parts[0] != "cart":
+        return None
+    if len(parts) == 2 or (len(parts) == 3 and parts[2] == "qty"):
+        return parts[1]
+    return None
+
+
+def pop_shadows(session_ids, client=None):
+    """
+    [{product_id: quantity}, ...] of the given expired carts, read and deleted
+    in one pipeline. Carts without a shadow (emptied, or written while shadows
+    were off) are left out.
+    """
+    pipe = (client or redis_cart.r).pipeline(transaction=False)
+    for session_id in session_ids:
+        key = redis_cart._shadow_key(session_id)
+        pipe.hgetall(key)
+        pipe.unlink(key)
+    results = pipe.execute()
+    return [
+        {int(pid): int(qty) for pid, qty in shadow.items()}
+        for shadow in results[::2]
+        if shadow
+    ]
+
+
+class Aggregate:
+    """Running totals of the abandoned carts of the current window."""
+
+    def __init__(self, top_products=10, clock=timezone.now):
+        self.top_products = top_products
+        self._clock = clock
+        self.reset()
+
+    def reset(self):
+        self.started_at = self._clock()
+        self.carts = 0
+        self.items = 0
+        self.value = Decimal("0")
+        self._quantities = Counter()
+        self._carts = Counter()
+
+    def add(self, shadows, products):
+        # products: product_cache.get_products() of the shadows' product ids;
+        # products that no longer exist count as items but add no value
+        for shadow in shadows:
+            self.carts += 1
+            for pid, qty in shadow.items():
+                self.items += qty
+                self._quantities[pid] += qty
+                self._carts[pid] += 1
+                product = products.get(pid)
+                if product is not None:
+                    self.value += Decimal(str(product["price"])) * qty
+
+    def top(self):
+        """[(product_id, quantity, carts), ...] most abandoned first."""
+        return [
+            (pid, qty, self._carts[pid])
+            for pid, qty in self._quantities.most_common(self.top_products)
+        ]
+
+    def save(self):
+        """Write the window to Postgres and start a new one. None when empty."""
+        ended_at = self._clock()
+        window = None
+        if self.carts:
+            with transaction.atomic():
+                window = AbandonedCartWindow.objects.create(
+                    started_at=self.started_at,
+                    ended_at=ended_at,
+                    carts=self.carts,
+                    items=self.items,
+                    value=self.value,
+                )
+                AbandonedCartProduct.objects.bulk_create(
+                    [
+                        AbandonedCartProduct(
+                            window=window, product_id=pid, quantity=qty, carts=carts
+                        )
+                        for pid, qty, carts in self.top()
+                    ]
+                )
+        self.reset()
+        return window
+
+
+def process_batch(session_ids, aggregate, client=None):
+    """Fold the expired carts of `session_ids` into `aggregate`."""
+    shadows = pop_shadows(session_ids, client=client)
+    if shadows:
+        product_ids = {pid for shadow in shadows for pid in shadow}
+        aggregate.add(shadows, product_cache.get_products(product_ids))
+    return len(shadows)
@@ -1,3 +1,10 @@
 from django.contrib import admin
 
 # Register your models here.
+from .models import (
+    AbandonedCartProduct,
+    AbandonedCartWindow,
+)
+
+admin.site.register(AbandonedCartWindow)
+admin.site.register(AbandonedCartProduct)
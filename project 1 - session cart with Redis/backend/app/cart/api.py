@@ -0,0 +1,133 @@
+from typing import List
+
+from inventory import local_cache
+from ninja import NinjaAPI, Router
+from ninja.errors import ValidationError
+
+from . import async_redis_cart, redis_cart
+from .schemas import (
+    AddToCartIn,
+    CartBatchIn,
+    CartBatchOut,
+    CartOut,
+    CartPromoIn,
+    CheckoutItemOut,
+    ErrorOut,
+    MessageOut,
+    RemoveFromCartIn,
+    SetQuantityIn,
+    UpdateQuantityIn,
+)
+from .views import check_cart_lines
+
+# Async version of the DRF views in views.py: same paths, bodies, status
+# codes and responses, on async_redis_cart. Mounted by cart/urls.py when
+# settings.CART_ASYNC_API is on (under ASGI, see core/asgi.py).
+
+router = Router()
+
+
+async def _session_id(request):
+    if not request.session.session_key:
+        await request.session.acreate()
+    return request.session.session_key
+
+
+@router.get("/get/", response=CartOut)
+async def get_cart(request):
+    snapshot = await async_redis_cart.get_cart_snapshot(request.session.session_key)
+    return snapshot.as_dict()
+
+
+@router.delete("/get/", response=MessageOut)
+async def clear_cart(request):
+    await async_redis_cart.clear_cart(request.session.session_key)
+    return {"message": "Cart cleared."}
+
+
+@router.post("/add/", response={200: MessageOut, 409: ErrorOut})
+async def add_to_cart(request, data: AddToCartIn):
+    session_id = await _session_id(request)
+    await async_redis_cart.add_to_cart(
+        session_id, product_id=data.product_id, quantity=data.quantity
+    )
+    return {"message": "Added to cart."}
+
+
+@router.post("/delete/", response=MessageOut)
+async def remove_from_cart(request, data: RemoveFromCartIn):
+    await async_redis_cart.remove_from_cart(
+        request.session.session_key, data.product_id
+    )
+    return {"message": "Removed from cart."}
+
+
+@router.post("/increment/", response={200: MessageOut, 409: ErrorOut})
+async def update_quantity(request, data: UpdateQuantityIn):
+    session_id = request.session.session_key
+    if data.action == "inc":
+        await async_redis_cart.increment_quantity(session_id, data.product_id)
+    else:
+        await async_redis_cart.decrement_quantity(session_id, data.product_id)
+    return {"message": f"{data.action} quantity successful"}
+
+
+@router.post("/update/qty/", response={200: MessageOut, 404: ErrorOut, 409: ErrorOut})
+async def set_quantity(request, data: SetQuantityIn):
+    session_id = await _session_id(request)
+    updated = await async_redis_cart.set_quantity(
+        session_id, data.product_id, data.quantity
+    )
+    if not updated:
+        return 404, {"error": "Product not found in cart."}
+    return {"message": f"Quantity updated to {data.quantity}"}
+
+
+@router.post("/promo/", response=MessageOut)
+async def set_promo_code(request, data: CartPromoIn):
+    await async_redis_cart.set_cart_promo_code(
+        request.session.session_key, data.promo_code
+    )
+    return {"message": "Cart promotion code set."}
+
+
+@router.post("/batch/", response=CartBatchOut)
+async def batch_update(request, data: CartBatchIn):
+    session_id = await _session_id(request)
+    result = await async_redis_cart.batch_update(
+        session_id,
+        [(op.action, op.product_id, op.quantity) for op in data.operations],
+    )
+    return {"results": result.results, **result.snapshot.as_dict()}
+
+
+@router.post("/checkout/", response=List[CheckoutItemOut])
+async def checkout(request):
+    session_id = request.session.session_key
+    quantities = await async_redis_cart.get_cart_quantities(session_id)
+    if not quantities:
+        return []
+
+    product_map = await local_cache.aget_products(quantities)
+    cleaned_cart, removals = check_cart_lines(quantities, product_map)
+    await async_redis_cart.reconcile_cart(session_id, removals=removals)
+    return cleaned_cart
+
+
+api = NinjaAPI(title="Session-Based Cart (async)", urls_namespace="cart_api")
+api.add_router("/", router)
+
+
+@api.exception_handler(ValidationError)
+def validation_error(request, exc):
+    # 400 {"field": ["message", ...]} like the DRF views, not Ninja's 422
+    errors = {}
+    for error in exc.errors:
+        field = str(error["loc"][-1]) if len(error["loc"]) > 2 else "non_field_errors"
+        errors.setdefault(field, []).append(error["msg"])
+    return api.create_response(request, errors, status=400)
+
+
+@api.exception_handler(redis_cart.OutOfStock)
+def out_of_stock(request, exc):
+    return api.create_response(request, {"error": "Not enough stock."}, status=409)
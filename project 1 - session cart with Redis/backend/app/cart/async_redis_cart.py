@@ -0,0 +1,134 @@
+# async_redis_cart.py
+"""
+Async counterpart of redis_cart on redis.asyncio, used by the Ninja cart API
+(cart/api.py) under ASGI. While a request waits on Redis the event loop
+serves other requests instead of blocking a worker thread.
+
+Keys, layouts, Lua scripts and return values are the same as redis_cart's,
+and so are the helpers that build commands and parse replies; only the I/O
+differs.
+"""
+
+from django.conf import settings
+
+from inventory import product_cache
+
+from . import lua_scripts, redis_cart
+
+r = settings.ASYNC_REDIS_CLIENT
+
+# EVALSHA with a SCRIPT LOAD fallback, as in redis_cart
+_add_to_cart_script = r.register_script(lua_scripts.ADD_TO_CART)
+_remove_from_cart_script = r.register_script(lua_scripts.REMOVE_FROM_CART)
+_change_quantity_script = r.register_script(lua_scripts.CHANGE_QUANTITY)
+_set_quantity_script = r.register_script(lua_scripts.SET_QUANTITY)
+_update_cart_item_script = r.register_script(lua_scripts.UPDATE_CART_ITEM)
+_reconcile_cart_script = r.register_script(lua_scripts.RECONCILE_CART)
+_batch_cart_script = r.register_script(lua_scripts.BATCH_CART)
+_set_promo_code_script = r.register_script(lua_scripts.SET_PROMO_CODE)
+_clear_cart_script = r.register_script(lua_scripts.CLEAR_CART)
+_read_cart_script = r.register_script(lua_scripts.READ_CART)
+
+
+async def _run_script(script, session_id, *args):
+    # client=r is resolved at call time so the module client can be swapped
+    return await script(
+        keys=redis_cart._cart_keys(session_id),
+        args=redis_cart._script_args(*args),
+        client=r,
+    )
+
+
+async def _read_cart(session_id):
+    layouts = redis_cart._readable_layouts()
+    async with r.pipeline(transaction=False) as pipe:
+        redis_cart._queue_read_cart(pipe, session_id, layouts)
+        results = await pipe.execute()
+    return redis_cart._unpack_read_cart(results, layouts)
+
+
+async def add_to_cart(session_id, product_id, quantity):
+    return redis_cart._check_stock(
+        await _run_script(_add_to_cart_script, session_id, product_id, quantity),
+        product_id,
+    )
+
+
+async def get_cart_snapshot(session_id):
+    qtys, details, promo_code, products, missing = redis_cart._unpack_joined_cart(
+        await _read_cart_script(
+            keys=redis_cart._cart_keys(session_id),
+            args=redis_cart._read_cart_args(),
+            client=r,
+        )
+    )
+    products.update(await product_cache.aload_products(missing))
+    return redis_cart._build_snapshot(qtys, details, promo_code, products)
+
+
+async def get_cart_quantities(session_id):
+    qtys, _, _ = await _read_cart(session_id)
+    return redis_cart._to_quantities(qtys)
+
+
+async def get_cart(session_id):
+    snapshot = await get_cart_snapshot(session_id)
+    return [item._asdict() for item in snapshot.items]
+
+
+async def remove_from_cart(session_id, product_id):
+    return bool(await _run_script(_remove_from_cart_script, session_id, product_id))
+
+
+async def clear_cart(session_id):
+    await _run_script(_clear_cart_script, session_id)
+
+
+async def increment_quantity(session_id, product_id, step=1):
+    changed = await _run_script(_change_quantity_script, session_id, product_id, step)
+    return redis_cart._check_stock(changed, product_id) >= 0
+
+
+async def decrement_quantity(session_id, product_id, step=1):
+    changed = await _run_script(_change_quantity_script, session_id, product_id, -step)
+    return changed >= 0
+
+
+async def set_quantity(session_id, product_id, quantity):
+    updated = await _run_script(_set_quantity_script, session_id, product_id, quantity)
+    return bool(redis_cart._check_stock(updated, product_id))
+
+
+async def set_cart_promo_code(session_id, promo_code):
+    await _run_script(_set_promo_code_script, session_id, promo_code)
+
+
+async def get_cart_promo_code(session_id):
+    async with r.pipeline(transaction=False) as pipe:
+        redis_cart._queue_read_promo_code(pipe, session_id)
+        return redis_cart._first_promo_code(await pipe.execute())
+
+
+async def update_cart_item(session_id, product_id, quantity):
+    redis_cart._check_stock(
+        await _run_script(_update_cart_item_script, session_id, product_id, quantity),
+        product_id,
+    )
+
+
+async def reconcile_cart(session_id, removals=(), updates=None):
+    args = redis_cart._reconcile_args(removals, updates)
+    if args is None:
+        return 0
+    return await _run_script(_reconcile_cart_script, session_id, *args)
+
+
+async def batch_update(session_id, operations):
+    results, *cart = await _run_script(
+        _batch_cart_script, session_id, *redis_cart._batch_args(operations)
+    )
+    qtys, details, promo_code = redis_cart._unpack_batch_cart(cart)
+    products = await product_cache.aget_products(qtys)
+    return redis_cart.BatchResult(
+        results, redis_cart._build_snapshot(qtys, details, promo_code, products)
+    )
@@ -0,0 +1,16 @@
+# details_codec.py
+"""
+Decoder of the cart item details older versions stored in Redis
+({"product_id", "name", "price"} per cart line, json.dumps() of the dict).
+
+Carts no longer store details (name/price come from inventory.product_cache).
+Details written by earlier versions are only read back, as a fallback for
+products the cache no longer knows, and removed together with their line.
+"""
+
+import json
+
+
+def decode_many(raws):
+    """Decode a list of stored values with one json.loads over a JSON array."""
+    return json.loads(f"[{','.join(raws)}]")
@@ -0,0 +1,456 @@
+# lua_scripts.py
+"""
+Server-side Lua scripts used by redis_cart.
+
+Every cart mutation runs as one script, so Redis executes it atomically and
+the client pays a single round trip (EVALSHA) per call. There is no need for
+WATCH/MULTI retry loops: nothing else can run on the server while a script
+is executing.
+
+A cart can be stored in one of two layouts (settings.CART_LAYOUT):
+
+    split   - cart:{sid}:qty        hash  product_id -> quantity
+              cart:{sid}:details    hash  product_id -> details blob (legacy)
+              cart:{sid}:promo_code string
+    compact - cart:{sid}            hash  q:{product_id} -> quantity
+                                          d:{product_id} -> details blob (legacy)
+                                          promo          -> promo code
+
+Product name/price live in the shared product cache (inventory.product_cache),
+so new writes only store quantities. Details blobs written by older versions
+are still moved between layouts and removed together with their cart line.
+
+The compact layout is one key per cart instead of three, so it needs one
+EXPIRE per write and, for typical cart sizes, stays in Redis' listpack
+encoding. Every script first moves a cart stored in the other layout into
+the configured one, so carts migrate online the first time they are written.
+
+The session of the cart (cart:{sid}:session, written by session_store.py) is
+not part of either layout, but shares the cart's TTL: every script refreshes
+it together with the cart keys (EXPIRE leaves a missing session missing).
+
+All scripts share the same calling convention:
+    KEYS[1] -> cart:{sid}:qty
+    KEYS[2] -> cart:{sid}:details
+    KEYS[3] -> cart:{sid}:promo_code
+    KEYS[4] -> cart:{sid}
+    KEYS[5] -> abandoned:shadow:{sid} (see abandoned_carts.py)
+    KEYS[6] -> stock:hold:{sid} (see inventory/stock.py)
+    KEYS[7] -> cart:{sid}:session (see session_store.py)
+    ARGV[1] -> cart TTL in seconds
+    ARGV[2] -> layout, "split" or "compact"
+    ARGV[3] -> shadow grace in seconds, 0 when shadows are off
+    ARGV[4:] -> operation specific arguments
+
+HELPERS drops ARGV[3] from ARGV, so in the scripts below the operation
+arguments start at ARGV[3].
+
+The shadow is a plain {product_id: quantity} hash mirroring the cart lines,
+written by set_qty() and kept `grace` seconds longer than the cart, so the
+abandoned-cart worker can still read it when the cart key expires.
+
+Products with a stock:{product_id} counter have limited stock: set_qty()
+reserves the units a line gains and releases the units it loses in the same
+script, and refuses (OUT_OF_STOCK) when not enough units are available. The
+units are held in stock:hold:{sid} until the cart expires, see
+inventory/stock.py. The counters are shared by every cart and are not in
+KEYS, so these scripts need a single Redis, not a cluster.
+"""
+
+from inventory.stock import STOCK_HELPERS
+
+# Returned by the scripts when a line could not get the stock it asked for.
+OUT_OF_STOCK = -2
+
+HELPERS = STOCK_HELPERS + """
+local qty_key = KEYS[1]
+local details_key = KEYS[2]
+local promo_key = KEYS[3]
+local cart_key = KEYS[4]
+local shadow_key = KEYS[5]
+local hold_key = KEYS[6]
+local session_key = KEYS[7]
+local ttl = tonumber(ARGV[1])
+local compact = ARGV[2] == 'compact'
+local shadow_grace = tonumber(ARGV[3])
+
+-- drop the shadow grace from the arguments (into a local, ARGV itself is
+-- read-only on recent Redis versions)
+local ARGV = (function(argv)
+    local args = {argv[1], argv[2]}
+    for i = 4, #argv do
+        args[i - 1] = argv[i]
+    end
+    return args
+end)(ARGV)
+
+local OUT_OF_STOCK = -2
+local QTY_PREFIX = 'q:'
+local DETAILS_PREFIX = 'd:'
+local PROMO_FIELD = 'promo'
+
+-- hash and field prefix holding quantities / details in the active layout
+local hqty_key = qty_key
+local hdetails_key = details_key
+local qty_prefix = ''
+local details_prefix = ''
+if compact then
+    hqty_key = cart_key
+    hdetails_key = cart_key
+    qty_prefix = QTY_PREFIX
+    details_prefix = DETAILS_PREFIX
+end
+
+local function hset_pairs(key, prefix, pairs)
+    for i = 1, #pairs, 2 do
+        redis.call('HSET', key, prefix .. pairs[i], pairs[i + 1])
+    end
+end
+
+-- Remaining lifetime of a cart stored in `keys`, in milliseconds: the
+-- longest of theirs (any of them may be missing), the cart TTL if none has
+-- one.
+local function cart_pttl(keys)
+    local pttl = -1
+    for _, key in ipairs(keys) do
+        pttl = math.max(pttl, redis.call('PTTL', key))
+    end
+    if pttl <= 0 then
+        return ttl * 1000
+    end
+    return pttl
+end
+
+-- Move the cart from the other layout into the active one, keeping its TTL.
+-- Returns 1 if something was moved.
+local function normalize_layout()
+    if compact then
+        if redis.call('EXISTS', qty_key, details_key, promo_key) == 0 then
+            return 0
+        end
+        local pttl = cart_pttl({qty_key, details_key, promo_key})
+        hset_pairs(cart_key, QTY_PREFIX, redis.call('HGETALL', qty_key))
+        hset_pairs(cart_key, DETAILS_PREFIX, redis.call('HGETALL', details_key))
+        local promo = redis.call('GET', promo_key)
+        if promo then
+            redis.call('HSET', cart_key, PROMO_FIELD, promo)
+        end
+        redis.call('DEL', qty_key, details_key, promo_key)
+        redis.call('PEXPIRE', cart_key, pttl)
+        return 1
+    end
+
+    if redis.call('EXISTS', cart_key) == 0 then
+        return 0
+    end
+    local pttl = cart_pttl({cart_key})
+    local fields = redis.call('HGETALL', cart_key)
+    for i = 1, #fields, 2 do
+        local field, value = fields[i], fields[i + 1]
+        local prefix = string.sub(field, 1, 2)
+        if prefix == QTY_PREFIX then
+            redis.call('HSET', qty_key, string.sub(field, 3), value)
+        elseif prefix == DETAILS_PREFIX then
+            redis.call('HSET', details_key, string.sub(field, 3), value)
+        elseif field == PROMO_FIELD then
+            redis.call('SET', promo_key, value)
+        end
+    end
+    redis.call('DEL', cart_key)
+    redis.call('PEXPIRE', qty_key, pttl)
+    redis.call('PEXPIRE', details_key, pttl)
+    redis.call('PEXPIRE', promo_key, pttl)
+    return 1
+end
+
+-- The session and the stock held by the cart share the cart's lifetime, one
+-- refresh covers all of them.
+local function touch()
+    refresh_hold(hold_key, ttl)
+    redis.call('EXPIRE', session_key, ttl)
+    if shadow_grace > 0 then
+        redis.call('EXPIRE', shadow_key, ttl + shadow_grace)
+    end
+    if compact then
+        redis.call('EXPIRE', cart_key, ttl)
+    else
+        redis.call('EXPIRE', qty_key, ttl)
+        redis.call('EXPIRE', details_key, ttl)
+        redis.call('EXPIRE', promo_key, ttl)
+    end
+end
+
+local function set_promo(promo_code)
+    if compact then
+        redis.call('HSET', cart_key, PROMO_FIELD, promo_code)
+    else
+        redis.call('SET', promo_key, promo_code)
+    end
+end
+
+local function drop_promo_if_empty()
+    if compact then
+        local fields = redis.call('HLEN', cart_key)
+        fields = fields - redis.call('HEXISTS', cart_key, PROMO_FIELD)
+        if fields == 0 then
+            redis.call('DEL', cart_key)
+        end
+    elseif redis.call('HLEN', qty_key) == 0 then
+        redis.call('DEL', promo_key)
+    end
+end
+
+local function get_qty(pid)
+    return tonumber(redis.call('HGET', hqty_key, qty_prefix .. pid))
+end
+
+local function drop_details(pid)
+    redis.call('HDEL', hdetails_key, details_prefix .. pid)
+end
+
+-- Single place where a cart line quantity changes; a quantity below 1
+-- removes the line together with its details. Returns false, changing
+-- nothing, when the stock for the new quantity cannot be reserved.
+local function set_qty(pid, qty)
+    if not reserve(hold_key, pid, math.max(qty, 0) - (get_qty(pid) or 0)) then
+        return false
+    end
+    if qty < 1 then
+        redis.call('HDEL', hqty_key, qty_prefix .. pid)
+        drop_details(pid)
+        drop_promo_if_empty()
+        if shadow_grace > 0 then
+            redis.call('HDEL', shadow_key, pid)
+        end
+    else
+        redis.call('HSET', hqty_key, qty_prefix .. pid, qty)
+        if shadow_grace > 0 then
+            redis.call('HSET', shadow_key, pid, qty)
+        end
+    end
+    return true
+end
+"""
+
+PRELUDE = HELPERS + """
+normalize_layout()
+-- a cart that expired and comes back first gives back what it held
+local hold_deadline = redis.call('ZSCORE', HOLDS_KEY, hold_key)
+if hold_deadline and tonumber(hold_deadline) <= now_ms() then
+    release_hold(hold_key)
+end
+"""
+
+# ARGV[3] product_id, ARGV[4] quantity
+# Returns the new quantity of the line, or OUT_OF_STOCK.
+ADD_TO_CART = PRELUDE + """
+local pid = ARGV[3]
+local qty = (get_qty(pid) or 0) + tonumber(ARGV[4])
+if not set_qty(pid, qty) then
+    return OUT_OF_STOCK
+end
+touch()
+return qty
+"""
+
+# ARGV[3] product_id
+# Returns 1 if the line existed, 0 otherwise.
+REMOVE_FROM_CART = PRELUDE + """
+local pid = ARGV[3]
+local existed = get_qty(pid) ~= nil
+set_qty(pid, 0)
+touch()
+if existed then
+    return 1
+end
+return 0
+"""
+
+# ARGV[3] product_id, ARGV[4] step (negative to decrement)
+# Returns the new quantity (0 when the line was removed), -1 if the
+# product is not in the cart, or OUT_OF_STOCK.
+CHANGE_QUANTITY = PRELUDE + """
+local pid = ARGV[3]
+local current = get_qty(pid)
+if current == nil then
+    return -1
+end
+local qty = current + tonumber(ARGV[4])
+if not set_qty(pid, qty) then
+    return OUT_OF_STOCK
+end
+touch()
+if qty < 1 then
+    return 0
+end
+return qty
+"""
+
+# ARGV[3] product_id, ARGV[4] quantity
+# Returns 1 if the line was updated, 0 if the product is not in the cart,
+# or OUT_OF_STOCK.
+SET_QUANTITY = PRELUDE + """
+local pid = ARGV[3]
+if get_qty(pid) == nil then
+    return 0
+end
+if not set_qty(pid, tonumber(ARGV[4])) then
+    return OUT_OF_STOCK
+end
+touch()
+return 1
+"""
+
+# ARGV[3] product_id, ARGV[4] quantity
+# Also drops a legacy details copy, the product cache is authoritative.
+# Returns 1, or OUT_OF_STOCK.
+UPDATE_CART_ITEM = PRELUDE + """
+local pid = ARGV[3]
+if not set_qty(pid, tonumber(ARGV[4])) then
+    return OUT_OF_STOCK
+end
+drop_details(pid)
+touch()
+return 1
+"""
+
+# ARGV[3] number of removals N, ARGV[4 .. 3+N] product_ids to remove,
+# then (product_id, quantity) pairs to update.
+# Lines that are no longer in the cart are not recreated by an update, and
+# lines whose new quantity is not in stock are left as they are.
+# Returns the number of lines removed or updated.
+RECONCILE_CART = PRELUDE + """
+local removals = tonumber(ARGV[3])
+local changed = 0
+for i = 4, 3 + removals do
+    if get_qty(ARGV[i]) ~= nil then
+        set_qty(ARGV[i], 0)
+        changed = changed + 1
+    end
+end
+for i = 4 + removals, #ARGV, 2 do
+    local pid = ARGV[i]
+    if get_qty(pid) ~= nil and set_qty(pid, tonumber(ARGV[i + 1])) then
+        drop_details(pid)
+        changed = changed + 1
+    end
+end
+touch()
+return changed
+"""
+
+# ARGV[3:] (action, product_id, quantity) triples, applied in order:
+#   add    - add quantity, creating the line
+#   set    - set the quantity of an existing line
+#   inc    - add quantity to an existing line
+#   dec    - subtract quantity from an existing line, removed below 1
+#   remove - remove an existing line (quantity is ignored)
+# Returns {results, cart}: the new quantity of the line after every action
+# (0 when removed, -1 if it was not in the cart and nothing was done,
+# OUT_OF_STOCK if the new quantity was not in stock and nothing was done),
+# then the cart as _read_cart() pipelines it for the active layout.
+BATCH_CART = PRELUDE + """
+local ACTIONS = {add = true, set = true, inc = true, dec = true, remove = true}
+for i = 3, #ARGV, 3 do
+    if not ACTIONS[ARGV[i]] then
+        return redis.error_reply('unknown cart action ' .. ARGV[i])
+    end
+end
+
+local results = {}
+for i = 3, #ARGV, 3 do
+    local action, pid, value = ARGV[i], ARGV[i + 1], tonumber(ARGV[i + 2])
+    local current = get_qty(pid)
+    local qty = nil
+    if action == 'add' then
+        qty = (current or 0) + value
+    elseif current ~= nil then
+        if action == 'set' then
+            qty = value
+        elseif action == 'inc' then
+            qty = current + value
+        elseif action == 'dec' then
+            qty = current - value
+        else
+            qty = 0
+        end
+    end
+    if qty == nil then
+        results[#results + 1] = -1
+    elseif not set_qty(pid, qty) then
+        results[#results + 1] = OUT_OF_STOCK
+    else
+        results[#results + 1] = math.max(qty, 0)
+    end
+end
+touch()
+
+if compact then
+    return {results, redis.call('HGETALL', cart_key)}
+end
+return {
+    results,
+    redis.call('HGETALL', qty_key),
+    redis.call('HGETALL', details_key),
+    redis.call('GET', promo_key),
+}
+"""
+
+# ARGV[3] promo code
+SET_PROMO_CODE = PRELUDE + """
+set_promo(ARGV[3])
+touch()
+return 1
+"""
+
+# An emptied cart is not abandoned, its shadow goes with it; the stock it
+# held is released.
+CLEAR_CART = HELPERS + """
+release_hold(hold_key)
+redis.call('DEL', shadow_key)
+return redis.call('DEL', qty_key, details_key, promo_key, cart_key)
+"""
+
+# Read-only: the cart joined with the product index in one round trip.
+# KEYS as above, only KEYS[1..4] are read, both layouts (a cart only ever
+# exists in one). ARGV[1] product index version key, ARGV[2] product key
+# prefix, ARGV[3:] product fields (see inventory/product_cache.py). The
+# product keys are not in KEYS either, so this needs a single Redis.
+# Returns {qtys, details, promo_code, index version, entries}: quantities
+# and details as flat product_id/value lists, then one HMGET of the product
+# fields per line, in the order of qtys.
+READ_CART = """
+local qtys = redis.call('HGETALL', KEYS[1])
+local details = redis.call('HGETALL', KEYS[2])
+local promo = redis.call('GET', KEYS[3])
+local cart = redis.call('HGETALL', KEYS[4])
+for i = 1, #cart, 2 do
+    local field, value = cart[i], cart[i + 1]
+    local prefix = string.sub(field, 1, 2)
+    if prefix == 'q:' then
+        qtys[#qtys + 1] = string.sub(field, 3)
+        qtys[#qtys + 1] = value
+    elseif prefix == 'd:' then
+        details[#details + 1] = string.sub(field, 3)
+        details[#details + 1] = value
+    elseif field == 'promo' then
+        promo = value
+    end
+end
+
+local fields = {}
+for i = 3, #ARGV do
+    fields[#fields + 1] = ARGV[i]
+end
+local entries = {}
+for i = 1, #qtys, 2 do
+    entries[#entries + 1] = redis.call('HMGET', ARGV[2] .. qtys[i], unpack(fields))
+end
+return {qtys, details, promo, redis.call('GET', ARGV[1]), entries}
+"""
+
+# Only moves the cart into the configured layout.
+# Returns 1 if the cart was migrated.
+MIGRATE_CART = HELPERS + """
+return normalize_layout()
+"""
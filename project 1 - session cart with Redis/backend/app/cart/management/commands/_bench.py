@@ -0,0 +1,43 @@
+"""Helpers shared by the bench_* management commands (not a command itself)."""
+
+import time
+from contextlib import contextmanager
+from unittest import mock
+
+from redis.client import Pipeline
+
+
+class RoundTripCounter:
+    def __init__(self):
+        self.count = 0
+
+
+@contextmanager
+def count_round_trips(client):
+    """
+    Count requests sent to Redis through `client`: every plain command and
+    every pipeline execute() is one network round trip.
+    """
+    counter = RoundTripCounter()
+    execute_command = client.execute_command
+    pipeline_execute = Pipeline.execute
+
+    def counted_command(*args, **kwargs):
+        counter.count += 1
+        return execute_command(*args, **kwargs)
+
+    def counted_pipeline(self, *args, **kwargs):
+        counter.count += 1
+        return pipeline_execute(self, *args, **kwargs)
+
+    with mock.patch.object(client, "execute_command", counted_command):
+        with mock.patch.object(Pipeline, "execute", counted_pipeline):
+            yield counter
+
+
+def measure(func, iterations):
+    """Run func() `iterations` times, return microseconds per call."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1_000_000
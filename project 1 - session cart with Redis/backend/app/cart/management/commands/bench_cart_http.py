@@ -0,0 +1,162 @@
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Connection:
+    """
+    Minimal keep-alive HTTP/1.1 client on asyncio streams, so the load
+    generator itself needs nothing outside the standard library.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+        self.cookie = None
+
+    async def request(self, method, path, payload=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port
+            )
+
+        body = json.dumps(payload).encode() if payload is not None else b""
+        head = [
+            f"{method} {path} HTTP/1.1",
+            f"Host: {self.host}:{self.port}",
+            f"Content-Length: {len(body)}",
+        ]
+        if body:
+            head.append("Content-Type: application/json")
+        if self.cookie:
+            head.append(f"Cookie: {self.cookie}")
+        self.writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length, chunked, close = 0, False, False
+        while (line := await self.reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            name, value = name.lower(), value.strip()
+            if name == "content-length":
+                length = int(value)
+            elif name == "transfer-encoding":
+                chunked = "chunked" in value
+            elif name == "connection":
+                close = value.lower() == "close"
+            elif name == "set-cookie" and value.startswith("sessionid="):
+                self.cookie = value.split(";")[0]
+
+        if chunked:
+            while size := int((await self.reader.readline()).strip(), 16):
+                await self.reader.readexactly(size + 2)
+            await self.reader.readline()
+        else:
+            await self.reader.readexactly(length)
+
+        if close:
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Command(BaseCommand):
+    help = (
+        "HTTP load test of the cart API: requests/s and latency of GET "
+        "/api/cart/get/ (or POST add/ with --write) at increasing concurrency, "
+        "for every --target. Compare one sync worker with one async worker, "
+        "e.g. `gunicorn core.wsgi -w 1 --threads 8 -b :8000` against "
+        "`uvicorn core.asgi:application --workers 1 --port 8001` and "
+        "--target sync=http://localhost:8000 --target async=http://localhost:8001. "
+        "Run warm_product_cache first so product reads stay in Redis."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target",
+            action="append",
+            required=True,
+            help="label=base URL of a running server, can be repeated",
+        )
+        parser.add_argument(
+            "--concurrency",
+            default="1,10,50,100",
+            help="comma separated numbers of concurrent clients",
+        )
+        parser.add_argument("--duration", type=float, default=10.0)
+        parser.add_argument("--product-id", type=int, default=1)
+        parser.add_argument(
+            "--write",
+            action="store_true",
+            help="POST /api/cart/add/ instead of GET /api/cart/get/",
+        )
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options["target"]:
+            label, sep, url = target.partition("=")
+            if not sep:
+                raise CommandError(f"--target must be label=url, got {target!r}")
+            parts = urlsplit(url)
+            targets.append((label, parts.hostname, parts.port or 80))
+        levels = [int(level) for level in options["concurrency"].split(",")]
+
+        self.stdout.write(
+            f"{'target':>8} {'clients':>8} {'req/s':>9} {'p50 ms':>8} "
+            f"{'p99 ms':>8} {'errors':>7}"
+        )
+        for label, host, port in targets:
+            for clients in levels:
+                latencies, errors, elapsed = asyncio.run(
+                    self.run_level(host, port, clients, options)
+                )
+                latencies.sort()
+                p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+                self.stdout.write(
+                    f"{label:>8} {clients:>8} {len(latencies) / elapsed:>9.0f} "
+                    f"{statistics.median(latencies or [0]) * 1000:>8.1f} "
+                    f"{p99 * 1000:>8.1f} {errors:>7}"
+                )
+
+    async def run_level(self, host, port, clients, options):
+        add = ("POST", "/api/cart/add/", {"product_id": options["product_id"]})
+        read = ("GET", "/api/cart/get/", None)
+        operation = add if options["write"] else read
+
+        connections = [Connection(host, port) for _ in range(clients)]
+        # every client gets its own session (and cart) first
+        await asyncio.gather(*(conn.request(*add) for conn in connections))
+
+        latencies = []
+        errors = 0
+        deadline = time.perf_counter() + options["duration"]
+
+        async def client(conn):
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    status = await conn.request(*operation)
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    conn.close()
+                    status = None
+                if status == 200:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(conn) for conn in connections))
+        elapsed = time.perf_counter() - start
+        for conn in connections:
+            conn.close()
+        return latencies, errors, elapsed
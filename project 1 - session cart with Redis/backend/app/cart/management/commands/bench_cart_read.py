@@ -0,0 +1,108 @@
+import json
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cart import redis_cart
+from inventory import product_cache, stock
+
+from ._bench import count_round_trips, measure
+
+BENCH_PRODUCT_ID_BASE = 10**12
+
+
+def legacy_read(session_id):
+    """The read path CartView.get used before get_cart_snapshot()."""
+    r = redis_cart.r
+    qtys = r.hgetall(redis_cart._qty_key(session_id))
+    details = r.hgetall(redis_cart._details_key(session_id))
+
+    cart_items = []
+    for pid, qty in qtys.items():
+        detail_json = details.get(pid)
+        if not detail_json:
+            continue
+        data = json.loads(detail_json)
+        data["quantity"] = int(qty)
+        cart_items.append(data)
+
+    promo_code = r.get(redis_cart._promo_key(session_id))
+    return {"items": cart_items, "promo_code": promo_code}
+
+
+def snapshot_read(session_id):
+    return redis_cart.get_cart_snapshot(session_id).as_dict()
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the GET /api/cart/get/ read path against the configured "
+        "Redis: legacy HGETALL/HGETALL/GET vs get_cart_snapshot()."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=20)
+        parser.add_argument("--iterations", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if redis_cart.r.get(product_cache.INDEX_VERSION_KEY) != str(
+            product_cache.INDEX_VERSION
+        ):
+            raise CommandError(
+                "The product index is missing or stale, reads would go to "
+                "Postgres. Run `python manage.py warm_product_cache` first."
+            )
+
+        # a cart of its own and synthetic ids far above the real catalog,
+        # every key written is deleted again below
+        session_id = f"bench-cart-read-{uuid.uuid4().hex}"
+        products = [
+            (BENCH_PRODUCT_ID_BASE + i, f"Product {i}", i * 1.5, True)
+            for i in range(1, options["items"] + 1)
+        ]
+        try:
+            self.prepare(session_id, products)
+            if redis_cart.get_layout() != redis_cart.SPLIT:
+                # the legacy path only understands the split layout
+                paths = [("snapshot", snapshot_read)]
+            elif legacy_read(session_id) != snapshot_read(session_id):
+                raise CommandError("The legacy and snapshot reads disagree.")
+            else:
+                paths = [("legacy", legacy_read), ("snapshot", snapshot_read)]
+
+            self.stdout.write(
+                f"cart with {options['items']} items, "
+                f"{options['iterations']} reads per path"
+            )
+            for name, read in paths:
+                with count_round_trips(redis_cart.r) as counter:
+                    read(session_id)
+                per_call = measure(lambda: read(session_id), options["iterations"])
+                self.stdout.write(
+                    f"{name:>10}: {counter.count} round trips, {per_call:8.1f} us/request"
+                )
+        finally:
+            self.cleanup(session_id, products)
+
+    def prepare(self, session_id, products):
+        product_cache.cache_products(products)
+        for pid, name, price, is_active in products:
+            redis_cart.add_to_cart(session_id, pid, 1)
+        redis_cart.set_cart_promo_code(session_id, "BENCH")
+        # the per-cart details copy the legacy path reads
+        redis_cart.r.hset(
+            redis_cart._details_key(session_id),
+            mapping={
+                pid: json.dumps({"product_id": pid, "name": name, "price": price})
+                for pid, name, price, is_active in products
+            },
+        )
+
+    def cleanup(self, session_id, products):
+        pipe = redis_cart.r.pipeline(transaction=False)
+        pipe.delete(
+            *redis_cart._cart_keys(session_id),
+            *(product_cache._product_key(pid) for pid, *_ in products),
+        )
+        pipe.zrem(stock.HOLDS_KEY, stock.hold_key(session_id))
+        pipe.execute()
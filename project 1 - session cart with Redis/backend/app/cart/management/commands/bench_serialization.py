@@ -0,0 +1,82 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from core import fast_json
+from inventory.models import Product
+from inventory.serializers import ProductSerializer
+
+from ._bench import measure
+
+
+def drf_product_list(products):
+    """The default path: ProductSerializer over instances, DRF's renderer."""
+    return JSONRenderer().render(ProductSerializer(products, many=True).data)
+
+
+def fast_product_list(rows):
+    """The FAST_JSON_RESPONSES path: .values() dicts encoded with orjson."""
+    return fast_json.dumps(rows)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the default and the fast JSON path (core/fast_json.py) on "
+        "product lists of 1k/10k/100k products and on a cart body. In memory, "
+        "no database or Redis: it measures serialization only."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000]
+        )
+        parser.add_argument("--cart-items", type=int, default=50)
+        parser.add_argument("--iterations", type=int, default=5)
+
+    def handle(self, *args, **options):
+        if fast_json.orjson is None:
+            raise CommandError("The fast path needs the orjson package.")
+        iterations = options["iterations"]
+
+        self.stdout.write(
+            f"{'products':>9} {'drf ms':>9} {'fast ms':>9} {'speedup':>8} "
+            f"{'drf items/s':>12} {'fast items/s':>13}"
+        )
+        for size in options["sizes"]:
+            # two decimal places, as read from the numeric(10, 2) column
+            rows = [
+                {"id": pid, "name": f"Product {pid}", "price": Decimal(pid).scaleb(-2)}
+                for pid in range(1, size + 1)
+            ]
+            products = [Product(**row) for row in rows]
+            if fast_product_list(rows) != drf_product_list(products):
+                raise CommandError("The two paths do not return the same JSON.")
+
+            drf_us = measure(lambda: drf_product_list(products), iterations)
+            fast_us = measure(lambda: fast_product_list(rows), iterations)
+            self.stdout.write(
+                f"{size:>9} {drf_us / 1000:>9.1f} {fast_us / 1000:>9.1f} "
+                f"{drf_us / fast_us:>7.1f}x "
+                f"{size / drf_us * 1_000_000:>12,.0f} "
+                f"{size / fast_us * 1_000_000:>13,.0f}"
+            )
+
+        cart = {
+            "items": [
+                {
+                    "product_id": pid,
+                    "name": f"Product {pid}",
+                    "price": "9.99",
+                    "quantity": 2,
+                }
+                for pid in range(1, options["cart_items"] + 1)
+            ],
+            "promo_code": "SPRING",
+        }
+        drf_us = measure(lambda: JSONRenderer().render(cart), iterations * 1000)
+        fast_us = measure(lambda: fast_json.dumps(cart), iterations * 1000)
+        self.stdout.write(
+            f"cart of {options['cart_items']} lines: drf {drf_us:.1f} us, "
+            f"fast {fast_us:.1f} us ({drf_us / fast_us:.1f}x)"
+        )
@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cart import redis_cart
+
+
+class Command(BaseCommand):
+    help = (
+        "Move live carts into the layout configured by settings.CART_LAYOUT. "
+        "Walks the keyspace incrementally with SCAN, so it is safe to run "
+        "against a live Redis."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="SCAN COUNT hint and number of carts migrated per pipeline.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.0,
+            help="Seconds to pause between batches to limit load on Redis.",
+        )
+
+    def handle(self, *args, **options):
+        r = redis_cart.r
+        layout = redis_cart.get_layout()
+
+        # split carts show up as cart:{sid}:qty|details|promo_code and compact
+        # carts as cart:{sid}; only carts in the other layout need to move.
+        def needs_migration(parts):
+            if layout == redis_cart.COMPACT:
+                return len(parts) == 3 and parts[2] != "session"
+            return len(parts) == 2
+
+        scanned = migrated = 0
+        cursor = 0
+        while True:
+            cursor, keys = r.scan(cursor, match="cart:*", count=options["batch_size"])
+            scanned += len(keys)
+
+            session_ids = set()
+            for key in keys:
+                parts = key.split(":")
+                if needs_migration(parts):
+                    session_ids.add(parts[1])
+
+            if session_ids:
+                migrated += redis_cart.migrate_carts(session_ids)
+                if options["sleep"]:
+                    time.sleep(options["sleep"])
+
+            if cursor == 0:
+                break
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Scanned {scanned} keys, migrated {migrated} carts to the {layout} layout."
+            )
+        )
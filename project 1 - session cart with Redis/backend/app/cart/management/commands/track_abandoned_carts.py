@@ -0,0 +1,113 @@
+import time
+
+import redis
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from cart import abandoned_carts, redis_cart
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker writing abandoned-cart aggregates (carts, items, value, top "
+        "products) to Postgres from Redis expired-key notifications. Needs "
+        "settings.CART_SHADOW_GRACE, see cart/abandoned_carts.py."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Expired carts processed per pipeline.",
+        )
+        parser.add_argument(
+            "--batch-timeout",
+            type=float,
+            default=1.0,
+            help="Seconds before a partial batch is processed.",
+        )
+        parser.add_argument(
+            "--window",
+            type=float,
+            default=60.0,
+            help="Seconds aggregated into each AbandonedCartWindow row.",
+        )
+        parser.add_argument(
+            "--top",
+            type=int,
+            default=10,
+            help="Products saved per window.",
+        )
+        parser.add_argument(
+            "--configure",
+            action="store_true",
+            help="Enable expired-key events with CONFIG SET notify-keyspace-events.",
+        )
+
+    def handle(self, *args, **options):
+        if not redis_cart.get_shadow_grace():
+            raise CommandError(
+                "settings.CART_SHADOW_GRACE is 0, carts keep no shadow to "
+                "aggregate when they expire."
+            )
+        r = redis_cart.r
+        if options["configure"]:
+            self.enable_notifications(r)
+
+        # no read timeout: the subscription may stay idle for long
+        pubsub_r = settings.REDIS_PUBSUB_CLIENT
+        pubsub = pubsub_r.pubsub(ignore_subscribe_messages=True)
+        channel = abandoned_carts.expired_channel(pubsub_r)
+        pubsub.subscribe(channel)
+        self.stdout.write(f"Listening on {channel}")
+
+        aggregate = abandoned_carts.Aggregate(top_products=options["top"])
+        batch = []
+        now = time.monotonic()
+        batch_deadline = now + options["batch_timeout"]
+        window_deadline = now + options["window"]
+        try:
+            while True:
+                message = pubsub.get_message(
+                    timeout=max(0.0, min(batch_deadline, window_deadline) - now)
+                )
+                if message is not None:
+                    session_id = abandoned_carts.session_id_from_expired_key(
+                        message["data"]
+                    )
+                    if session_id is not None:
+                        batch.append(session_id)
+
+                now = time.monotonic()
+                if len(batch) >= options["batch_size"] or now >= batch_deadline:
+                    if batch:
+                        abandoned_carts.process_batch(batch, aggregate)
+                        batch = []
+                    batch_deadline = now + options["batch_timeout"]
+                if now >= window_deadline:
+                    window = aggregate.save()
+                    if window is not None:
+                        self.stdout.write(str(window))
+                    window_deadline = now + options["window"]
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if batch:
+                abandoned_carts.process_batch(batch, aggregate)
+            aggregate.save()
+            pubsub.close()
+
+    def enable_notifications(self, r):
+        # keep the classes already enabled, add keyevent (E) + expired (x)
+        try:
+            flags = r.config_get("notify-keyspace-events")["notify-keyspace-events"]
+            r.config_set(
+                "notify-keyspace-events", "".join(sorted(set(flags) | set("Ex")))
+            )
+        except redis.ResponseError as exc:
+            # managed Redis services often disable CONFIG
+            raise CommandError(
+                f"Could not enable notifications ({exc}), set "
+                "notify-keyspace-events to include 'Ex' on the server."
+            )
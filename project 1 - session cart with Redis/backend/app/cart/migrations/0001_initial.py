@@ -0,0 +1,58 @@
+# Generated by Django 5.2 on 2026-10-18 10:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="AbandonedCartWindow",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("started_at", models.DateTimeField()),
+                ("ended_at", models.DateTimeField(db_index=True)),
+                ("carts", models.PositiveIntegerField()),
+                ("items", models.PositiveIntegerField()),
+                ("value", models.DecimalField(decimal_places=2, max_digits=14)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="AbandonedCartProduct",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("product_id", models.BigIntegerField()),
+                ("quantity", models.PositiveIntegerField()),
+                ("carts", models.PositiveIntegerField()),
+                (
+                    "window",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="products",
+                        to="cart.abandonedcartwindow",
+                    ),
+                ),
+            ],
+        ),
+    ]
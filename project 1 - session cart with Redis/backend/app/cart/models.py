@@ -1,3 +1,31 @@
 from django.db import models
 
 # Create your models here.
+
+
+class AbandonedCartWindow(models.Model):
+    """Carts that expired with items in them during [started_at, ended_at)."""
+
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField(db_index=True)
+    carts = models.PositiveIntegerField()
+    items = models.PositiveIntegerField()
+    value = models.DecimalField(max_digits=14, decimal_places=2)
+
+    def __str__(self):
+        return f"{self.carts} carts abandoned until {self.ended_at}"
+
+
+class AbandonedCartProduct(models.Model):
+    """One of the most abandoned products of a window."""
+
+    window = models.ForeignKey(
+        AbandonedCartWindow, on_delete=models.CASCADE, related_name="products"
+    )
+    # no foreign key: the product may be gone by the time its cart expires
+    product_id = models.BigIntegerField()
+    quantity = models.PositiveIntegerField()
+    carts = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.product_id} x {self.quantity}"
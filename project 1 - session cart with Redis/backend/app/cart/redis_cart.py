@@ -1,18 +1,91 @@
 # redis_cart.py
-import json
+from typing import NamedTuple, Optional
 
 from django.conf import settings
 
-r = settings.REDIS_CLIENT
+from inventory import product_cache, stock
 
-CART_TTL = 60 * 60  # 30 minutes
-# CART_TTL = 60 * 30  # 30 minutes
+from . import details_codec, lua_scripts
 
+r = settings.REDIS_CLIENT
 
-def _refresh_cart_ttl_pipe(pipe, session_id):
-    pipe.expire(_qty_key(session_id), CART_TTL)
-    pipe.expire(_details_key(session_id), CART_TTL)
-    pipe.expire(f"{_cart_key(session_id)}:promo_code", CART_TTL)
+# Shared by the cart and its session (see session_store.py)
+CART_TTL = settings.SESSION_COOKIE_AGE
+
+# Storage layouts, see lua_scripts.py for the key/field structure of each one
+SPLIT = "split"
+COMPACT = "compact"
+LAYOUTS = (SPLIT, COMPACT)
+
+# Actions accepted by batch_update(), see BATCH_CART in lua_scripts.py
+BATCH_ACTIONS = ("add", "set", "remove", "inc", "dec")
+
+OUT_OF_STOCK = lua_scripts.OUT_OF_STOCK
+
+
+class OutOfStock(Exception):
+    """The product does not have the units a cart line asked for."""
+
+    def __init__(self, product_id):
+        super().__init__(f"Not enough stock for product {product_id}.")
+        self.product_id = product_id
+
+
+# Every mutation below is a Lua script (see lua_scripts.py).
+# register_script() only computes the SHA1 of the script locally. The first call
+# sends EVALSHA; if Redis answers NOSCRIPT (first use, or after a restart /
+# SCRIPT FLUSH) redis-py loads the script with SCRIPT LOAD and retries, so a
+# flushed script cache never surfaces as an error. After that every cart
+# operation is a single atomic EVALSHA round trip.
+_add_to_cart_script = r.register_script(lua_scripts.ADD_TO_CART)
+_remove_from_cart_script = r.register_script(lua_scripts.REMOVE_FROM_CART)
+_change_quantity_script = r.register_script(lua_scripts.CHANGE_QUANTITY)
+_set_quantity_script = r.register_script(lua_scripts.SET_QUANTITY)
+_update_cart_item_script = r.register_script(lua_scripts.UPDATE_CART_ITEM)
+_reconcile_cart_script = r.register_script(lua_scripts.RECONCILE_CART)
+_batch_cart_script = r.register_script(lua_scripts.BATCH_CART)
+_set_promo_code_script = r.register_script(lua_scripts.SET_PROMO_CODE)
+_clear_cart_script = r.register_script(lua_scripts.CLEAR_CART)
+_migrate_cart_script = r.register_script(lua_scripts.MIGRATE_CART)
+_read_cart_script = r.register_script(lua_scripts.READ_CART)
+
+_SCRIPTS = (
+    _add_to_cart_script,
+    _remove_from_cart_script,
+    _change_quantity_script,
+    _set_quantity_script,
+    _update_cart_item_script,
+    _reconcile_cart_script,
+    _batch_cart_script,
+    _set_promo_code_script,
+    _clear_cart_script,
+    _migrate_cart_script,
+    _read_cart_script,
+)
+
+
+def load_scripts(client=None):
+    """SCRIPT LOAD every cart script up front (e.g. on deploy) in one pipeline."""
+    pipe = (client or r).pipeline(transaction=False)
+    for script in _SCRIPTS:
+        pipe.script_load(script.script)
+    return pipe.execute()
+
+
+def get_layout():
+    """Layout new writes go to (settings.CART_LAYOUT)."""
+    layout = getattr(settings, "CART_LAYOUT", SPLIT)
+    if layout not in LAYOUTS:
+        raise ValueError(f"CART_LAYOUT must be one of {LAYOUTS}, got {layout!r}")
+    return layout
+
+
+def _readable_layouts():
+    # During a rollout carts can live in either layout until they are written
+    # again (or migrated by `manage.py migrate_cart_layout`), so read both.
+    if getattr(settings, "CART_READ_BOTH_LAYOUTS", True):
+        return LAYOUTS
+    return (get_layout(),)
 
 
 def _cart_key(session_id):
@@ -27,225 +100,348 @@ def _details_key(session_id):
     return f"{_cart_key(session_id)}:details"
 
 
-def add_to_cart(session_id, product_id, quantity, name, price):
-    qty_key = _qty_key(session_id)
-    details_key = _details_key(session_id)
+def _promo_key(session_id):
+    return f"{_cart_key(session_id)}:promo_code"
 
-    pipe = r.pipeline()
-    pipe.hincrby(qty_key, product_id, quantity)
 
-    if not r.hexists(details_key, product_id):
-        product_data = {
-            "product_id": product_id,
-            "name": name,
-            "price": float(price),
-        }
-        """
-            Redis Hashes Only Store Strings
-            Even in hashes (HSET), both keys and values are stored as strings
-            Redis won’t understand how to serialize or store that Python dict—it needs a string.
-            
-            json.dumps(product_data) turns your dictionary into a JSON string so it can be stored cleanly in Redis.
-            json.dumps(product_data) converts your Python dict to a structured string.
+def _session_key(session_id):
+    # written by the session engine, cart/session_store.py
+    return f"{_cart_key(session_id)}:session"
 
-            This makes your data portable: easy to send over the network, store, and retrieve.
-            When you read it back, you can easily turn it into a dictionary again with json.loads().
-        """
-        pipe.hset(details_key, product_id, json.dumps(product_data))
 
-    _refresh_cart_ttl_pipe(pipe, session_id)
-    pipe.execute()
+def _shadow_key(session_id):
+    # outside the cart:* namespace, it outlives the cart (see abandoned_carts.py)
+    return f"abandoned:shadow:{session_id}"
 
 
-def get_cart(session_id):
-    qtys = r.hgetall(_qty_key(session_id))
-    details = r.hgetall(_details_key(session_id))
+def get_shadow_grace():
+    """
+    Seconds the shadow of a cart outlives it (settings.CART_SHADOW_GRACE),
+    0 when no shadow is written.
+    """
+    return int(getattr(settings, "CART_SHADOW_GRACE", 0))
+
+
+def _data_keys(session_id):
+    # the keys of both layouts
+    return [
+        _qty_key(session_id),
+        _details_key(session_id),
+        _promo_key(session_id),
+        _cart_key(session_id),
+    ]
+
+
+def _cart_keys(session_id):
+    return [
+        *_data_keys(session_id),
+        _shadow_key(session_id),
+        stock.hold_key(session_id),
+        _session_key(session_id),
+    ]
+
+
+def _script_args(*args):
+    return [CART_TTL, get_layout(), get_shadow_grace(), *args]
+
+
+def _check_stock(result, product_id):
+    if result == OUT_OF_STOCK:
+        raise OutOfStock(product_id)
+    return result
+
+
+def _run_script(script, session_id, *args, client=None):
+    # client=r is resolved at call time so the module client can be swapped
+    return script(
+        keys=_cart_keys(session_id),
+        args=_script_args(*args),
+        client=client or r,
+    )
+
+
+def _unpack_compact(fields):
+    qtys, details, promo_code = {}, {}, None
+    for field, value in fields.items():
+        if field.startswith("q:"):
+            qtys[field[2:]] = value
+        elif field.startswith("d:"):
+            details[field[2:]] = value
+        elif field == "promo":
+            promo_code = value
+    return qtys, details, promo_code
+
+
+def _queue_read_cart(pipe, session_id, layouts):
+    if SPLIT in layouts:
+        pipe.hgetall(_qty_key(session_id))
+        pipe.hgetall(_details_key(session_id))
+        pipe.get(_promo_key(session_id))
+    if COMPACT in layouts:
+        pipe.hgetall(_cart_key(session_id))
+
+
+def _unpack_read_cart(results, layouts):
+    qtys, details, promo_code = {}, {}, None
+    if SPLIT in layouts:
+        qtys, details, promo_code = results[:3]
+    if COMPACT in layouts:
+        # A cart only ever exists in one layout; the scripts move it atomically.
+        compact_qtys, compact_details, compact_promo = _unpack_compact(results[-1])
+        qtys.update(compact_qtys)
+        details.update(compact_details)
+        promo_code = promo_code or compact_promo
+    return qtys, details, promo_code
+
+
+def _read_cart(session_id):
+    """
+    Fetch (quantities, details, promo_code) of a cart in one round trip,
+    whichever layout it is stored in.
+    """
+    layouts = _readable_layouts()
+    pipe = r.pipeline(transaction=False)
+    _queue_read_cart(pipe, session_id, layouts)
+    return _unpack_read_cart(pipe.execute(), layouts)
+
+
+def add_to_cart(session_id, product_id, quantity):
+    """
+    Returns the new quantity of the line. Raises OutOfStock, leaving the cart
+    as it was, when the product does not have `quantity` more units.
+    """
+    # only the quantity is stored, name/price come from the product cache
+    return _check_stock(
+        _run_script(_add_to_cart_script, session_id, product_id, quantity),
+        product_id,
+    )
+
+
+class CartItem(NamedTuple):
+    product_id: int
+    name: str
+    price: float
+    quantity: int
+
 
-    cart_items = []
+class CartSnapshot(NamedTuple):
+    items: list
+    promo_code: Optional[str]
 
+    def as_dict(self):
+        """Response body of GET /api/cart/get/."""
+        return {
+            "items": [item._asdict() for item in self.items],
+            "promo_code": self.promo_code,
+        }
+
+
+def get_cart_snapshot(session_id):
+    """
+    Quantities and promo code of a cart joined with the shared product cache
+    in one round trip (READ_CART), whatever the size of the cart. Only
+    products missing from the cache cost a Postgres query and a write back.
+
+    Lines whose product is no longer known fall back to the details copy
+    older versions stored in the cart itself; without one they are skipped
+    (checkout removes them from the cart).
+    """
+    qtys, details, promo_code, products, missing = _unpack_joined_cart(
+        _read_cart_script(keys=_cart_keys(session_id), args=_read_cart_args(), client=r)
+    )
+    products.update(product_cache.load_products(missing))
+    return _build_snapshot(qtys, details, promo_code, products)
+
+
+def _read_cart_args():
+    return [
+        product_cache.INDEX_VERSION_KEY,
+        product_cache.KEY_PREFIX,
+        *product_cache.PRODUCT_FIELDS,
+    ]
+
+
+def _unpack_joined_cart(result):
+    """READ_CART reply -> (qtys, details, promo_code, products, missing)"""
+    qtys, details, promo_code, version, entries = result
+    qtys = _pairs(qtys)
+    products, missing = product_cache.unpack_lookup(
+        [int(pid) for pid in qtys], [version, *entries]
+    )
+    return qtys, _pairs(details), promo_code, products, missing
+
+
+def _build_snapshot(qtys, details, promo_code, products):
+    legacy_pids = [pid for pid in qtys if int(pid) not in products and details.get(pid)]
+    legacy = dict(
+        zip(
+            legacy_pids,
+            details_codec.decode_many([details[pid] for pid in legacy_pids]),
+        )
+    )
+
+    items = []
     for pid, qty in qtys.items():
-        detail_json = details.get(pid)
-        if not detail_json:
-            continue
+        product = products.get(int(pid)) or legacy.get(pid)
+        if product:
+            items.append(
+                CartItem(int(pid), product["name"], product["price"], int(qty))
+            )
+    return CartSnapshot(items, promo_code)
 
-        data = json.loads(detail_json)
-        data["quantity"] = int(qty)
-        cart_items.append(data)
 
-    return cart_items
+def get_cart_quantities(session_id):
+    """{product_id: quantity} of every cart line, in one round trip."""
+    qtys, _, _ = _read_cart(session_id)
+    return _to_quantities(qtys)
 
 
-def remove_from_cart(session_id, product_id):
-    qty_key = _qty_key(session_id)
-    details_key = _details_key(session_id)
-    promo_key = f"{_cart_key(session_id)}:promo_code"
+def _to_quantities(qtys):
+    return {int(pid): int(qty) for pid, qty in qtys.items()}
 
-    pipe = r.pipeline()
-    pipe.hdel(qty_key, product_id)
-    pipe.hdel(details_key, product_id)
 
-    if r.hlen(qty_key) == 0:  # 1 left before deletion
-        pipe.delete(promo_key)
+def get_cart(session_id):
+    return [item._asdict() for item in get_cart_snapshot(session_id).items]
+
 
-    _refresh_cart_ttl_pipe(pipe, session_id)
-    pipe.execute()
+def remove_from_cart(session_id, product_id):
+    # the promo code is dropped together with the last line of the cart
+    return bool(_run_script(_remove_from_cart_script, session_id, product_id))
 
 
 def clear_cart(session_id):
-    pipe = r.pipeline()
-    pipe.delete(_qty_key(session_id))
-    pipe.delete(_details_key(session_id))
-    pipe.delete(f"{_cart_key(session_id)}:promo_code")
-    pipe.execute()
+    _run_script(_clear_cart_script, session_id)
 
 
 def increment_quantity(session_id, product_id, step=1):
-    pipe = r.pipeline()
-    pipe.hincrby(_qty_key(session_id), product_id, step)
-    _refresh_cart_ttl_pipe(pipe, session_id)
-    pipe.execute()
-    return True
+    # False if the product is not in the cart, OutOfStock without the units
+    changed = _run_script(_change_quantity_script, session_id, product_id, step)
+    return _check_stock(changed, product_id) >= 0
 
 
 def decrement_quantity(session_id, product_id, step=1):
     """
-    What .watch(qty_key) Does
-    It monitors the key qty_key for changes by other clients.
-
-    If the key is modified after it's watched (before the transaction with .multi()
-    and .execute() is run), Redis will abort the transaction, and raise a WatchError.
-
-    That’s why your code has a try...except r.WatchError block: if something
-    else updates qty_key, your code will catch the error and retry (up to 5
-    times, as specified by MAX_ATTEMPTS).
-
-    💡 Why It Matters
-    This ensures consistency when multiple clients might be updating the
-    same shopping cart concurrently.
-
-    Without .watch(), two simultaneous updates could read the same quantity
-    and overwrite each other's changes—leading to incorrect final values.
-
-    🧠 Concept Summary
-    It's like saying: “Hey Redis, watch this key—if it changes while I’m
-    calculating what to do, then cancel everything and let me try again.”
-    """
-    qty_key = _qty_key(session_id)
-    details_key = _details_key(session_id)
-
-    MAX_ATTEMPTS = 5
-
-    for attempt in range(MAX_ATTEMPTS):
-        try:
-            with r.pipeline() as pipe:
-                pipe.watch(qty_key)
-
-                # Use direct client method (not through pipe)
-                current_qty = r.hget(qty_key, product_id)
-                if current_qty is None:
-                    pipe.unwatch()
-                    return False
-
-                current_qty = int(current_qty)
-                new_qty = current_qty - step
-
-                """
-                Role of pipe.multi() and pipe.execute()
-                
-                pipe.multi():
-                This method marks the start of a Redis transaction in the pipeline (pipe).
-                It tells Redis to queue all subsequent commands (e.g., pipe.hset, pipe.hdel,
-                _refresh_cart_ttl_pipe) without executing them immediately.
-                These queued commands are held until pipe.execute() is called, ensuring
-                they are executed as a single, atomic unit.
-                
-                pipe.execute():
-                This method sends all the queued commands (from the multi block) to Redis for execution.
-                Redis executes these commands atomically, meaning:
-                All commands are executed sequentially without interruption by other clients.
-                Either all commands succeed or none are applied (e.g., if an error like 
-                WatchError occurs).
-                If the qty_key being watched (via pipe.watch(qty_key)) was modified by another client
-                before execute is called, Redis raises a WatchError, and no commands in the transaction are applied.
-                """
-                pipe.multi()
-
-                if new_qty < 1:
-                    pipe.hdel(qty_key, product_id)
-                    pipe.hdel(details_key, product_id)
-                else:
-                    pipe.hset(qty_key, product_id, new_qty)
-
-                _refresh_cart_ttl_pipe(pipe, session_id)
-                pipe.execute()
-                return True
-
-        except r.WatchError:
-            continue
-
-
-# def decrement_quantity(session_id, product_id, step=1):
-#     qty_key = _qty_key(session_id)
-#     details_key = _details_key(session_id)
-
-#     # First, decrement and get new quantity
-#     new_qty = r.hincrby(qty_key, product_id, -step)
-
-#     if new_qty < 1:
-#         # Quantity too low, clean up
-#         pipe = r.pipeline()
-#         pipe.hdel(qty_key, product_id)
-#         pipe.hdel(details_key, product_id)
-#         _refresh_cart_ttl_pipe(pipe, session_id)
-#         pipe.execute()
-#     else:
-#         # Just refresh TTL
-#         pipe = r.pipeline()
-#         _refresh_cart_ttl_pipe(session_id)
-#         pipe.execute()
-
-#     return True
+    The old implementation used WATCH/MULTI: read the quantity, compute the
+    new one in Python and retry (up to 5 times) whenever another client
+    touched the cart in between. That costs 2+ round trips per attempt.
+
+    The script reads, decrements and (below 1) removes the line inside Redis,
+    where no other command can interleave, so it needs no retries.
+
+    Returns False if the product is not in the cart.
+    """
+    return _run_script(_change_quantity_script, session_id, product_id, -step) >= 0
 
 
 def set_quantity(session_id, product_id, quantity):
-    key = _cart_key(session_id)
-    existing = r.hget(key, product_id)
+    # False: Nothing to update; OutOfStock when raising it lacks the units
+    updated = _run_script(_set_quantity_script, session_id, product_id, quantity)
+    return bool(_check_stock(updated, product_id))
 
-    if not existing:
-        return False  # Nothing to update
 
-    data = json.loads(existing)
-    data["quantity"] = quantity
-    r.hset(key, product_id, json.dumps(data))
+def set_cart_promo_code(session_id, promo_code):
+    _run_script(_set_promo_code_script, session_id, promo_code)
 
-    pipe = r.pipeline()
-    _refresh_cart_ttl_pipe(pipe, session_id)
-    pipe.execute()
 
-    return True
+def get_cart_promo_code(session_id):
+    pipe = r.pipeline(transaction=False)
+    _queue_read_promo_code(pipe, session_id)
+    return _first_promo_code(pipe.execute())
 
 
-def set_cart_promo_code(session_id, promo_code):
-    pipe = r.pipeline()
-    pipe.set(f"{_cart_key(session_id)}:promo_code", promo_code)
-    _refresh_cart_ttl_pipe(pipe, session_id)
-    pipe.execute()
+def _queue_read_promo_code(pipe, session_id):
+    layouts = _readable_layouts()
+    if SPLIT in layouts:
+        pipe.get(_promo_key(session_id))
+    if COMPACT in layouts:
+        pipe.hget(_cart_key(session_id), "promo")
 
 
-def get_cart_promo_code(session_id):
-    key = f"cart:{session_id}:promo_code"
-    return r.get(key)
-
-
-def update_cart_item(session_id, product_id, name, price, quantity):
-    pipe = r.pipeline()
-    details = {
-        "product_id": product_id,
-        "name": name,
-        "price": float(price),
-    }
-
-    pipe.hset(_details_key(session_id), product_id, json.dumps(details))
-    pipe.hset(_qty_key(session_id), product_id, quantity)
-    _refresh_cart_ttl_pipe(pipe, session_id)
-    pipe.execute()
+def _first_promo_code(results):
+    return next((code for code in results if code is not None), None)
+
+
+def update_cart_item(session_id, product_id, quantity):
+    _check_stock(
+        _run_script(_update_cart_item_script, session_id, product_id, quantity),
+        product_id,
+    )
+
+
+def reconcile_cart(session_id, removals=(), updates=None):
+    """
+    Apply all checkout fixes to a cart atomically in one round trip:
+    remove every product in `removals` and set the quantities given in
+    `updates` ({product_id: quantity}). Returns the number of changed lines.
+    """
+    args = _reconcile_args(removals, updates)
+    if args is None:
+        return 0
+    return _run_script(_reconcile_cart_script, session_id, *args)
+
+
+def _reconcile_args(removals, updates):
+    """RECONCILE_CART arguments, None when there is nothing to change."""
+    removals = list(removals)
+    updates = updates or {}
+    if not removals and not updates:
+        return None
+
+    args = [len(removals), *removals]
+    for product_id, quantity in updates.items():
+        args += [product_id, quantity]
+    return args
+
+
+class BatchResult(NamedTuple):
+    # new quantity of the line after each action, 0 when it was removed,
+    # -1 when the product was not in the cart and OUT_OF_STOCK when the
+    # product lacked the units
+    results: list
+    snapshot: CartSnapshot
+
+
+def batch_update(session_id, operations):
+    """
+    Apply (action, product_id, quantity) operations, in order, in one
+    atomic script that also returns the resulting cart; the product join
+    is a second round trip, whatever the number of operations.
+    """
+    results, *cart = _run_script(
+        _batch_cart_script, session_id, *_batch_args(operations)
+    )
+    qtys, details, promo_code = _unpack_batch_cart(cart)
+    products = product_cache.get_products(qtys)
+    return BatchResult(results, _build_snapshot(qtys, details, promo_code, products))
+
+
+def _batch_args(operations):
+    args = []
+    for action, product_id, quantity in operations:
+        if action not in BATCH_ACTIONS:
+            raise ValueError(f"action must be one of {BATCH_ACTIONS}, got {action!r}")
+        args += [action, product_id, quantity]
+    return args
+
+
+def _pairs(flat):
+    return dict(zip(flat[::2], flat[1::2]))
+
+
+def _unpack_batch_cart(cart):
+    # the script moved the cart into the active layout and read it from there
+    if get_layout() == COMPACT:
+        return _unpack_compact(_pairs(cart[0]))
+    qtys, details, promo_code = cart
+    return _pairs(qtys), _pairs(details), promo_code
+
+
+def migrate_carts(session_ids, client=None):
+    """
+    Move the given carts into the configured layout, one pipeline (a single
+    round trip) for the whole batch. Returns how many carts were moved.
+    """
+    pipe = (client or r).pipeline(transaction=False)
+    for session_id in session_ids:
+        _run_script(_migrate_cart_script, session_id, client=pipe)
+    return sum(pipe.execute())
@@ -0,0 +1,73 @@
+from typing import List, Literal, Optional
+
+from ninja import Field, Schema
+
+# Ninja counterparts of serializers.py for the async cart API (api.py),
+# with the same fields, defaults and limits.
+
+
+class CartItemOut(Schema):
+    product_id: int
+    name: str
+    price: float
+    quantity: int
+
+
+class CartOut(Schema):
+    items: List[CartItemOut]
+    promo_code: Optional[str]
+
+
+class AddToCartIn(Schema):
+    product_id: int
+    # Accepted for older clients but ignored: name and price come from the
+    # shared product cache.
+    name: Optional[str] = None
+    price: Optional[float] = None
+    quantity: int = Field(1, ge=1)
+
+
+class RemoveFromCartIn(Schema):
+    product_id: int
+
+
+class UpdateQuantityIn(Schema):
+    product_id: int
+    action: Literal["inc", "dec"] = "inc"
+
+
+class SetQuantityIn(Schema):
+    product_id: int
+    quantity: int = Field(..., ge=1)
+
+
+class CartPromoIn(Schema):
+    promo_code: str = Field(..., max_length=200)
+
+
+class CartBatchOperationIn(Schema):
+    action: Literal["add", "set", "remove", "inc", "dec"]
+    product_id: int
+    # ignored by "remove"
+    quantity: int = Field(1, ge=1)
+
+
+class CartBatchIn(Schema):
+    operations: List[CartBatchOperationIn] = Field(..., min_length=1, max_length=500)
+
+
+class CartBatchOut(CartOut):
+    results: List[int]
+
+
+class CheckoutItemOut(CartItemOut):
+    valid: bool
+    error: str
+
+
+class MessageOut(Schema):
+    message: str
+
+
+class ErrorOut(Schema):
+    error: str
@@ -1,5 +1,7 @@
 from rest_framework import serializers
 
+from .redis_cart import BATCH_ACTIONS
+
 
 class CartItemSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
@@ -10,8 +12,10 @@ class CartItemSerializer(serializers.Serializer):
 
 class AddToCartSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
-    name = serializers.CharField()
-    price = serializers.FloatField()
+    # Accepted for older clients but ignored: name and price come from the
+    # shared product cache.
+    name = serializers.CharField(required=False)
+    price = serializers.FloatField(required=False)
     quantity = serializers.IntegerField(min_value=1, default=1)
 
 
@@ -33,6 +37,25 @@ class CartPromoSerializer(serializers.Serializer):
     promo_code = serializers.CharField(max_length=200)
 
 
+class CartBatchOperationSerializer(serializers.Serializer):
+    action = serializers.ChoiceField(choices=BATCH_ACTIONS)
+    product_id = serializers.IntegerField()
+    # ignored by "remove"
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartBatchOperationSerializer(
+        many=True, allow_empty=False, max_length=500
+    )
+
+
+class CartBatchResponseSerializer(serializers.Serializer):
+    results = serializers.ListField(child=serializers.IntegerField())
+    items = CartItemSerializer(many=True)
+    promo_code = serializers.CharField(allow_null=True)
+
+
 class CheckoutResponseItemSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
     name = serializers.CharField()
@@ -0,0 +1,134 @@
+# session_store.py
+"""
+Session engine (settings.SESSION_ENGINE = "cart.session_store") keeping the
+session next to the cart it belongs to:
+
+    cart:{session_key}:session    string  signed session data
+
+The session and its cart share one TTL (redis_cart.CART_TTL, which is
+SESSION_COOKIE_AGE): every cart script refreshes the session key along with
+the cart keys, and every session save refreshes the cart keys in the same
+round trip, so neither outlives the other. A session saved with a custom
+set_expiry() stores the cart with that expiry too, until the next cart write
+brings both back to CART_TTL. Cart requests never read session state from
+Postgres.
+"""
+
+import time
+
+from django.contrib.sessions.backends.base import CreateError, SessionBase, UpdateError
+
+from inventory import stock
+
+from . import async_redis_cart, redis_cart
+
+
+class SessionStore(SessionBase):
+    def _queue_save(self, pipe, session_key, data, must_create):
+        ttl = max(self.get_expiry_age(), 1)
+        pipe.set(
+            redis_cart._session_key(session_key),
+            self.encode(data),
+            ex=ttl,
+            nx=must_create,
+            xx=not must_create,
+        )
+        # the cart expires with its session, whichever layout it is in
+        for key in redis_cart._data_keys(session_key):
+            pipe.expire(key, ttl)
+        # and so do the units it holds, if any (xx: never creates an entry)
+        pipe.zadd(
+            stock.HOLDS_KEY,
+            {stock.hold_key(session_key): (time.time() + ttl) * 1000},
+            xx=True,
+        )
+        grace = redis_cart.get_shadow_grace()
+        if grace:
+            pipe.expire(redis_cart._shadow_key(session_key), ttl + grace)
+
+    def _check_saved(self, saved, must_create):
+        if not saved:
+            raise CreateError if must_create else UpdateError
+
+    def load(self):
+        data = self.session_key and redis_cart.r.get(
+            redis_cart._session_key(self.session_key)
+        )
+        if not data:
+            self._session_key = None
+            return {}
+        return self.decode(data)
+
+    async def aload(self):
+        data = self.session_key and await async_redis_cart.r.get(
+            redis_cart._session_key(self.session_key)
+        )
+        if not data:
+            self._session_key = None
+            return {}
+        return self.decode(data)
+
+    def create(self):
+        while True:
+            self._session_key = self._get_new_session_key()
+            try:
+                self.save(must_create=True)
+            except CreateError:
+                continue  # key collision
+            self.modified = True
+            return
+
+    async def acreate(self):
+        while True:
+            self._session_key = await self._aget_new_session_key()
+            try:
+                await self.asave(must_create=True)
+            except CreateError:
+                continue
+            self.modified = True
+            return
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        pipe = redis_cart.r.pipeline()
+        self._queue_save(pipe, self.session_key, data, must_create)
+        self._check_saved(pipe.execute()[0], must_create)
+
+    async def asave(self, must_create=False):
+        if self.session_key is None:
+            return await self.acreate()
+        data = await self._aget_session(no_load=must_create)
+        async with async_redis_cart.r.pipeline() as pipe:
+            self._queue_save(pipe, self.session_key, data, must_create)
+            results = await pipe.execute()
+        self._check_saved(results[0], must_create)
+
+    def exists(self, session_key):
+        return bool(session_key) and bool(
+            redis_cart.r.exists(redis_cart._session_key(session_key))
+        )
+
+    async def aexists(self, session_key):
+        return bool(session_key) and bool(
+            await async_redis_cart.r.exists(redis_cart._session_key(session_key))
+        )
+
+    def delete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if session_key is not None:
+            redis_cart.r.delete(redis_cart._session_key(session_key))
+
+    async def adelete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if session_key is not None:
+            await async_redis_cart.r.delete(redis_cart._session_key(session_key))
+
+    @classmethod
+    def clear_expired(cls):
+        pass  # Redis expires the keys itself
+
+    @classmethod
+    async def aclear_expired(cls):
+        pass
@@ -1,3 +1,940 @@
-from django.test import TestCase
+import json
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, override_settings
+from ninja.testing import TestAsyncClient
+from redis.client import Pipeline
+from rest_framework.test import APIRequestFactory
+
+from inventory import local_cache, product_cache, stock
+
+from . import (
+    abandoned_carts,
+    async_redis_cart,
+    redis_cart,
+    session_store,
+    views,
+)
+from .api import api
+from .management.commands import bench_cart_read
+from .models import AbandonedCartProduct, AbandonedCartWindow
+
+
+class RedisCartTestCase(SimpleTestCase):
+    """Runs redis_cart against an in-process Redis stand-in (fakeredis + Lua)."""
+
+    session_id = "test-session"
+
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+        # asyncio client on the same data, for async_redis_cart
+        self.async_redis = fakeredis.FakeAsyncRedis(
+            server=server, decode_responses=True
+        )
+        for patcher in (
+            mock.patch.object(redis_cart, "r", self.redis),
+            mock.patch.object(product_cache, "r", self.redis),
+            mock.patch.object(stock, "r", self.redis),
+            mock.patch.object(async_redis_cart, "r", self.async_redis),
+            mock.patch.object(product_cache, "ar", self.async_redis),
+            # products that are not cached do not exist
+            mock.patch.object(product_cache, "_fetch_from_db", return_value=[]),
+            mock.patch.object(product_cache, "_afetch_from_db", return_value=[]),
+            mock.patch.object(local_cache, "_ensure_listener", return_value=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        product_cache.mark_index_built()
+        local_cache.cache.clear()
+        self.addCleanup(local_cache.cache.clear)
+
+    def count_round_trips(self):
+        """Patch the client so every command / pipeline sent to Redis is counted."""
+        calls = []
+        original = self.redis.execute_command
+        pipeline_execute = Pipeline.execute
+
+        def execute_command(*args, **kwargs):
+            calls.append(args[0])
+            return original(*args, **kwargs)
+
+        def execute_pipeline(pipe, *args, **kwargs):
+            calls.append("PIPELINE")
+            return pipeline_execute(pipe, *args, **kwargs)
+
+        for patcher in (
+            mock.patch.object(self.redis, "execute_command", execute_command),
+            mock.patch.object(Pipeline, "execute", execute_pipeline),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return calls
+
+    def add(self, product_id, quantity=1, name=None, price=10):
+        product_cache.cache_products(
+            [(product_id, name or f"product {product_id}", price, True)]
+        )
+        redis_cart.add_to_cart(
+            self.session_id, product_id=product_id, quantity=quantity
+        )
+
+    def quantities(self):
+        return {
+            item["product_id"]: item["quantity"]
+            for item in redis_cart.get_cart(self.session_id)
+        }
+
+
+class CartScriptTests(RedisCartTestCase):
+    def test_add_accumulates_quantity(self):
+        self.add(1, 2, name="Phone", price=100)
+        self.add(1, 3, name="Phone", price=100)
+
+        self.assertEqual(
+            redis_cart.get_cart(self.session_id),
+            [{"product_id": 1, "name": "Phone", "price": 100.0, "quantity": 5}],
+        )
+
+    def test_details_come_from_the_shared_product_cache(self):
+        self.add(1, name="Phone", price=100)
+
+        product_cache.cache_products([(1, "Phone X", "89.90", True)])
+
+        self.assertEqual(
+            redis_cart.get_cart(self.session_id),
+            [{"product_id": 1, "name": "Phone X", "price": 89.9, "quantity": 1}],
+        )
+
+    def test_lines_of_unknown_products_are_skipped(self):
+        self.add(1)
+        redis_cart.add_to_cart(self.session_id, 2, 1)
+
+        self.assertEqual(self.quantities(), {1: 1})
+
+    def test_mutations_refresh_ttl(self):
+        self.add(1)
+        redis_cart.set_cart_promo_code(self.session_id, "SALE")
+        for key in self.redis.keys("cart:*"):
+            self.redis.expire(key, 5)
+
+        redis_cart.increment_quantity(self.session_id, 1)
+
+        for key in self.redis.keys("cart:*"):
+            self.assertGreater(self.redis.ttl(key), redis_cart.CART_TTL - 5)
+
+    def test_increment_and_decrement(self):
+        self.add(1, 2)
+
+        self.assertTrue(redis_cart.increment_quantity(self.session_id, 1))
+        self.assertEqual(self.quantities(), {1: 3})
+
+        self.assertTrue(redis_cart.decrement_quantity(self.session_id, 1, step=2))
+        self.assertEqual(self.quantities(), {1: 1})
+
+    def test_decrement_below_one_removes_line(self):
+        self.add(1)
+
+        self.assertTrue(redis_cart.decrement_quantity(self.session_id, 1))
+
+        self.assertEqual(redis_cart.get_cart(self.session_id), [])
+        self.assertEqual(self.redis.keys("cart:*"), [])
+
+    def test_quantity_changes_on_missing_product(self):
+        self.assertFalse(redis_cart.increment_quantity(self.session_id, 99))
+        self.assertFalse(redis_cart.decrement_quantity(self.session_id, 99))
+        self.assertFalse(redis_cart.set_quantity(self.session_id, 99, 3))
+        self.assertEqual(self.redis.keys("cart:*"), [])
+
+    def test_batch_update_applies_operations_in_order(self):
+        self.add(1, 2, name="Phone", price=100)
+        self.add(2)
+        product_cache.cache_products([(3, "Case", 5, True)])
+        redis_cart.set_cart_promo_code(self.session_id, "SALE")
+
+        result = redis_cart.batch_update(
+            self.session_id,
+            [
+                ("add", 3, 2),
+                ("inc", 1, 3),
+                ("dec", 3, 1),
+                ("set", 1, 4),
+                ("remove", 2, 1),
+                ("set", 9, 1),
+                ("dec", 9, 1),
+            ],
+        )
+
+        self.assertEqual(result.results, [2, 5, 1, 4, 0, -1, -1])
+        self.assertEqual(
+            result.snapshot,
+            redis_cart.CartSnapshot(
+                [
+                    redis_cart.CartItem(1, "Phone", 100.0, 4),
+                    redis_cart.CartItem(3, "Case", 5.0, 1),
+                ],
+                "SALE",
+            ),
+        )
+        self.assertEqual(result.snapshot, redis_cart.get_cart_snapshot(self.session_id))
+
+    def test_batch_update_costs_two_round_trips(self):
+        redis_cart.load_scripts(self.redis)
+        product_cache.cache_products(
+            (pid, f"product {pid}", 1, True) for pid in range(50)
+        )
+        calls = self.count_round_trips()
+
+        redis_cart.batch_update(self.session_id, [("add", pid, 1) for pid in range(50)])
+
+        # the script, then the product join
+        self.assertEqual(calls, ["EVALSHA", "PIPELINE"])
+
+    def test_set_quantity(self):
+        self.add(1)
+
+        self.assertTrue(redis_cart.set_quantity(self.session_id, 1, 7))
+        self.assertEqual(self.quantities(), {1: 7})
+
+    def test_removing_last_item_drops_promo_code(self):
+        self.add(1)
+        self.add(2)
+        redis_cart.set_cart_promo_code(self.session_id, "SALE")
+
+        self.assertTrue(redis_cart.remove_from_cart(self.session_id, 1))
+        self.assertEqual(redis_cart.get_cart_promo_code(self.session_id), "SALE")
+
+        self.assertTrue(redis_cart.remove_from_cart(self.session_id, 2))
+        self.assertIsNone(redis_cart.get_cart_promo_code(self.session_id))
+        self.assertFalse(redis_cart.remove_from_cart(self.session_id, 2))
+
+    def test_update_cart_item_sets_quantity(self):
+        self.add(1, 2, name="Phone", price=100)
+
+        redis_cart.update_cart_item(self.session_id, 1, 4)
+
+        self.assertEqual(self.quantities(), {1: 4})
+
+    def test_clear_cart(self):
+        self.add(1)
+        redis_cart.set_cart_promo_code(self.session_id, "SALE")
+
+        redis_cart.clear_cart(self.session_id)
+
+        self.assertEqual(self.redis.keys("cart:*"), [])
+
+    def test_each_mutation_is_one_round_trip(self):
+        redis_cart.load_scripts(self.redis)
+        self.add(1)
+        calls = self.count_round_trips()
+
+        redis_cart.add_to_cart(self.session_id, 1, 1)
+        redis_cart.increment_quantity(self.session_id, 1)
+        redis_cart.decrement_quantity(self.session_id, 1)
+        redis_cart.set_quantity(self.session_id, 1, 3)
+        redis_cart.update_cart_item(self.session_id, 1, 2)
+        redis_cart.remove_from_cart(self.session_id, 1)
+        redis_cart.clear_cart(self.session_id)
+
+        self.assertEqual(calls, ["EVALSHA"] * 7)
+
+    def test_script_cache_flush_falls_back_to_script_load(self):
+        self.add(1)
+        self.redis.script_flush()
+
+        self.add(1)
+
+        self.assertEqual(self.quantities(), {1: 2})
+
+    def test_snapshot_is_one_round_trip(self):
+        self.add(1, 2, name="Phone", price=100)
+        self.add(2, 1, name="Case", price=5)
+        redis_cart.set_cart_promo_code(self.session_id, "SALE")
+        redis_cart.load_scripts(self.redis)
+        calls = self.count_round_trips()
+
+        snapshot = redis_cart.get_cart_snapshot(self.session_id)
+
+        # cart read and product cache join, whatever the number of lines
+        self.assertEqual(calls, ["EVALSHA"])
+        self.assertEqual(
+            snapshot,
+            redis_cart.CartSnapshot(
+                items=[
+                    redis_cart.CartItem(1, "Phone", 100.0, 2),
+                    redis_cart.CartItem(2, "Case", 5.0, 1),
+                ],
+                promo_code="SALE",
+            ),
+        )
+        self.assertEqual(snapshot.as_dict()["items"][0]["quantity"], 2)
+
+    def test_unknown_products_are_looked_up_once(self):
+        redis_cart.add_to_cart(self.session_id, product_id=404, quantity=1)
+
+        for _ in range(2):
+            snapshot = redis_cart.get_cart_snapshot(self.session_id)
+
+        self.assertEqual(snapshot.items, [])
+        product_cache._fetch_from_db.assert_called_once_with([404])
+        self.assertEqual(
+            self.redis.hget("product:404", "is_active"), product_cache.MISSING
+        )
+
+    def test_snapshot_of_empty_cart(self):
+        self.assertEqual(
+            redis_cart.get_cart_snapshot(self.session_id).as_dict(),
+            {"items": [], "promo_code": None},
+        )
+
+    def test_reconcile_cart(self):
+        for pid in (1, 2, 3):
+            self.add(pid, 2)
+        redis_cart.set_cart_promo_code(self.session_id, "SALE")
+
+        changed = redis_cart.reconcile_cart(
+            self.session_id, removals=[1, 99], updates={2: 5, 98: 1}
+        )
+
+        self.assertEqual(changed, 2)
+        self.assertEqual(self.quantities(), {2: 5, 3: 2})
+
+        redis_cart.reconcile_cart(self.session_id, removals=[2, 3])
+        self.assertEqual(self.redis.keys("cart:*"), [])
+
+
+@override_settings(CART_LAYOUT=redis_cart.COMPACT)
+class CompactCartScriptTests(CartScriptTests):
+    """Same behaviour with the whole cart stored in one cart:{sid} hash."""
+
+    def test_cart_is_a_single_hash(self):
+        self.add(1)
+        redis_cart.set_cart_promo_code(self.session_id, "SALE")
+
+        self.assertEqual(self.redis.keys("cart:*"), [f"cart:{self.session_id}"])
+        self.assertEqual(
+            set(self.redis.hkeys(f"cart:{self.session_id}")), {"q:1", "promo"}
+        )
+
+
+class LegacyDetailsTests(RedisCartTestCase):
+    def test_legacy_details_stay_readable(self):
+        # carts written before the product cache kept their own details copy
+        for pid in (1, 2):
+            redis_cart.add_to_cart(self.session_id, pid, 1)
+            details = {"product_id": pid, "name": f"Café {pid}", "price": pid}
+            self.redis.hset(
+                redis_cart._details_key(self.session_id), pid, json.dumps(details)
+            )
+
+        self.assertEqual(
+            redis_cart.get_cart(self.session_id),
+            [
+                {"product_id": 1, "name": "Café 1", "price": 1, "quantity": 1},
+                {"product_id": 2, "name": "Café 2", "price": 2, "quantity": 1},
+            ],
+        )
+
+
+class CartCheckoutTests(RedisCartTestCase):
+    def checkout(self):
+        request = APIRequestFactory().post("/api/cart/checkout/")
+        request.session = SimpleNamespace(session_key=self.session_id)
+        return views.CartCheckoutView.as_view()(request)
+
+    def fill_cart(self, size):
+        """Cart of `size` lines; odd products were deactivated, even ones repriced."""
+        for pid in range(1, size + 1):
+            self.add(pid, name=f"product {pid}", price=10)
+        product_cache.cache_products(
+            (pid, f"product {pid}", Decimal("12"), pid % 2 == 0)
+            for pid in range(1, size + 1)
+        )
+
+    def test_checkout_response(self):
+        self.fill_cart(4)
+
+        response = self.checkout()
+
+        self.assertEqual(
+            response.data,
+            [
+                {
+                    "product_id": pid,
+                    "name": f"product {pid}",
+                    "price": 12.0,
+                    "quantity": 1,
+                    "valid": True,
+                    "error": "",
+                }
+                for pid in (2, 4)
+            ],
+        )
+        self.assertEqual(self.quantities(), {2: 1, 4: 1})
+
+    def test_fast_json_path_returns_the_same_body(self):
+        self.fill_cart(4)
+        default = self.checkout()
+        default.render()
+
+        with override_settings(FAST_JSON_RESPONSES=True):
+            fast = self.checkout()
+
+        self.assertEqual(fast["Content-Type"], "application/json")
+        self.assertEqual(json.loads(fast.content), json.loads(default.content))
+
+    def test_missing_index_falls_back_to_postgres(self):
+        self.fill_cart(2)
+        self.redis.delete(product_cache.INDEX_VERSION_KEY)
+
+        with mock.patch.object(
+            product_cache,
+            "_fetch_from_db",
+            return_value=[(2, "product 2", Decimal("15"), True)],
+        ) as fetch:
+            response = self.checkout()
+
+        fetch.assert_called_once_with([1, 2])
+        self.assertEqual([item["price"] for item in response.data], [15.0])
+        self.assertEqual(
+            self.redis.hgetall(redis_cart._qty_key(self.session_id)), {"2": "1"}
+        )
+
+    def test_round_trips_do_not_grow_with_cart_size(self):
+        redis_cart.load_scripts(self.redis)
+        calls = self.count_round_trips()
+        round_trips = []
+        for size in (2, 40):
+            self.redis.flushall()
+            product_cache.mark_index_built()
+            self.fill_cart(size)
+            calls.clear()
+
+            self.checkout()
+
+            round_trips.append(len(calls))
+
+        self.assertEqual(round_trips[0], round_trips[1])
+        # cart read + price/availability index + reconcile
+        self.assertEqual(round_trips[0], 3)
+
+    def test_products_cached_in_the_worker_skip_redis(self):
+        self.fill_cart(4)
+        self.checkout()
+        calls = self.count_round_trips()
+
+        response = self.checkout()
+
+        # only the cart read: product data came from local memory and the
+        # first checkout already removed the inactive lines
+        self.assertEqual(calls, ["PIPELINE"])
+        self.assertEqual([item["product_id"] for item in response.data], [2, 4])
+
+
+class UpdateQuantityViewTests(RedisCartTestCase):
+    def update(self, payload):
+        request = APIRequestFactory().post(
+            "/api/cart/increment/", payload, format="json"
+        )
+        request.session = SimpleNamespace(session_key=self.session_id)
+        return views.UpdateQuantityView.as_view()(request)
+
+    def test_only_inc_and_dec_are_accepted(self):
+        self.add(1, 2)
+
+        self.assertEqual(self.update({"product_id": 1}).status_code, 200)
+        self.assertEqual(
+            self.update({"product_id": 1, "action": "dec"}).status_code, 200
+        )
+        response = self.update({"product_id": 1, "action": "remove"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("action", response.data)
+        self.assertEqual(self.quantities(), {1: 2})
+
+
+class CartBatchViewTests(RedisCartTestCase):
+    def batch(self, payload):
+        request = APIRequestFactory().post("/api/cart/batch/", payload, format="json")
+        request.session = SimpleNamespace(session_key=self.session_id)
+        return views.CartBatchView.as_view()(request)
+
+    def test_batch_view(self):
+        product_cache.cache_products([(1, "Phone", 100, True)])
+
+        response = self.batch(
+            {
+                "operations": [
+                    {"action": "add", "product_id": 1, "quantity": 2},
+                    {"action": "remove", "product_id": 2},
+                ]
+            }
+        )
+
+        self.assertEqual(
+            response.data,
+            {
+                "results": [2, -1],
+                "items": [
+                    {"product_id": 1, "name": "Phone", "price": 100.0, "quantity": 2}
+                ],
+                "promo_code": None,
+            },
+        )
+
+    def test_batch_view_rejects_the_whole_batch_on_one_bad_operation(self):
+        response = self.batch(
+            {
+                "operations": [
+                    {"action": "add", "product_id": 1},
+                    {"action": "explode", "product_id": 1},
+                ]
+            }
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.redis.keys("cart:*"), [])
+
+
+class AsyncCartTests(RedisCartTestCase):
+    # one client: ninja refuses to build the URLs of an API twice
+    api_client = TestAsyncClient(api)
+
+    def setUp(self):
+        super().setUp()
+        self.session = SimpleNamespace(session_key=self.session_id)
+
+    async def test_async_module_shares_carts_with_the_sync_one(self):
+        self.add(1, 2, name="Phone", price=100)
+
+        await async_redis_cart.add_to_cart(self.session_id, 1, 3)
+        await async_redis_cart.set_cart_promo_code(self.session_id, "SALE")
+
+        self.assertEqual(
+            redis_cart.get_cart_snapshot(self.session_id),
+            await async_redis_cart.get_cart_snapshot(self.session_id),
+        )
+        self.assertEqual(self.quantities(), {1: 5})
+        self.assertTrue(await async_redis_cart.decrement_quantity(self.session_id, 1))
+        self.assertFalse(await async_redis_cart.set_quantity(self.session_id, 2, 1))
+        self.assertEqual(
+            await async_redis_cart.get_cart_promo_code(self.session_id), "SALE"
+        )
+
+    async def test_api_contract(self):
+        product_cache.cache_products([(1, "Phone", 100, True)])
+
+        response = await self.api_client.post(
+            "/add/", json={"product_id": 1, "quantity": 2}, session=self.session
+        )
+        self.assertEqual(response.json(), {"message": "Added to cart."})
+
+        response = await self.api_client.get("/get/", session=self.session)
+        self.assertEqual(
+            response.json(),
+            {
+                "items": [
+                    {"product_id": 1, "name": "Phone", "price": 100.0, "quantity": 2}
+                ],
+                "promo_code": None,
+            },
+        )
+
+        response = await self.api_client.post(
+            "/update/qty/", json={"product_id": 9, "quantity": 1}, session=self.session
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {"error": "Product not found in cart."})
+
+        response = await self.api_client.post(
+            "/update/qty/", json={"product_id": 1, "quantity": 0}, session=self.session
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()), ["quantity"])
+
+    async def test_checkout_removes_inactive_products(self):
+        self.add(1)
+        self.add(2)
+        product_cache.cache_products([(1, "Phone", 100, False)])
+
+        response = await self.api_client.post("/checkout/", session=self.session)
+
+        self.assertEqual(
+            response.json(),
+            [
+                {
+                    "product_id": 2,
+                    "name": "product 2",
+                    "price": 10.0,
+                    "quantity": 1,
+                    "valid": True,
+                    "error": "",
+                }
+            ],
+        )
+        self.assertEqual(self.quantities(), {2: 1})
+
+
+class SessionStoreTests(RedisCartTestCase):
+    def test_session_is_stored_next_to_the_cart(self):
+        session = session_store.SessionStore()
+        session["step"] = "shipping"
+        session.save()
+
+        self.assertEqual(
+            self.redis.ttl(f"cart:{session.session_key}:session"),
+            settings.SESSION_COOKIE_AGE,
+        )
+        self.assertEqual(
+            session_store.SessionStore(session.session_key)["step"], "shipping"
+        )
+
+    def test_cart_writes_and_session_saves_share_one_ttl(self):
+        session = session_store.SessionStore()
+        session.create()
+        self.session_id = session.session_key
+        self.add(1)
+        redis_cart.set_cart_promo_code(self.session_id, "SALE")
+
+        # a cart write refreshes the session with the cart
+        for key in self.redis.keys("cart:*"):
+            self.redis.expire(key, 5)
+        redis_cart.increment_quantity(self.session_id, 1)
+        for key in self.redis.keys("cart:*"):
+            self.assertEqual(self.redis.ttl(key), redis_cart.CART_TTL, key)
+
+        # and a session save refreshes the cart with the session
+        for key in self.redis.keys("cart:*"):
+            self.redis.expire(key, 5)
+        session["seen"] = True
+        session.save()
+        for key in self.redis.keys("cart:*"):
+            self.assertEqual(self.redis.ttl(key), redis_cart.CART_TTL, key)
+
+    def test_clearing_the_cart_keeps_the_session(self):
+        session = session_store.SessionStore()
+        session.create()
+        self.session_id = session.session_key
+        self.add(1)
+
+        redis_cart.clear_cart(self.session_id)
+
+        self.assertTrue(session.exists(self.session_id))
+
+    def test_expired_session_cannot_be_updated(self):
+        session = session_store.SessionStore()
+        session.create()
+        self.redis.delete(f"cart:{session.session_key}:session")
+
+        session["key"] = "value"
+        with self.assertRaises(session_store.UpdateError):
+            session.save()
+
+    async def test_async_session_api(self):
+        session = session_store.SessionStore()
+        await session.acreate()
+        await session.aset("step", "payment")
+        await session.asave()
+
+        loaded = session_store.SessionStore(session.session_key)
+        self.assertEqual(await loaded.aget("step"), "payment")
+        self.assertTrue(await loaded.aexists(session.session_key))
+
+
+class CartLayoutMigrationTests(RedisCartTestCase):
+    def fill_split_cart(self, session_id):
+        with override_settings(CART_LAYOUT=redis_cart.SPLIT):
+            product_cache.cache_products([(1, "Phone", 100, True)])
+            redis_cart.add_to_cart(session_id, 1, 2)
+            redis_cart.set_cart_promo_code(session_id, "SALE")
+
+    @override_settings(CART_LAYOUT=redis_cart.COMPACT)
+    def test_both_layouts_are_readable_during_rollout(self):
+        self.fill_split_cart(self.session_id)
+
+        self.assertEqual(self.quantities(), {1: 2})
+        self.assertEqual(redis_cart.get_cart_promo_code(self.session_id), "SALE")
+
+    @override_settings(CART_LAYOUT=redis_cart.COMPACT)
+    def test_write_moves_cart_to_configured_layout(self):
+        self.fill_split_cart(self.session_id)
+
+        self.add(1)
+
+        self.assertEqual(self.redis.keys("cart:*"), [f"cart:{self.session_id}"])
+        self.assertEqual(self.quantities(), {1: 3})
+        self.assertEqual(redis_cart.get_cart_promo_code(self.session_id), "SALE")
+
+    @override_settings(CART_LAYOUT=redis_cart.COMPACT)
+    def test_migrate_cart_layout_command(self):
+        for i in range(5):
+            self.fill_split_cart(f"sid{i}")
+        for key in self.redis.keys("cart:sid0:*"):
+            self.redis.expire(key, 100)
+
+        call_command("migrate_cart_layout", batch_size=2, stdout=mock.Mock())
+
+        self.assertEqual(
+            sorted(self.redis.keys("cart:*")), [f"cart:sid{i}" for i in range(5)]
+        )
+        self.assertLessEqual(self.redis.ttl("cart:sid0"), 100)
+
+        with override_settings(CART_LAYOUT=redis_cart.SPLIT):
+            call_command("migrate_cart_layout", stdout=mock.Mock())
+        self.assertEqual(
+            sorted(self.redis.keys("cart:sid0:*")),
+            ["cart:sid0:promo_code", "cart:sid0:qty"],
+        )
+
+    @override_settings(CART_LAYOUT=redis_cart.COMPACT)
+    def test_moved_cart_keeps_the_longest_ttl(self):
+        with override_settings(CART_LAYOUT=redis_cart.SPLIT):
+            redis_cart.set_cart_promo_code("promo-only", "SALE")
+            self.fill_split_cart("no-ttl")
+        self.redis.persist("cart:no-ttl:qty")
+        self.redis.persist("cart:no-ttl:promo_code")
+        self.redis.expire("cart:promo-only:promo_code", 100)
+
+        call_command("migrate_cart_layout", stdout=mock.Mock())
+
+        self.assertTrue(0 < self.redis.ttl("cart:promo-only") <= 100)
+        self.assertEqual(self.redis.ttl("cart:no-ttl"), redis_cart.CART_TTL)
+
+
+@override_settings(CART_SHADOW_GRACE=600)
+class AbandonedCartTests(RedisCartTestCase):
+    shadow_key = f"abandoned:shadow:{RedisCartTestCase.session_id}"
+
+    def test_shadow_mirrors_the_cart_lines(self):
+        self.add(1, 2)
+        self.add(2)
+        redis_cart.decrement_quantity(self.session_id, 1)
+        redis_cart.remove_from_cart(self.session_id, 2)
+
+        self.assertEqual(self.redis.hgetall(self.shadow_key), {"1": "1"})
+        self.assertEqual(self.redis.ttl(self.shadow_key), redis_cart.CART_TTL + 600)
+
+        redis_cart.clear_cart(self.session_id)
+        self.assertFalse(self.redis.exists(self.shadow_key))
+
+    @override_settings(CART_SHADOW_GRACE=0)
+    def test_no_shadow_when_disabled(self):
+        self.add(1)
+
+        self.assertFalse(self.redis.exists(self.shadow_key))
+
+    def test_expired_keys_map_to_their_cart(self):
+        parse = abandoned_carts.session_id_from_expired_key
+        self.assertEqual(parse("cart:abc:qty"), "abc")
+        self.assertEqual(parse("cart:abc"), "abc")
+        self.assertIsNone(parse("cart:abc:details"))
+        self.assertIsNone(parse("cart:abc:session"))
+        self.assertIsNone(parse("product:1"))
+
+    def test_batches_are_aggregated_and_saved(self):
+        self.add(1, 2, price="9.99")
+        self.add(2, price=5)
+        self.session_id = "other-session"
+        self.add(1, price="9.99")
+        self.redis.delete(*self.redis.keys("cart:*"))  # as if they expired
+
+        clock = mock.Mock(return_value="now")
+        aggregate = abandoned_carts.Aggregate(top_products=1, clock=clock)
+        processed = abandoned_carts.process_batch(
+            ["test-session", "other-session", "never-had-items"], aggregate
+        )
+
+        self.assertEqual(processed, 2)
+        self.assertEqual(self.redis.keys("abandoned:*"), [])
+        self.assertEqual(
+            (aggregate.carts, aggregate.items, aggregate.value),
+            (2, 4, Decimal("34.97")),
+        )
+        self.assertEqual(aggregate.top(), [(1, 3, 2)])
+
+        with mock.patch.object(abandoned_carts, "transaction"), mock.patch.object(
+            AbandonedCartWindow.objects,
+            "create",
+            return_value=AbandonedCartWindow(pk=1),
+        ) as create, mock.patch.object(
+            AbandonedCartProduct.objects, "bulk_create"
+        ) as bulk_create:
+            aggregate.save()
+
+        create.assert_called_once_with(
+            started_at="now", ended_at="now", carts=2, items=4, value=Decimal("34.97")
+        )
+        [row] = bulk_create.call_args.args[0]
+        self.assertEqual((row.product_id, row.quantity, row.carts), (1, 3, 2))
+        self.assertEqual(aggregate.carts, 0)
+
+
+class StockReservationTests(RedisCartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.sync([(1, 5, None)], [1, 2])
+
+    def sync(self, rows, product_ids=(1,)):
+        with mock.patch.object(stock, "_read_stock", return_value=rows):
+            return stock.sync_products(product_ids)
+
+    def write_back(self, created=True):
+        written = stock.StockWriteBack(pk=1)
+        with mock.patch.object(stock, "transaction"), mock.patch.object(
+            stock.StockWriteBack.objects,
+            "get_or_create",
+            return_value=(written, created),
+        ) as get_or_create, mock.patch.object(
+            stock.StockWriteBack.objects, "exclude"
+        ), mock.patch.object(
+            stock.Product.objects, "filter"
+        ) as product_filter:
+            deltas = stock.write_back()
+        return deltas, get_or_create.call_args.kwargs["batch"], product_filter
+
+    def available(self, product_id=1):
+        return stock.get_available([product_id]).get(product_id)
+
+    def held(self, session_id=None):
+        return self.redis.hgetall(stock.hold_key(session_id or self.session_id))
+
+    def test_adds_reserve_stock_until_it_runs_out(self):
+        self.add(1, 3)
+        self.assertEqual(self.available(), 2)
+        self.assertEqual(self.held(), {"1": "3"})
+        self.assertEqual(self.redis.hget(stock.DELTAS_KEY, "1"), "-3")
+
+        with self.assertRaises(redis_cart.OutOfStock):
+            self.add(1, 3)
+        self.assertEqual(self.quantities(), {1: 3})
+        self.assertEqual(self.available(), 2)
+
+        with self.assertRaises(redis_cart.OutOfStock):
+            redis_cart.set_quantity(self.session_id, 1, 6)
+        self.assertTrue(redis_cart.set_quantity(self.session_id, 1, 5))
+        self.assertEqual(self.available(), 0)
+
+    def test_lowering_a_line_releases_stock(self):
+        self.add(1, 4)
+        redis_cart.decrement_quantity(self.session_id, 1, step=2)
+        self.assertEqual(self.available(), 3)
+
+        redis_cart.remove_from_cart(self.session_id, 1)
+        self.assertEqual(self.available(), 5)
+        self.assertEqual(self.held(), {})
+        self.assertEqual(self.redis.zcard(stock.HOLDS_KEY), 0)
+
+        self.add(1, 4)
+        redis_cart.clear_cart(self.session_id)
+        self.assertEqual(self.available(), 5)
+
+    def test_untracked_products_are_unlimited(self):
+        self.add(2, 1000)
+
+        self.assertIsNone(self.available(2))
+        self.assertEqual(self.held(), {})
+
+    def test_holds_expire_with_the_cart(self):
+        self.add(1, 5)
+        expiry = self.redis.zscore(stock.HOLDS_KEY, stock.hold_key(self.session_id))
+        self.assertAlmostEqual(
+            expiry / 1000, time.time() + redis_cart.CART_TTL, delta=5
+        )
+
+        # the cart expired: the next add that runs short takes its units back
+        self.redis.zadd(stock.HOLDS_KEY, {stock.hold_key(self.session_id): 0})
+        self.session_id = "other-session"
+        self.add(1, 2)
+        self.assertEqual(self.available(), 3)
+        self.assertEqual(self.held("test-session"), {})
+
+    def test_periodic_reclaim_and_write_back(self):
+        self.add(1, 2)
+        self.redis.zadd(stock.HOLDS_KEY, {stock.hold_key(self.session_id): 0})
+        self.session_id = "other-session"
+        self.add(1, 1)
+
+        self.assertEqual(stock.reclaim_expired(chunk_size=1), 1)
+        self.assertEqual(self.available(), 4)
+
+        deltas, batch, product_filter = self.write_back()
+        self.assertEqual(deltas, {1: -1})
+        product_filter.assert_called_once_with(pk__in=[1])
+        self.assertFalse(
+            self.redis.exists(stock.DELTAS_KEY, stock.FLUSHING_KEY, stock.BATCH_KEY)
+        )
+        self.assertEqual(self.redis.get(stock.WRITTEN_KEY), batch)
+
+        # Product.stock is now 4: resyncing keeps the counter
+        self.assertEqual(self.sync([(1, 4, batch)]), {1: 4})
+        self.assertEqual(self.available(), 4)
+
+    def test_a_batch_already_written_is_only_cleared(self):
+        self.add(1, 2)
+        # the previous write-back died after its commit
+        self.redis.rename(stock.DELTAS_KEY, stock.FLUSHING_KEY)
+        self.redis.set(stock.BATCH_KEY, "b1")
+        self.add(1, 1)
+
+        # Product.stock (3) has b1 in it: only the newer delta is pending
+        self.assertEqual(self.sync([(1, 3, "b1")]), {1: 2})
+
+        deltas, batch, product_filter = self.write_back(created=False)
+        self.assertEqual((deltas, batch), ({1: -2}, "b1"))
+        product_filter.assert_not_called()
+        self.assertFalse(self.redis.exists(stock.FLUSHING_KEY, stock.BATCH_KEY))
+        self.assertEqual(self.redis.hgetall(stock.DELTAS_KEY), {"1": "-1"})
+
+    def test_sync_rereads_a_stock_older_than_the_last_write_back(self):
+        self.add(1, 2)
+        _, batch, _ = self.write_back()
+
+        with mock.patch.object(
+            stock, "_read_stock", side_effect=[[(1, 5, None)], [(1, 3, batch)]]
+        ) as read:
+            self.assertEqual(stock.sync_products([1]), {1: 3})
+        self.assertEqual(read.call_count, 2)
+        self.assertEqual(self.available(), 3)
+
+    def test_batch_skips_operations_without_stock(self):
+        result = redis_cart.batch_update(
+            self.session_id, [("add", 1, 4), ("inc", 1, 2), ("add", 2, 9)]
+        )
+
+        self.assertEqual(result.results, [4, redis_cart.OUT_OF_STOCK, 9])
+        self.assertEqual(self.available(), 1)
+
+    def test_add_view_answers_409_without_stock(self):
+        request = APIRequestFactory().post(
+            "/api/cart/add/", {"product_id": 1, "quantity": 6}, format="json"
+        )
+        request.session = mock.Mock(session_key=self.session_id)
+
+        response = views.AddToCartView.as_view()(request)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.quantities(), {})
+
+
+class BenchCartReadTests(RedisCartTestCase):
+    def test_bench_leaves_no_keys_behind(self):
+        call_command(
+            "bench_cart_read", "--items=3", "--iterations=1", stdout=mock.Mock()
+        )
+
+        self.assertEqual(self.redis.keys("*"), [product_cache.INDEX_VERSION_KEY])
+
+    def test_mismatching_reads_fail_and_are_cleaned_up(self):
+        with mock.patch.object(
+            bench_cart_read, "snapshot_read", return_value={"items": []}
+        ):
+            with self.assertRaises(CommandError):
+                call_command("bench_cart_read", "--items=3", stdout=mock.Mock())
+
+        self.assertEqual(self.redis.keys("*"), [product_cache.INDEX_VERSION_KEY])
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 
 from .views import (
@@ -8,6 +9,7 @@ from .views import (
     SetQuantityView,
     CartPromoView,
     CartCheckoutView,
+    CartBatchView,
 )
 
 urlpatterns = [
@@ -18,4 +20,11 @@ urlpatterns = [
     path("update/qty/", SetQuantityView.as_view()),
     path("promo/", CartPromoView.as_view()),
     path("checkout/", CartCheckoutView.as_view()),
+    path("batch/", CartBatchView.as_view()),
 ]
+
+if settings.CART_ASYNC_API:
+    # same routes on the async Ninja API (api.py), served under ASGI
+    from .api import api
+
+    urlpatterns = [path("", api.urls)]
@@ -1,6 +1,7 @@
 from . import redis_cart
+from core import fast_json
 from drf_spectacular.utils import extend_schema
-from inventory.models import Product
+from inventory import local_cache
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -12,10 +13,45 @@ from .serializers import (
     UpdateQuantitySerializer,
     SetQuantitySerializer,
     CartPromoSerializer,
+    CartBatchSerializer,
+    CartBatchResponseSerializer,
     CheckoutResponseItemSerializer,
 )
 
 
+def check_cart_lines(quantities, product_map):
+    """
+    Split cart lines into checkout items (name/price from `product_map`) and
+    the product ids to remove: deleted or deactivated products.
+    """
+    cleaned_cart = []
+    removals = []
+
+    for product_id, quantity in quantities.items():
+        product = product_map.get(product_id)
+
+        if not product or not product["is_active"]:
+            removals.append(product_id)
+            continue
+
+        cleaned_cart.append(
+            {
+                "product_id": product_id,
+                "name": product["name"],
+                "price": product["price"],
+                "quantity": quantity,
+                "valid": True,
+                "error": "",
+            }
+        )
+
+    return cleaned_cart, removals
+
+
+def out_of_stock_response():
+    return Response({"error": "Not enough stock."}, status=status.HTTP_409_CONFLICT)
+
+
 class CartView(APIView):
     @extend_schema(
         responses={200: CartItemSerializer(many=True)},
@@ -23,12 +59,10 @@ class CartView(APIView):
     )
     def get(self, request):
         session_id = request.session.session_key
-        cart_data = redis_cart.get_cart(session_id)
-        promo_code = redis_cart.get_cart_promo_code(session_id)
+        # cart lines joined with the product cache in one Redis round trip
+        snapshot = redis_cart.get_cart_snapshot(session_id)
 
-        return Response(
-            {"items": cart_data, "promo_code": promo_code},
-        )
+        return fast_json.json_response(snapshot.as_dict())
 
     def delete(self, request):
         session_id = request.session.session_key
@@ -40,7 +74,7 @@ class AddToCartView(APIView):
     @extend_schema(
         request=AddToCartSerializer,
         responses={200: None},
-        description="Add a product to the cart. Product data is sent from client.",
+        description="Add a product to the cart. Name and price are taken from the product catalog.",
     )
     def post(self, request):
         if not request.session.session_key:
@@ -52,13 +86,14 @@ class AddToCartView(APIView):
 
         data = serializer.validated_data
 
-        redis_cart.add_to_cart(
-            session_id,
-            product_id=data["product_id"],
-            quantity=data["quantity"],
-            name=data["name"],
-            price=data["price"],
-        )
+        try:
+            redis_cart.add_to_cart(
+                session_id,
+                product_id=data["product_id"],
+                quantity=data["quantity"],
+            )
+        except redis_cart.OutOfStock:
+            return out_of_stock_response()
 
         return Response({"message": "Added to cart."}, status=status.HTTP_200_OK)
 
@@ -89,11 +124,17 @@ class UpdateQuantityView(APIView):
     )
     def post(self, request):
         session_id = request.session.session_key
-        product_id = request.data.get("product_id")
-        action = request.data.get("action", "inc")  # "inc" or "dec"
+
+        serializer = UpdateQuantitySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        product_id = serializer.validated_data["product_id"]
+        action = serializer.validated_data["action"]
 
         if action == "inc":
-            redis_cart.increment_quantity(session_id, product_id)
+            try:
+                redis_cart.increment_quantity(session_id, product_id)
+            except redis_cart.OutOfStock:
+                return out_of_stock_response()
         else:
             redis_cart.decrement_quantity(session_id, product_id)
 
@@ -114,7 +155,10 @@ class SetQuantityView(APIView):
         product_id = serializer.validated_data["product_id"]
         quantity = serializer.validated_data["quantity"]
 
-        updated = redis_cart.set_quantity(session_id, product_id, quantity)
+        try:
+            updated = redis_cart.set_quantity(session_id, product_id, quantity)
+        except redis_cart.OutOfStock:
+            return out_of_stock_response()
 
         if not updated:
             return Response({"error": "Product not found in cart."}, status=404)
@@ -122,6 +166,34 @@ class SetQuantityView(APIView):
         return Response({"message": f"Quantity updated to {quantity}"})
 
 
+class CartBatchView(APIView):
+    @extend_schema(
+        request=CartBatchSerializer,
+        responses={200: CartBatchResponseSerializer},
+        description="Apply a list of add/set/remove/inc/dec operations atomically and return the resulting cart. "
+        "results[i] is the new quantity of the line after operation i, -1 if the product was not in the cart, "
+        "-2 if the product did not have the units (the operation was skipped).",
+    )
+    def post(self, request):
+        if not request.session.session_key:
+            request.session.create()
+        session_id = request.session.session_key
+
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        operations = [
+            (op["action"], op["product_id"], op["quantity"])
+            for op in serializer.validated_data["operations"]
+        ]
+        # ✅ every operation in one atomic script, whatever the list size
+        result = redis_cart.batch_update(session_id, operations)
+
+        return fast_json.json_response(
+            {"results": result.results, **result.snapshot.as_dict()}
+        )
+
+
 class CartPromoView(APIView):
     @extend_schema(
         request=CartPromoSerializer,
@@ -147,43 +219,20 @@ class CartCheckoutView(APIView):
     )
     def post(self, request):
         session_id = request.session.session_key
-        cart_items = redis_cart.get_cart(session_id)
-
-        if not cart_items:
-            return Response([])
-
-        product_ids = [item["product_id"] for item in cart_items]
-
-        # ✅ Single DB hit: get all products that are still active
-        products = Product.objects.filter(id__in=product_ids, is_active=True)
-        product_map = {product.id: product for product in products}
-
-        cleaned_cart = []
-
-        for item in cart_items:
-            product_id = item["product_id"]
-            product = product_map.get(product_id)
-
-            if not product:
-                redis_cart.remove_from_cart(session_id, product_id)
-                continue
-
-            # Check if Redis-stored name/price differs
-            if item["name"] != product.name or float(item["price"]) != float(
-                product.price
-            ):
-                redis_cart.update_cart_item(
-                    session_id,
-                    product_id,
-                    product.name,
-                    product.price,
-                    item["quantity"],
-                )
-                item["name"] = product.name
-                item["price"] = float(product.price)
-
-            item["valid"] = True
-            item["error"] = ""
-            cleaned_cart.append(item)
-
-        return Response(cleaned_cart)
+        # quantities only: lines of deleted products are not dropped yet
+        quantities = redis_cart.get_cart_quantities(session_id)
+
+        if not quantities:
+            return fast_json.json_response([])
+
+        # ✅ Products cached in this worker are not fetched at all; the rest
+        # come from the price/availability index in one Redis round trip
+        # (Postgres is only read if the index is missing or stale)
+        product_map = local_cache.get_products(quantities)
+
+        cleaned_cart, removals = check_cart_lines(quantities, product_map)
+
+        # all cart fixes in one atomic round trip, whatever the cart size
+        redis_cart.reconcile_cart(session_id, removals=removals)
+
+        return fast_json.json_response(cleaned_cart)
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# the cart routes are served by the async API under ASGI (see cart/urls.py)
+os.environ.setdefault('CART_ASYNC_API', '1')
 
 application = get_asgi_application()
@@ -0,0 +1,60 @@
+# fast_json.py
+"""
+Opt-in fast path for JSON responses (settings.FAST_JSON_RESPONSES, off by
+default).
+
+When enabled, the product list and cart views build plain dicts (from
+`.values()` instead of ProductSerializer) and encode them with orjson into
+a bare HttpResponse, skipping DRF's per-field serializers, content
+negotiation and JSONRenderer. Decimals are written as strings, like DRF's
+DecimalField does; prices read from their numeric(10, 2) column already
+carry two decimal places, so both paths return the same JSON. Compare them
+with `python manage.py bench_serialization`.
+
+orjson is an optional dependency, required only when the setting is on.
+"""
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+def enabled():
+    if not getattr(settings, "FAST_JSON_RESPONSES", False):
+        return False
+    if orjson is None:
+        raise ImproperlyConfigured("FAST_JSON_RESPONSES requires the orjson package.")
+    return True
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(data):
+    return orjson.dumps(data, default=_default)
+
+
+def render(data):
+    """JSON bytes of `data`, with orjson when the fast path is on."""
+    if enabled():
+        return dumps(data)
+    return JSONRenderer().render(data)
+
+
+def json_response(data, status=200):
+    """A DRF Response, or with the fast path on an HttpResponse of orjson bytes."""
+    if enabled():
+        return HttpResponse(dumps(data), content_type="application/json", status=status)
+    return Response(data, status=status)
@@ -0,0 +1,215 @@
+# redis_client.py
+"""
+Factory for the Redis clients in settings: a BlockingConnectionPool of
+`max_connections` (a command waits up to `pool_timeout` seconds for a free
+connection, then raises ConnectionError("No connection available.")),
+`socket_timeout` / `socket_connect_timeout`, a PING health check after
+`health_check_interval` idle seconds, and `retries` attempts with backoff on
+connection errors and timeouts. The async client is one client per running
+event loop, closed when asyncio.run() shuts that loop down.
+
+stats() returns the counters of every pool built here. This module is kept
+identical in both projects (core/ and A_core/).
+"""
+
+import asyncio
+import contextlib
+import threading
+import time
+import weakref
+
+import redis
+import redis.asyncio
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import ExponentialBackoff
+from redis.commands.core import AsyncScript
+from redis.retry import Retry
+
+DEFAULTS = {
+    "max_connections": 50,
+    "pool_timeout": 5,
+    "socket_timeout": 2,
+    "socket_connect_timeout": 2,
+    "retries": 3,
+    "health_check_interval": 30,
+}
+RETRIED_ERRORS = (redis.ConnectionError, redis.TimeoutError)
+
+COUNTERS = (
+    "checkouts",
+    "pool_wait_seconds",
+    "pool_timeouts",
+    "in_use_connections",
+    "reconnects",
+)
+_counts = dict.fromkeys(COUNTERS, 0)
+_lock = threading.Lock()
+
+
+def stats():
+    """Pool wait time, in-use connections and reconnects, process-wide."""
+    with _lock:
+        return dict(_counts)
+
+
+def reset_stats():
+    with _lock:
+        _counts.update(dict.fromkeys(COUNTERS, 0))
+
+
+def _count(**counts):
+    with _lock:
+        for name, value in counts.items():
+            _counts[name] += value
+
+
+@contextlib.contextmanager
+def _checkout():
+    start = time.perf_counter()
+    try:
+        yield
+    except redis.ConnectionError as exc:
+        # raised by the pools when no connection was released in time
+        if str(exc) == "No connection available.":
+            _count(pool_wait_seconds=time.perf_counter() - start, pool_timeouts=1)
+        raise
+    _count(
+        pool_wait_seconds=time.perf_counter() - start, checkouts=1, in_use_connections=1
+    )
+
+
+def _release(connection):
+    # connections that failed to connect during a checkout are released too,
+    # those were never counted as in use
+    if getattr(connection, "_checked_out", False):
+        connection._checked_out = False
+        _count(in_use_connections=-1)
+
+
+class InstrumentedConnection(redis.Connection):
+    def on_connect(self):
+        super().on_connect()
+        _count(reconnects=int(getattr(self, "_has_connected", False)))
+        self._has_connected = True
+
+
+class InstrumentedBlockingConnectionPool(redis.BlockingConnectionPool):
+    def get_connection(self, *args, **kwargs):
+        with _checkout():
+            connection = super().get_connection(*args, **kwargs)
+        connection._checked_out = True
+        return connection
+
+    def release(self, connection):
+        _release(connection)
+        super().release(connection)
+
+
+class AsyncInstrumentedConnection(redis.asyncio.Connection):
+    async def on_connect(self):
+        await super().on_connect()
+        _count(reconnects=int(getattr(self, "_has_connected", False)))
+        self._has_connected = True
+
+
+class AsyncInstrumentedBlockingConnectionPool(redis.asyncio.BlockingConnectionPool):
+    async def get_connection(self, *args, **kwargs):
+        with _checkout():
+            connection = await super().get_connection(*args, **kwargs)
+        connection._checked_out = True
+        return connection
+
+    async def release(self, connection):
+        _release(connection)
+        await super().release(connection)
+
+
+def _pool_kwargs(options, retry_class, connection_class):
+    options = {**DEFAULTS, **options}
+    backoff = ExponentialBackoff(cap=1, base=0.05)
+    retry = retry_class(backoff, options.pop("retries"), RETRIED_ERRORS)
+    timeout = options.pop("pool_timeout")
+    return {
+        **options,
+        "timeout": timeout,
+        "connection_class": connection_class,
+        "retry": retry,
+        "retry_on_error": list(RETRIED_ERRORS),
+    }
+
+
+def create_redis_client(**options):
+    """
+    redis.Redis on an instrumented BlockingConnectionPool. Takes the usual
+    connection arguments (host, port, db, decode_responses, ...) plus the
+    DEFAULTS keys.
+    """
+    pool = InstrumentedBlockingConnectionPool(
+        **_pool_kwargs(options, Retry, InstrumentedConnection)
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+def _create_async_client(options):
+    pool = AsyncInstrumentedBlockingConnectionPool(
+        **_pool_kwargs(options, AsyncRetry, AsyncInstrumentedConnection)
+    )
+    # owns its pool: aclose() disconnects it
+    return redis.asyncio.Redis.from_pool(pool)
+
+
+def _close_with_running_loop(client):
+    # asyncio.run() (uvicorn, asgiref) closes the async generators of a loop
+    # before closing it: step this one to its yield now, so its finally runs
+    # on that loop then. The caller keeps it referenced.
+    async def closer():
+        try:
+            yield
+        finally:
+            await client.aclose()
+
+    generator = closer()
+    with contextlib.suppress(StopIteration):
+        generator.asend(None).send(None)
+    return generator
+
+
+class LoopLocalRedis:
+    """
+    Stand-in for a redis.asyncio.Redis that forwards every call to a client
+    of the running event loop, created on first use, so several loops (ASGI
+    plus async_to_sync calls, tests) never share connections.
+    """
+
+    def __init__(self, options):
+        self._options = options
+        self._clients = weakref.WeakKeyDictionary()  # loop -> (client, closer)
+        # never connected: only provides the encoder for register_script()
+        self._template = _create_async_client(options)
+
+    def client(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._clients:
+            # a loop only gets here from its own thread, no lock needed
+            client = _create_async_client(self._options)
+            self._clients[loop] = (client, _close_with_running_loop(client))
+        return self._clients[loop][0]
+
+    def register_script(self, script):
+        # registered at import time, outside of any loop; calls go through
+        # this proxy to the client of the calling loop
+        registered = AsyncScript(self._template, script)
+        registered.registered_client = self
+        return registered
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            # lookups about the proxy itself (copy, pickle, Django's settings
+            # wrapper), possibly outside a loop
+            raise AttributeError(name)
+        return getattr(self.client(), name)
+
+
+def create_async_redis_client(**options):
+    """Per-event-loop redis.asyncio client, same options as create_redis_client()."""
+    return LoopLocalRedis(options)
@@ -10,8 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
-import redis
+
+from core.redis_client import create_async_redis_client, create_redis_client
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -39,6 +41,7 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "inventory",
+    "cart",
     # Thirs-party apps
     "rest_framework",
     "drf_spectacular",
@@ -101,13 +104,94 @@ REDIS_PORT = 6379
 REDIS_DB = 0
 REDIS_DECODE_RESPONSES = True
 
-REDIS_CLIENT = redis.Redis(
+# Connection pool, timeouts, retries and health checks of the clients, see
+# core/redis_client.py. Commands wait up to REDIS_POOL_TIMEOUT seconds for a
+# free connection once all REDIS_MAX_CONNECTIONS are in use.
+REDIS_POOL_OPTIONS = {
+    "max_connections": 50,
+    "pool_timeout": 5,
+    "socket_timeout": 2,
+    "socket_connect_timeout": 2,
+    "retries": 3,
+    "health_check_interval": 30,
+}
+
+REDIS_CLIENT = create_redis_client(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    decode_responses=REDIS_DECODE_RESPONSES,
+    **REDIS_POOL_OPTIONS,
+)
+
+# Same server for the async cart API (cart/api.py). One client is created per
+# event loop, on first use.
+ASYNC_REDIS_CLIENT = create_async_redis_client(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    decode_responses=REDIS_DECODE_RESPONSES,
+    **REDIS_POOL_OPTIONS,
+)
+
+# Subscribers (inventory/local_cache.py invalidations, the expired-key
+# events of track_abandoned_carts): no read timeout, they wait for messages
+REDIS_PUBSUB_CLIENT = create_redis_client(
     host=REDIS_HOST,
     port=REDIS_PORT,
     db=REDIS_DB,
     decode_responses=REDIS_DECODE_RESPONSES,
+    **{**REDIS_POOL_OPTIONS, "socket_timeout": None},
 )
 
+# Sessions live in Redis next to the cart (cart:{sid}:session) and expire
+# with it: SESSION_COOKIE_AGE is also the cart TTL, and every cart write or
+# session save refreshes both, see cart/session_store.py
+SESSION_ENGINE = "cart.session_store"
+SESSION_COOKIE_AGE = 60 * 60
+# an active admin or auth session slides forward instead of ending an hour
+# after login
+SESSION_SAVE_EVERY_REQUEST = True
+
+# Serve the cart routes with the async Ninja API (cart/api.py) instead of the
+# DRF views. core/asgi.py turns it on; the sync views stay on WSGI.
+CART_ASYNC_API = os.environ.get("CART_ASYNC_API") == "1"
+
+# How carts are stored in Redis (see cart/lua_scripts.py):
+# "split"   -> cart:{sid}:qty, cart:{sid}:details and cart:{sid}:promo_code
+# "compact" -> a single cart:{sid} hash, one key and one EXPIRE per cart
+CART_LAYOUT = "split"
+# Read carts from both layouts while switching CART_LAYOUT. Carts move to the
+# new layout on their next write or with `python manage.py migrate_cart_layout`.
+CART_READ_BOTH_LAYOUTS = True
+# Keep a {product_id: quantity} shadow of every cart this many seconds longer
+# than the cart, for the abandoned-cart worker
+# (`python manage.py track_abandoned_carts`). 0 writes no shadows.
+CART_SHADOW_GRACE = 0
+
+# Per-worker LRU cache of products in front of the Redis index
+# (inventory/local_cache.py), invalidated over Redis pub/sub. The TTL bounds
+# staleness for writes that bypass the Product signals.
+PRODUCT_LOCAL_CACHE_SIZE = 10_000
+PRODUCT_LOCAL_CACHE_TTL = 60
+
+# GET /api/products/?page_size=n&cursor=... pages through the catalog by id;
+# ?stream=1 streams the whole list, reading PRODUCT_LIST_STREAM_CHUNK_SIZE
+# rows per database round trip.
+PRODUCT_LIST_PAGE_SIZE = 100
+PRODUCT_LIST_MAX_PAGE_SIZE = 1000
+PRODUCT_LIST_STREAM_CHUNK_SIZE = 2000
+# Rendered product list pages are cached in Redis under the catalog version
+# (inventory/response_cache.py); bodies of old versions expire after this.
+CATALOG_RESPONSE_CACHE_TTL = 60 * 60
+# GET /api/products/suggest/?q=...&limit=n answers type-ahead from the Redis
+# autocomplete index (inventory/search_index.py).
+PRODUCT_SUGGEST_LIMIT = 10
+PRODUCT_SUGGEST_MAX_LIMIT = 50
+# Encode the product list and cart responses with orjson from plain dicts
+# instead of DRF serializers and renderer (core/fast_json.py, needs orjson).
+FAST_JSON_RESPONSES = False
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -0,0 +1,104 @@
+import threading
+from unittest import mock
+
+import fakeredis
+import redis
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase
+
+from . import redis_client
+
+
+class RedisClientFactoryTests(SimpleTestCase):
+    """Runs the clients against fakeredis served over a real TCP socket."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = fakeredis.TcpFakeServer(("127.0.0.1", 0))
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.host, cls.port = cls.server.server_address
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        redis_client.reset_stats()
+
+    def create_client(self, **options):
+        client = redis_client.create_redis_client(
+            host=self.host, port=self.port, decode_responses=True, **options
+        )
+        self.addCleanup(client.close)
+        return client
+
+    def test_commands_check_connections_in_and_out(self):
+        client = self.create_client()
+
+        client.set("key", "value")
+        self.assertEqual(client.get("key"), "value")
+
+        stats = redis_client.stats()
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["in_use_connections"], 0)
+        self.assertEqual(stats["reconnects"], 0)
+
+    def test_exhausted_pool_times_out(self):
+        client = self.create_client(max_connections=1, pool_timeout=0.05)
+        connection = client.connection_pool.get_connection("PING")
+        self.assertEqual(redis_client.stats()["in_use_connections"], 1)
+
+        with self.assertRaisesMessage(redis.ConnectionError, "No connection"):
+            client.ping()
+
+        stats = redis_client.stats()
+        self.assertEqual(stats["pool_timeouts"], 1)
+        self.assertGreaterEqual(stats["pool_wait_seconds"], 0.05)
+        client.connection_pool.release(connection)
+        self.assertEqual(redis_client.stats()["in_use_connections"], 0)
+
+    def test_reconnects_are_counted(self):
+        client = self.create_client()
+        client.ping()
+        for connection in client.connection_pool._connections:
+            connection.disconnect()
+
+        client.ping()
+
+        self.assertEqual(redis_client.stats()["reconnects"], 1)
+
+    def test_connection_errors_and_timeouts_are_retried(self):
+        client = self.create_client(retries=2)
+
+        for error in (redis.TimeoutError, redis.ConnectionError):
+            # the command was sent, its reply is lost
+            with mock.patch.object(
+                client, "parse_response", side_effect=error
+            ) as parse_response:
+                with self.assertRaises(error):
+                    client.incr("counter")
+            self.assertEqual(parse_response.call_count, 3)
+
+    def test_async_client_is_created_per_event_loop(self):
+        client = redis_client.create_async_redis_client(
+            host=self.host, port=self.port, decode_responses=True
+        )
+        script = client.register_script("return ARGV[1]")
+
+        async def call():
+            return await script(args=["ok"]), client.client()
+
+        first_result, first_client = async_to_sync(call)()
+        second_result, second_client = async_to_sync(call)()
+
+        self.assertEqual((first_result, second_result), ("ok", "ok"))
+        self.assertIsNot(first_client, second_client)
+        # each client was closed with its loop
+        for closed in (first_client, second_client):
+            connections = closed.connection_pool._available_connections
+            self.assertEqual(len(connections), 1)
+            self.assertFalse(connections[0].is_connected)
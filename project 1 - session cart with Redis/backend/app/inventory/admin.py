@@ -6,4 +6,9 @@ from .models import (
 )
 
 admin.site.register(Category)
-admin.site.register(Product)
+
+
+@admin.register(Product)
+class ProductAdmin(admin.ModelAdmin):
+    # written back from the Redis counters, see Product.save()
+    readonly_fields = ("stock",)
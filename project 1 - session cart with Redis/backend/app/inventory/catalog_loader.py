@@ -0,0 +1,142 @@
+# catalog_loader.py
+"""
+Bulk upsert of category / product CSV feeds (same layout as db_data/*.csv,
+a header row naming the columns) for `python manage.py load_catalog`.
+
+A feed is streamed in blocks through psycopg's COPY into a temporary
+staging table, then merged into the real table with a single
+
+    INSERT INTO ... SELECT ... FROM staging ON CONFLICT (id) DO UPDATE
+
+so neither side holds the file in memory and Postgres does one set-based
+pass. Columns missing from the header keep their current value on existing
+rows and get the defaults below on new ones; Product.stock is only set on
+new rows, existing ones keep the stock written back from Redis. Rows are matched by id, and the
+id sequence is moved past the largest one afterwards.
+
+Writes made this way bypass the model signals, so refresh_caches() brings
+the Redis product index, stock counters and autocomplete index of the
+loaded products up to date, one pipeline per chunk.
+"""
+
+import csv
+import io
+
+from django.core.management.color import no_style
+from django.db import connection
+
+from . import product_cache, search_index, stock
+from .models import Category, Product
+
+# bytes sent per COPY write
+BLOCK_SIZE = 1 << 20
+
+# SQL values for NOT NULL columns a feed may leave out, used on new rows
+INSERT_DEFAULTS = {
+    Category: {"is_active": "false", "level": "0"},
+    Product: {"is_digital": "false", "is_active": "false", "created_at": "NOW()"},
+}
+
+# columns a feed only sets on new rows
+INSERT_ONLY = {Product: {"stock"}}
+
+
+def read_header(stream, model):
+    """
+    Consume the header row of a binary CSV stream and return its columns,
+    checked against the model's table.
+    """
+    line = stream.readline().decode("utf-8-sig")
+    columns = next(csv.reader(io.StringIO(line)), [])
+    known = {field.column for field in model._meta.concrete_fields}
+    unknown = [column for column in columns if column not in known]
+    if unknown:
+        raise ValueError(
+            f"Unknown {model._meta.db_table} columns: {', '.join(unknown)}."
+        )
+    if "id" not in columns:
+        raise ValueError(f"The {model._meta.db_table} feed needs an id column.")
+    if len(set(columns)) != len(columns):
+        raise ValueError(f"Duplicate columns in the {model._meta.db_table} feed.")
+    return columns
+
+
+def upsert_sql(model, columns, staging):
+    """The INSERT ... ON CONFLICT merging `staging` into the model's table."""
+    quote = connection.ops.quote_name
+    defaults = {
+        column: value
+        for column, value in INSERT_DEFAULTS.get(model, {}).items()
+        if column not in columns
+    }
+    targets = ", ".join(quote(column) for column in [*columns, *defaults])
+    values = ", ".join([*(quote(column) for column in columns), *defaults.values()])
+    updates = ", ".join(
+        f"{quote(column)} = EXCLUDED.{quote(column)}"
+        for column in columns
+        if column != "id" and column not in INSERT_ONLY.get(model, ())
+    )
+    conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+    return (
+        f"INSERT INTO {quote(model._meta.db_table)} ({targets}) "
+        f"SELECT {values} FROM {quote(staging)} "
+        f"ON CONFLICT (id) {conflict} RETURNING id"
+    )
+
+
+def load(cursor, model, stream, block_size=BLOCK_SIZE):
+    """
+    Upsert the CSV `stream` (binary, with a header row) into the model's
+    table and return the ids of the rows written. Run it in a transaction:
+    the staging table is dropped on commit.
+    """
+    columns = read_header(stream, model)
+    quote = connection.ops.quote_name
+    table = model._meta.db_table
+    staging = f"{table}_staging"
+    column_list = ", ".join(quote(column) for column in columns)
+
+    # temporary, so the name cannot reach a real table; loaded once per
+    # transaction
+    cursor.execute(
+        f"CREATE TEMPORARY TABLE {quote(staging)} ON COMMIT DROP AS "
+        f"SELECT {column_list} FROM {quote(table)} WITH NO DATA"
+    )
+    with cursor.copy(
+        f"COPY {quote(staging)} ({column_list}) FROM STDIN WITH (FORMAT csv)"
+    ) as copy:
+        while block := stream.read(block_size):
+            copy.write(block)
+
+    cursor.execute(upsert_sql(model, columns, staging))
+    ids = [row[0] for row in cursor.fetchall()]
+    for sql in connection.ops.sequence_reset_sql(no_style(), [model]):
+        cursor.execute(sql)
+    return ids
+
+
+def refresh_caches(product_ids, chunk_size=2000):
+    """
+    Rewrite the Redis entries of the given products from the table: product
+    index and autocomplete terms, one pipeline per chunk, and stock counters
+    (see stock.sync_products()).
+    """
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), chunk_size):
+        rows = list(
+            Product.objects.filter(
+                pk__in=product_ids[start : start + chunk_size]
+            ).values_list("id", "name", "price", "is_active", "slug")
+        )
+
+        pipe = product_cache.r.pipeline(transaction=False)
+        product_cache.cache_products(
+            [(pid, name, price, active) for pid, name, price, active, _ in rows],
+            pipe=pipe,
+        )
+        search_index.index_products(
+            [(pid, name, slug, active) for pid, name, _, active, slug in rows],
+            pipe=pipe,
+        )
+        pipe.execute()
+        stock.sync_products([pid for pid, *_ in rows])
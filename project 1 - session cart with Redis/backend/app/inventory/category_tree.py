@@ -0,0 +1,213 @@
+# category_tree.py
+"""
+Category tree materialized in Redis as a closure: every category stores the
+ids of its whole subtree, so "all products under Electronics" is one
+SMEMBERS plus one `category_id__in` query instead of a recursive walk of
+Category.parent.
+
+    category:{id}            hash    parent ("" for roots), slug
+    category:{id}:subtree    set     id of the category and of every
+                                     descendant
+    category:slugs           hash    slug -> id
+    category:tree:built      string  set once a full build completed
+    category:tree:version    integer bumped by every incremental update
+
+build_tree() writes everything from the Category table in one MULTI; it
+runs on deploy (warm_product_cache) and on the first read that finds no
+tree. It WATCHes category:tree:version while it reads the rows, so an
+update that lands between the read and the MULTI makes it read again
+instead of being lost. Category signals then keep the tree up to date
+incrementally once their transaction commits (see signals.py): moving a
+category only moves its subtree out of the subtree sets of its old
+ancestors and into those of its new ones. Deleting is only possible for
+leaves (Category.parent is RESTRICT).
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+
+from .models import Category
+
+r = settings.REDIS_CLIENT
+
+SLUGS_KEY = "category:slugs"
+BUILT_KEY = "category:tree:built"
+VERSION_KEY = "category:tree:version"
+
+
+def _node_key(category_id):
+    return f"category:{category_id}"
+
+
+def _subtree_key(category_id):
+    return f"category:{category_id}:subtree"
+
+
+HELPERS = """
+local SLUGS_KEY = 'category:slugs'
+local BUILT_KEY = 'category:tree:built'
+local VERSION_KEY = 'category:tree:version'
+
+local function node_key(id)
+    return 'category:' .. id
+end
+
+local function subtree_key(id)
+    return 'category:' .. id .. ':subtree'
+end
+
+-- `id` and its ancestors, up to the root
+local function ancestors(id)
+    local chain = {}
+    while id and id ~= '' and #chain < 1000 do
+        chain[#chain + 1] = id
+        id = redis.call('HGET', node_key(id), 'parent')
+    end
+    return chain
+end
+
+local function set_members(command, key, members)
+    for i = 1, #members, 1000 do
+        redis.call(command, key, unpack(members, i, math.min(i + 999, #members)))
+    end
+end
+"""
+
+# ARGV[1] id, ARGV[2] parent id ("" for a root), ARGV[3] slug
+# Returns 0 (and does nothing but bump the version) while no full build
+# completed.
+UPDATE_CATEGORY = HELPERS + """
+redis.call('INCR', VERSION_KEY)
+if redis.call('EXISTS', BUILT_KEY) == 0 then
+    return 0
+end
+local id, parent, slug = ARGV[1], ARGV[2], ARGV[3]
+local old_parent = redis.call('HGET', node_key(id), 'parent') or ''
+local old_slug = redis.call('HGET', node_key(id), 'slug')
+
+redis.call('SADD', subtree_key(id), id)
+if old_parent ~= parent then
+    local subtree = redis.call('SMEMBERS', subtree_key(id))
+    for _, ancestor in ipairs(ancestors(old_parent)) do
+        set_members('SREM', subtree_key(ancestor), subtree)
+    end
+    for _, ancestor in ipairs(ancestors(parent)) do
+        set_members('SADD', subtree_key(ancestor), subtree)
+    end
+end
+
+if old_slug and old_slug ~= slug then
+    redis.call('HDEL', SLUGS_KEY, old_slug)
+end
+redis.call('HSET', SLUGS_KEY, slug, id)
+redis.call('HSET', node_key(id), 'parent', parent, 'slug', slug)
+return 1
+"""
+
+# ARGV[1] id of a deleted (leaf) category
+REMOVE_CATEGORY = HELPERS + """
+redis.call('INCR', VERSION_KEY)
+local id = ARGV[1]
+local parent = redis.call('HGET', node_key(id), 'parent')
+for _, ancestor in ipairs(ancestors(parent)) do
+    redis.call('SREM', subtree_key(ancestor), id)
+end
+local slug = redis.call('HGET', node_key(id), 'slug')
+if slug then
+    redis.call('HDEL', SLUGS_KEY, slug)
+end
+redis.call('DEL', node_key(id), subtree_key(id))
+return 1
+"""
+
+# ARGV[1] slug
+# Returns {built, subtree ids}; the ids are empty for an unknown slug.
+GET_SUBTREE = HELPERS + """
+local built = redis.call('EXISTS', BUILT_KEY)
+local id = redis.call('HGET', SLUGS_KEY, ARGV[1])
+if not id then
+    return {built, {}}
+end
+return {built, redis.call('SMEMBERS', subtree_key(id))}
+"""
+
+_update_category_script = r.register_script(UPDATE_CATEGORY)
+_remove_category_script = r.register_script(REMOVE_CATEGORY)
+_get_subtree_script = r.register_script(GET_SUBTREE)
+
+
+def _fetch_categories():
+    return Category.objects.values_list("id", "parent_id", "slug")
+
+
+def subtrees(rows):
+    """{id: {ids of the category and its descendants}} for (id, parent_id, slug) rows."""
+    children = defaultdict(list)
+    for category_id, parent_id, _ in rows:
+        children[parent_id].append(category_id)
+
+    result = {}
+    for category_id, _, _ in rows:
+        subtree = set()
+        stack = [category_id]
+        while stack:
+            node = stack.pop()
+            if node not in subtree:
+                subtree.add(node)
+                stack.extend(children[node])
+        result[category_id] = subtree
+    return result
+
+
+def _build_tree(pipe):
+    # WATCHing VERSION_KEY: immediate mode until multi()
+    rows = list(_fetch_categories())
+    old_ids = pipe.hvals(SLUGS_KEY)
+
+    pipe.multi()
+    for category_id in old_ids:
+        pipe.delete(_node_key(category_id), _subtree_key(category_id))
+    pipe.delete(SLUGS_KEY)
+    for category_id, subtree in subtrees(rows).items():
+        pipe.sadd(_subtree_key(category_id), *subtree)
+    for category_id, parent_id, slug in rows:
+        pipe.hset(
+            _node_key(category_id),
+            mapping={"parent": parent_id or "", "slug": slug},
+        )
+        pipe.hset(SLUGS_KEY, slug, category_id)
+    pipe.set(BUILT_KEY, 1)
+    return len(rows)
+
+
+def build_tree():
+    """
+    Rebuild the whole tree from the Category table, atomically, and return
+    the number of categories. Read again if an update ran meanwhile.
+    """
+    return r.transaction(_build_tree, VERSION_KEY, value_from_callable=True)
+
+
+def update_category(category):
+    _update_category_script(
+        args=[category.id, category.parent_id or "", category.slug], client=r
+    )
+
+
+def remove_category(category_id):
+    _remove_category_script(args=[category_id], client=r)
+
+
+def subtree_ids(slug):
+    """
+    Ids of the category with `slug` and of all its descendants, None if
+    there is no such category. One round trip once the tree is built.
+    """
+    built, ids = _get_subtree_script(args=[slug], client=r)
+    if not built:
+        build_tree()
+        built, ids = _get_subtree_script(args=[slug], client=r)
+    if not ids:
+        return None
+    return sorted(int(category_id) for category_id in ids)
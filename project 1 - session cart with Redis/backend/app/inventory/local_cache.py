@@ -0,0 +1,226 @@
+# local_cache.py
+"""
+Process-local LRU cache, with a TTL, in front of the Redis product index.
+
+Product data changes a few times a day but is read by every checkout and
+catalog request, so each worker keeps a bounded copy in memory and does not
+touch the network on a hit:
+
+    product id -> {"name", "price", "is_active"} (product_cache format)
+
+The Product post_save/post_delete signals publish the product id on
+INVALIDATION_CHANNEL (warm_product_cache publishes ALL). Every worker runs
+one subscriber thread that drops the entry as soon as the message arrives.
+Entries are only served while that subscription is up; if it breaks the
+whole cache is cleared, since messages may have been lost. The TTL bounds
+staleness for writes that bypass the signals (bulk updates, raw SQL).
+
+The product list is cached in Redis instead, see response_cache.py.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import product_cache
+
+pubsub_r = settings.REDIS_PUBSUB_CLIENT
+
+INVALIDATION_CHANNEL = "product:invalidate"
+ALL = "*"
+
+
+class LRUCache:
+    """Thread-safe LRU cache whose entries also expire `ttl` seconds after being set."""
+
+    def __init__(self, max_size, ttl, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        # bumped by every invalidation, see set_many(if_generation=...)
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_many(self, keys):
+        """{key: value} of the keys that are cached and not expired."""
+        found = {}
+        now = self._clock()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] <= now:
+                    del self._entries[key]
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                found[key] = entry[1]
+        return found
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set_many(self, mapping, if_generation=None):
+        """
+        Store the given entries, evicting the least recently used ones.
+
+        With `if_generation`, nothing is stored if an invalidation happened
+        since that generation was read: the values may have been loaded
+        before the change they would now hide.
+        """
+        expires_at = self._clock() + self.ttl
+        with self._lock:
+            if if_generation is not None and if_generation != self.generation:
+                return
+            for key, value in mapping.items():
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def set(self, key, value, if_generation=None):
+        self.set_many({key: value}, if_generation=if_generation)
+
+    def delete(self, *keys):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+cache = LRUCache(
+    max_size=getattr(settings, "PRODUCT_LOCAL_CACHE_SIZE", 10_000),
+    ttl=getattr(settings, "PRODUCT_LOCAL_CACHE_TTL", 60),
+)
+
+_listener = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def _handle_message(message):
+    if message["data"] == ALL:
+        cache.clear()
+    else:
+        cache.delete(int(message["data"]))
+
+
+def _handle_exception(exc, pubsub, thread):
+    # Invalidations sent while disconnected are lost. The next get_message()
+    # reconnects and subscribes again.
+    cache.clear()
+    time.sleep(1)
+
+
+def _ensure_listener():
+    """
+    Start this process' subscriber thread if it is not running (first use,
+    or after a fork). Returns False if Redis cannot be reached, in which
+    case the local cache must not be used.
+    """
+    global _listener, _listener_pid
+    if _listener_pid == os.getpid():
+        return True
+
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return True
+        try:
+            pubsub = pubsub_r.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{INVALIDATION_CHANNEL: _handle_message})
+        except redis.RedisError:
+            return False
+        # entries copied from a parent process missed its invalidations
+        cache.clear()
+        _listener = pubsub.run_in_thread(
+            sleep_time=1, daemon=True, exception_handler=_handle_exception
+        )
+        _listener_pid = os.getpid()
+    return True
+
+
+def stop_listener():
+    global _listener, _listener_pid
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener.join(timeout=5)
+        _listener = _listener_pid = None
+        cache.clear()
+
+
+def publish_invalidation(product_id=ALL):
+    """Tell every worker to drop a product (or everything) from its local cache."""
+    product_cache.r.publish(INVALIDATION_CHANNEL, product_id)
+
+
+def get_products(product_ids):
+    """
+    product_cache.get_products() through the local cache: only products not
+    cached in this process are read from Redis (or Postgres).
+    """
+    product_ids = [int(product_id) for product_id in product_ids]
+    if not _ensure_listener():
+        return product_cache.get_products(product_ids)
+
+    generation = cache.generation
+    products = cache.get_many(product_ids)
+    missing = [product_id for product_id in product_ids if product_id not in products]
+    if missing:
+        loaded = product_cache.get_products(missing)
+        cache.set_many(loaded, if_generation=generation)
+        products.update(loaded)
+    return products
+
+
+async def aget_products(product_ids):
+    """get_products() for async views; misses go through the asyncio client."""
+    product_ids = [int(product_id) for product_id in product_ids]
+    if _listener_pid != os.getpid():
+        # subscribing is a blocking call, done once per process
+        if not await sync_to_async(_ensure_listener)():
+            return await product_cache.aget_products(product_ids)
+
+    generation = cache.generation
+    products = cache.get_many(product_ids)
+    missing = [product_id for product_id in product_ids if product_id not in products]
+    if missing:
+        loaded = await product_cache.aget_products(missing)
+        cache.set_many(loaded, if_generation=generation)
+        products.update(loaded)
+    return products
+
+
+def stats():
+    """Hit/miss/eviction counters of this process' cache."""
+    return cache.stats()
@@ -0,0 +1,78 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DataError, IntegrityError, connection, transaction
+
+from inventory import (
+    catalog_loader,
+    category_tree,
+    local_cache,
+    response_cache,
+)
+from inventory.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Upsert category and product CSV feeds (layout of db_data/*.csv) with "
+        "COPY into a staging table and one INSERT ... ON CONFLICT per table, "
+        "in a single transaction, then refresh the Redis caches of what was "
+        "loaded."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--categories", help="Path of a category CSV.")
+        parser.add_argument("--products", help="Path of a product CSV.")
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Products refreshed per DB round trip and Redis pipeline.",
+        )
+
+    def handle(self, *args, **options):
+        feeds = [
+            (model, options[name])
+            for model, name in ((Category, "categories"), (Product, "products"))
+            if options[name]
+        ]
+        if not feeds:
+            raise CommandError("Pass --categories and/or --products.")
+
+        started = time.perf_counter()
+        loaded = {}
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                # categories first, products reference them
+                for model, path in feeds:
+                    with open(path, "rb") as stream:
+                        try:
+                            loaded[model] = catalog_loader.load(cursor, model, stream)
+                        except (DataError, IntegrityError) as exc:
+                            # e.g. a product of an unknown category, a duplicate slug
+                            raise CommandError(f"{path} was not loaded: {exc}")
+        except (OSError, ValueError) as exc:
+            raise CommandError(exc)
+        loaded_in = time.perf_counter() - started
+
+        started = time.perf_counter()
+        product_ids = loaded.get(Product, [])
+        catalog_loader.refresh_caches(product_ids, options["chunk_size"])
+        if Category in loaded:
+            category_tree.build_tree()
+        # only the loaded products were refreshed: the index stays as current
+        # as it was (warm_product_cache rebuilds all of it)
+        local_cache.publish_invalidation()
+        response_cache.bump_catalog_version()
+        refreshed_in = time.perf_counter() - started
+
+        rows = sum(len(ids) for ids in loaded.values())
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Upserted {len(loaded.get(Category, []))} categories and "
+                f"{len(product_ids)} products in {loaded_in:.2f}s "
+                f"({rows / max(loaded_in, 1e-9):,.0f} rows/s); refreshed Redis "
+                f"in {refreshed_in:.2f}s "
+                f"({len(product_ids) / max(refreshed_in, 1e-9):,.0f} products/s)."
+            )
+        )
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from inventory import stock
+from inventory.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the Redis stock counters (stock:{id}) from Product.stock plus "
+        "the deltas not yet written back. Run it on deploy, after enabling "
+        "stock on existing products, or after a Redis data loss."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Products read per DB query and synced per Redis pipeline.",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        ids = Product.objects.values_list("id", flat=True).iterator(
+            chunk_size=chunk_size
+        )
+
+        tracked = 0
+        chunk = []
+        for product_id in ids:
+            chunk.append(product_id)
+            if len(chunk) == chunk_size:
+                tracked += len(stock.sync_products(chunk))
+                chunk = []
+        if chunk:
+            tracked += len(stock.sync_products(chunk))
+
+        self.stdout.write(self.style.SUCCESS(f"Synced {tracked} stock counters."))
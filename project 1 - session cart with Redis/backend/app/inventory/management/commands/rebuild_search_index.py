@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory import search_index
+from inventory.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the Redis autocomplete index (suggest:index) from the active "
+        "products, streaming the table in chunks. Product signals keep it "
+        "current afterwards; run it on deploy or after a Redis data loss."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Rows fetched per DB round trip and indexed per Redis pipeline.",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        rows = (
+            Product.objects.filter(is_active=True)
+            .values_list("id", "name", "slug", "is_active")
+            .iterator(chunk_size=chunk_size)
+        )
+
+        search_index.start_rebuild()
+        try:
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    search_index.index_products(chunk, rebuild=True)
+                    chunk = []
+            if chunk:
+                search_index.index_products(chunk, rebuild=True)
+        except BaseException:
+            search_index.abort_rebuild()
+            raise
+        indexed = search_index.finish_rebuild()
+        if indexed is None:
+            raise CommandError(
+                f"A chunk took longer than {search_index.REBUILD_TIMEOUT}s, "
+                "the index was not replaced."
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Indexed {indexed} products for autocomplete.")
+        )
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+
+from inventory import category_tree, local_cache, product_cache, response_cache
+from inventory.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the Redis product index (product:{id}) from the Product table "
+        "and drop entries of products that no longer exist, then rebuild the "
+        "category tree (category_tree.py). Run it on deploy "
+        "and periodically (e.g. from cron) to repair writes that bypassed the "
+        "model signals, such as bulk updates or raw SQL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Rows fetched per DB round trip and written per Redis pipeline.",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        rows = Product.objects.values_list("id", "name", "price", "is_active").iterator(
+            chunk_size=chunk_size
+        )
+
+        seen = set()
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            seen.add(row[0])
+            if len(chunk) == chunk_size:
+                product_cache.cache_products(chunk)
+                chunk = []
+        if chunk:
+            product_cache.cache_products(chunk)
+
+        pruned = self.prune(seen, chunk_size)
+        categories = category_tree.build_tree()
+        product_cache.mark_index_built()
+        local_cache.publish_invalidation()
+        # the rebuild may pick up writes that bypassed the signals
+        response_cache.bump_catalog_version()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Indexed {len(seen)} products, removed {pruned} stale entries "
+                f"(index version {product_cache.INDEX_VERSION}), built the tree "
+                f"of {categories} categories."
+            )
+        )
+
+    def prune(self, product_ids, chunk_size):
+        """Delete product:{id} entries whose id is not in product_ids."""
+        r = product_cache.r
+        pruned = 0
+        for key in r.scan_iter(match="product:*", count=chunk_size):
+            suffix = key.split(":", 1)[1]
+            if suffix.isdigit() and int(suffix) not in product_ids:
+                r.delete(key)
+                pruned += 1
+        return pruned
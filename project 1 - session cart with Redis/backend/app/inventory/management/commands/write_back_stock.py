@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventory import stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Release the stock held by expired carts and write the net stock "
+        "changes accumulated in Redis to Product.stock. Runs once, or every "
+        "--interval seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Seconds between runs; 0 runs once.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Products updated per UPDATE statement.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            released = stock.reclaim_expired()
+            deltas = stock.write_back(chunk_size=options["chunk_size"])
+            if released or deltas or options["verbosity"] > 1:
+                self.stdout.write(
+                    f"Released {released} expired holds, wrote back "
+                    f"{len(deltas)} products."
+                )
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -35,7 +35,16 @@ class Migration(migrations.Migration):
                 ('created_at', models.DateTimeField(auto_now_add=True)),
                 ('updated_at', models.DateTimeField(blank=True, null=True)),
                 ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('stock', models.IntegerField(blank=True, null=True)),
                 ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='products', to='inventory.category')),
             ],
         ),
+        migrations.CreateModel(
+            name='StockWriteBack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch', models.CharField(max_length=32, unique=True)),
+                ('written_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
     ]
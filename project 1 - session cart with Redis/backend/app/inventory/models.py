@@ -26,6 +26,36 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(null=True, blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Units not held by any cart, NULL for unlimited. Carts reserve against
+    # Redis counters, written back here in batches (see stock.py). Only set
+    # on insert by save(); change it with an UPDATE adding to it (F("stock")),
+    # which the counter sync after commit picks up.
+    stock = models.IntegerField(null=True, blank=True)
 
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        # an instance read before a write-back must not put its stock back
+        if not self._state.adding:
+            update_fields = kwargs.get("update_fields")
+            if update_fields is None:
+                update_fields = [
+                    field.name
+                    for field in self._meta.concrete_fields
+                    if not field.primary_key
+                ]
+            kwargs["update_fields"] = [
+                field for field in update_fields if field != "stock"
+            ]
+        super().save(*args, **kwargs)
+
+
+class StockWriteBack(models.Model):
+    # The last batch of Redis stock deltas added to Product.stock, recorded in
+    # the same transaction so that a batch is never applied twice.
+    batch = models.CharField(max_length=32, unique=True)
+    written_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.batch
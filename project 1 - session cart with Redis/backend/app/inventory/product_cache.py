@@ -0,0 +1,231 @@
+# product_cache.py
+"""
+Redis index of product name, price and availability.
+
+Carts only store product_id -> quantity; name and price are looked up here,
+so a product held in many carts is stored once, and checkout validates
+prices and availability against it instead of querying Postgres:
+
+    product:{id}             hash    name, price, is_active ("1" / "0"),
+                                     or only is_active = MISSING
+    product:index:version    string  INDEX_VERSION of the last full build
+
+Entries are written after commit by the Product post_save/post_delete
+signals (see signals.py) and rebuilt by `python manage.py warm_product_cache`,
+which is meant to run on deploy and periodically. Reads only trust the index
+when its version matches INDEX_VERSION; otherwise (and for single misses)
+they fall back to Postgres and write what they read back to the index, but
+only to entries that are still absent: a signal that wrote the entry since
+the row was read has the newer data. Ids Postgres does not know get a
+MISSING entry for MISSING_TTL seconds, deleted products too: cart lines are
+not validated on add, and such a line must not query Postgres on every
+cart read.
+"""
+
+from django.conf import settings
+
+from .models import Product
+
+r = settings.REDIS_CLIENT
+ar = settings.ASYNC_REDIS_CLIENT
+
+# Bump when the fields stored per product change, so reads fall back to
+# Postgres until the next full rebuild.
+INDEX_VERSION = 2
+INDEX_VERSION_KEY = "product:index:version"
+
+PRODUCT_FIELDS = ("name", "price", "is_active")
+
+KEY_PREFIX = "product:"
+
+# is_active of an id that is not in Postgres; short-lived, a product created
+# meanwhile by a write that bypassed the signals shows up after at most that
+MISSING = "-"
+MISSING_TTL = 60
+
+
+def _product_key(product_id):
+    return f"{KEY_PREFIX}{product_id}"
+
+
+# KEYS product:{id} of the misses, ARGV[1] MISSING_TTL, then name, price and
+# is_active of each (is_active = MISSING for an id Postgres does not know)
+FILL_MISSES = f"""
+for i, key in ipairs(KEYS) do
+    local at = i * 3 - 1
+    if redis.call('EXISTS', key) == 0 then
+        if ARGV[at + 2] == '{MISSING}' then
+            redis.call('HSET', key, 'is_active', ARGV[at + 2])
+            redis.call('EXPIRE', key, ARGV[1])
+        else
+            redis.call('HSET', key, 'name', ARGV[at], 'price', ARGV[at + 1],
+                'is_active', ARGV[at + 2])
+        end
+    end
+end
+"""
+
+_fill_misses_script = r.register_script(FILL_MISSES)
+_afill_misses_script = ar.register_script(FILL_MISSES)
+
+
+def cache_products(rows, pipe=None):
+    """
+    Write (id, name, price, is_active) rows to the index in one pipeline.
+    Pass `pipe` to queue the writes on an existing pipeline instead.
+    """
+    own_pipe = pipe is None
+    if own_pipe:
+        pipe = r.pipeline(transaction=False)
+
+    for product_id, name, price, is_active in rows:
+        pipe.hset(
+            _product_key(product_id),
+            mapping={"name": name, "price": str(price), "is_active": int(is_active)},
+        )
+        # the TTL of a MISSING entry the product replaces
+        pipe.persist(_product_key(product_id))
+
+    if own_pipe:
+        pipe.execute()
+
+
+def _queue_cache_missing(pipe, product_ids):
+    for product_id in product_ids:
+        key = _product_key(product_id)
+        pipe.delete(key)
+        pipe.hset(key, "is_active", MISSING)
+        pipe.expire(key, MISSING_TTL)
+
+
+def cache_product(product):
+    cache_products([(product.id, product.name, product.price, product.is_active)])
+
+
+def cache_missing(product_id):
+    """Mark a deleted product as MISSING, so a late miss fill cannot revive it."""
+    pipe = r.pipeline(transaction=False)
+    _queue_cache_missing(pipe, [product_id])
+    pipe.execute()
+
+
+def mark_index_built():
+    r.set(INDEX_VERSION_KEY, INDEX_VERSION)
+
+
+def _fetch_from_db(product_ids):
+    return Product.objects.filter(id__in=product_ids).values_list(
+        "id", "name", "price", "is_active"
+    )
+
+
+async def _afetch_from_db(product_ids):
+    rows = Product.objects.filter(id__in=product_ids).values_list(
+        "id", "name", "price", "is_active"
+    )
+    return [row async for row in rows]
+
+
+def get_products(product_ids):
+    """
+    {id: {"name", "price", "is_active"}} for the given products, read with a
+    single pipeline (GET of the index version + one HMGET per product).
+    Misses, or every product when the index version is missing/stale, are
+    loaded from Postgres in one query and written back; ids that do not
+    exist are left out.
+    """
+    product_ids = [int(product_id) for product_id in product_ids]
+    if not product_ids:
+        return {}
+
+    pipe = r.pipeline(transaction=False)
+    _queue_lookup(pipe, product_ids)
+    products, missing = unpack_lookup(product_ids, pipe.execute())
+    products.update(load_products(missing))
+    return products
+
+
+async def aget_products(product_ids):
+    """get_products() on the asyncio client and the async ORM."""
+    product_ids = [int(product_id) for product_id in product_ids]
+    if not product_ids:
+        return {}
+
+    async with ar.pipeline(transaction=False) as pipe:
+        _queue_lookup(pipe, product_ids)
+        products, missing = unpack_lookup(product_ids, await pipe.execute())
+    products.update(await aload_products(missing))
+    return products
+
+
+def load_products(product_ids):
+    """
+    Index misses from Postgres in one query, written back to the entries
+    still absent in one script call, together with the MISSING entries of
+    ids that do not exist.
+    """
+    if not product_ids:
+        return {}
+    rows = list(_fetch_from_db(product_ids))
+    _fill_misses_script(*_fill_args(product_ids, rows), client=r)
+    return _rows_to_products(rows)
+
+
+async def aload_products(product_ids):
+    """load_products() on the asyncio client and the async ORM."""
+    if not product_ids:
+        return {}
+    rows = await _afetch_from_db(product_ids)
+    await _afill_misses_script(*_fill_args(product_ids, rows), client=ar)
+    return _rows_to_products(rows)
+
+
+def _fill_args(product_ids, rows):
+    """(keys, args) of FILL_MISSES for the rows read for `product_ids`."""
+    found = {
+        product_id: (name, str(price), int(is_active))
+        for product_id, name, price, is_active in rows
+    }
+    keys = [_product_key(product_id) for product_id in product_ids]
+    args = [MISSING_TTL]
+    for product_id in product_ids:
+        args.extend(found.get(product_id, ("", "", MISSING)))
+    return keys, args
+
+
+def _queue_lookup(pipe, product_ids):
+    pipe.get(INDEX_VERSION_KEY)
+    for product_id in product_ids:
+        pipe.hmget(_product_key(product_id), PRODUCT_FIELDS)
+
+
+def unpack_lookup(product_ids, results):
+    """
+    (products found in the index, ids to load from Postgres) from the index
+    version and one (name, price, is_active) entry per product, as queued by
+    _queue_lookup() or read by the cart's READ_CART script.
+    """
+    version, *entries = results
+
+    products = {}
+    missing = []
+    index_is_current = version == str(INDEX_VERSION)
+    for product_id, (name, price, is_active) in zip(product_ids, entries):
+        if index_is_current and is_active == MISSING:
+            continue  # not in Postgres either
+        if not index_is_current or name is None or is_active is None:
+            missing.append(product_id)
+        else:
+            products[product_id] = {
+                "name": name,
+                "price": float(price),
+                "is_active": is_active == "1",
+            }
+    return products, missing
+
+
+def _rows_to_products(rows):
+    return {
+        product_id: {"name": name, "price": float(price), "is_active": is_active}
+        for product_id, name, price, is_active in rows
+    }
@@ -0,0 +1,123 @@
+# response_cache.py
+"""
+Rendered catalog responses cached in Redis under a catalog version:
+
+    catalog:version                          integer, bumped on every change
+    catalog:response:{version}:{variant}     bytes   rendered JSON body
+
+A variant is one page / filter of an endpoint (see variant_of()). Product
+and Category signals bump the version once their transaction commits (see
+signals.py), which makes every cached body unreachable at once; old bodies
+simply expire after settings.CATALOG_RESPONSE_CACHE_TTL.
+
+The ETag of a response is "{version}-{variant}", known before the body is
+built. One script call returns the version and the cached body together,
+so a request with a matching If-None-Match is answered 304, and a hit is
+answered with the stored bytes, without Postgres or any serialization.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+from core import fast_json
+
+r = settings.REDIS_CLIENT
+
+VERSION_KEY = "catalog:version"
+RESPONSE_PREFIX = "catalog:response"
+
+# A missing version (first use, or Redis lost its data) starts from the
+# current time, so ETags handed out before can never match again.
+_INIT_VERSION = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('SET', KEYS[1], redis.call('TIME')[1], 'NX')
+end
+"""
+
+# KEYS[1] catalog:version, ARGV[1] key prefix, ARGV[2] variant
+# Returns {version, body or false}.
+LOOKUP = _INIT_VERSION + """
+local version = redis.call('GET', KEYS[1])
+return {version, redis.call('GET', ARGV[1] .. ':' .. version .. ':' .. ARGV[2])}
+"""
+
+# KEYS[1] catalog:version. Returns the version.
+VERSION = _INIT_VERSION + """
+return redis.call('GET', KEYS[1])
+"""
+
+# KEYS[1] catalog:version. Returns the new version.
+BUMP = _INIT_VERSION + """
+return redis.call('INCR', KEYS[1])
+"""
+
+_lookup_script = r.register_script(LOOKUP)
+_version_script = r.register_script(VERSION)
+_bump_script = r.register_script(BUMP)
+
+
+def bump_catalog_version():
+    return _bump_script(keys=[VERSION_KEY], client=r)
+
+
+def variant_of(request, params=()):
+    """
+    Short digest of what selects the body: the endpoint, the query
+    parameters named in `params` and the host (pagination links are
+    absolute).
+    """
+    query = "&".join(
+        f"{name}={request.GET[name]}" for name in sorted(params) if name in request.GET
+    )
+    variant = f"{request.get_host()}{request.path}?{query}"
+    return hashlib.sha1(variant.encode()).hexdigest()[:16]
+
+
+def _response_key(version, variant):
+    return f"{RESPONSE_PREFIX}:{version}:{variant}"
+
+
+def _not_modified(request, etag):
+    etags = parse_etags(request.headers.get("If-None-Match", ""))
+    return "*" in etags or etag in etags
+
+
+def cached_response(request, variant, build):
+    """
+    HttpResponse for `variant`: 304 when the client has the current ETag,
+    else the cached body, else the data returned by `build()` rendered as
+    JSON and stored for the next request.
+    """
+    version, body = _lookup_script(
+        keys=[VERSION_KEY], args=[RESPONSE_PREFIX, variant], client=r
+    )
+    etag = f'"{version}-{variant}"'
+    if _not_modified(request, etag):
+        return HttpResponseNotModified(headers={"ETag": etag})
+
+    if body is None:
+        body = fast_json.render(build())
+        r.set(
+            _response_key(version, variant),
+            body,
+            ex=settings.CATALOG_RESPONSE_CACHE_TTL,
+        )
+    elif isinstance(body, str):
+        # decode_responses clients hand bodies back as str
+        body = body.encode()
+    return HttpResponse(body, content_type="application/json", headers={"ETag": etag})
+
+
+def check_not_modified(request, variant):
+    """
+    (ETag, 304 response or None) for responses that are not cached, such as
+    the streamed product list.
+    """
+    version = _version_script(keys=[VERSION_KEY], client=r)
+    etag = f'"{version}-{variant}"'
+    if _not_modified(request, etag):
+        return etag, HttpResponseNotModified(headers={"ETag": etag})
+    return etag, None
@@ -0,0 +1,203 @@
+# search_index.py
+"""
+Autocomplete index of active products in Redis sorted sets, queried by
+lexicographic range:
+
+    suggest:index           zset  "{term}\\0{id}\\0{name}", all scored 0
+    suggest:members         hash  id -> JSON list of the product's members,
+                                  to replace them
+
+A product is indexed under its normalized name starting at every word
+("apple iphone 15", "iphone 15", "15") and under its slug, so typing the
+start of any word finds it. Normalization lowercases, strips accents and
+collapses whitespace. The name is stored in the member itself, so a
+suggestion is a single ZRANGEBYLEX with no second lookup.
+
+Product signals keep the index current (see signals.py); the
+`rebuild_search_index` command rebuilds it from the table in chunks into
+suggest:index:rebuild and suggest:members:rebuild, and swaps both in with
+RENAME. While it runs, saved products are indexed in both and listed in
+suggest:index:rebuild:saved, so that a chunk read before the save does not
+bring their old terms back. That key expires REBUILD_TIMEOUT seconds after
+the last chunk, so a rebuild that died does not leave saves writing twice;
+finish_rebuild() then refuses to swap in the incomplete index.
+"""
+
+import unicodedata
+
+from django.conf import settings
+
+r = settings.REDIS_CLIENT
+
+INDEX_KEY = "suggest:index"
+MEMBERS_KEY = "suggest:members"
+REBUILD_KEY = "suggest:index:rebuild"
+REBUILD_MEMBERS_KEY = "suggest:members:rebuild"
+# exists while a rebuild runs: holds STARTED and the ids saved since
+SAVED_KEY = "suggest:index:rebuild:saved"
+STARTED = "-"
+# seconds a rebuild may spend on one chunk before it counts as dead
+REBUILD_TIMEOUT = 10 * 60
+SEPARATOR = "\0"
+# sorts after every character a term can contain
+RANGE_END = "\U0010ffff"
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(text.replace(SEPARATOR, " ").split())
+
+
+def terms(name, slug):
+    words = normalize(name).split(" ")
+    result = {" ".join(words[i:]) for i in range(len(words)) if words[i]}
+    slug = normalize(slug)
+    if slug:
+        result.add(slug)
+    return result
+
+
+def members(product_id, name, slug):
+    return [
+        f"{term}{SEPARATOR}{product_id}{SEPARATOR}{name}" for term in terms(name, slug)
+    ]
+
+
+# KEYS[1] index, KEYS[2] members, KEYS[3] rebuild index, KEYS[4] rebuild
+# members, KEYS[5] SAVED_KEY
+# ARGV[1] "save" or "rebuild", ARGV[2] product id, ARGV[3..] the product's
+# new members (none to remove it)
+REPLACE_MEMBERS = """
+local function replace(index, members)
+    local old = redis.call('HGET', members, ARGV[2])
+    if old then
+        old = cjson.decode(old)
+        redis.call('ZREM', index, unpack(old))
+    end
+    if #ARGV > 2 then
+        local new = {}
+        for i = 3, #ARGV do
+            redis.call('ZADD', index, 0, ARGV[i])
+            new[#new + 1] = ARGV[i]
+        end
+        redis.call('HSET', members, ARGV[2], cjson.encode(new))
+    else
+        redis.call('HDEL', members, ARGV[2])
+    end
+end
+
+if ARGV[1] == 'rebuild' then
+    -- saved since the rebuild started: the row read may be older
+    if redis.call('SISMEMBER', KEYS[5], ARGV[2]) == 0 then
+        replace(KEYS[3], KEYS[4])
+    end
+    return
+end
+replace(KEYS[1], KEYS[2])
+if redis.call('EXISTS', KEYS[5]) == 1 then
+    replace(KEYS[3], KEYS[4])
+    redis.call('SADD', KEYS[5], ARGV[2])
+end
+"""
+
+# same KEYS as REPLACE_MEMBERS
+FINISH_REBUILD = """
+-- timed out: saves stopped reaching the rebuild index
+if redis.call('DEL', KEYS[5]) == 0 then
+    redis.call('DEL', KEYS[3], KEYS[4])
+    return false
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+-- an empty rebuild leaves no keys to rename
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    redis.call('RENAME', KEYS[3], KEYS[1])
+    redis.call('RENAME', KEYS[4], KEYS[2])
+end
+return redis.call('HLEN', KEYS[2])
+"""
+
+_replace_members_script = r.register_script(REPLACE_MEMBERS)
+_finish_rebuild_script = r.register_script(FINISH_REBUILD)
+
+
+def index_products(rows, rebuild=False, pipe=None):
+    """
+    Index (id, name, slug, is_active) rows, replacing what each product had;
+    inactive products are removed. One pipeline unless `pipe` is given.
+    With `rebuild`, write to the index being rebuilt instead.
+    """
+    own_pipe = pipe is None
+    if own_pipe:
+        pipe = r.pipeline(transaction=False)
+
+    if rebuild:
+        # the rebuild is alive (no-op once it timed out)
+        pipe.expire(SAVED_KEY, REBUILD_TIMEOUT)
+    mode = "rebuild" if rebuild else "save"
+    for product_id, name, slug, is_active in rows:
+        new = members(product_id, name, slug) if is_active else []
+        _replace_members_script(
+            keys=[INDEX_KEY, MEMBERS_KEY, REBUILD_KEY, REBUILD_MEMBERS_KEY, SAVED_KEY],
+            args=[mode, product_id, *new],
+            client=pipe,
+        )
+
+    if own_pipe:
+        pipe.execute()
+
+
+def index_product(product):
+    index_products([(product.id, product.name, product.slug, product.is_active)])
+
+
+def remove_product(product_id):
+    index_products([(product_id, "", "", False)])
+
+
+def start_rebuild():
+    pipe = r.pipeline(transaction=True)
+    pipe.delete(REBUILD_KEY, REBUILD_MEMBERS_KEY, SAVED_KEY)
+    pipe.sadd(SAVED_KEY, STARTED)
+    pipe.expire(SAVED_KEY, REBUILD_TIMEOUT)
+    pipe.execute()
+
+
+def finish_rebuild():
+    """
+    Swap the index built by index_products(..., rebuild=True) in, with the
+    products saved meanwhile, and return the number of products indexed.
+    None when the rebuild timed out; the live index is left as it was.
+    """
+    return _finish_rebuild_script(
+        keys=[INDEX_KEY, MEMBERS_KEY, REBUILD_KEY, REBUILD_MEMBERS_KEY, SAVED_KEY],
+        client=r,
+    )
+
+
+def abort_rebuild():
+    """Drop a rebuild in progress, saves go to the live index only again."""
+    r.delete(SAVED_KEY, REBUILD_KEY, REBUILD_MEMBERS_KEY)
+
+
+def suggest(query, limit=10):
+    """
+    [{"id", "name"}, ...] of up to `limit` products with a word starting
+    with `query`, in term order. One Redis command.
+    """
+    prefix = normalize(query)
+    if not prefix:
+        return []
+    # a product can match through several terms, read a few extra
+    found = r.zrangebylex(
+        INDEX_KEY, f"[{prefix}", f"[{prefix}{RANGE_END}", start=0, num=limit * 3
+    )
+    suggestions = {}
+    for member in found:
+        _, product_id, name = member.split(SEPARATOR, 2)
+        suggestions.setdefault(int(product_id), name)
+        if len(suggestions) == limit:
+            break
+    return [
+        {"id": product_id, "name": name} for product_id, name in suggestions.items()
+    ]
@@ -0,0 +1,63 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import (
+    category_tree,
+    local_cache,
+    product_cache,
+    response_cache,
+    search_index,
+    stock,
+)
+from .models import Category, Product
+
+# Redis is written after commit: a rolled back save must leave no trace, and
+# a reader that filled a miss from the old row meanwhile is overwritten (see
+# product_cache.load_products()).
+
+
+def _refresh_product(product):
+    product_cache.cache_product(product)
+    search_index.index_product(product)
+    # from the table: the stock of the instance may predate a write-back
+    stock.sync_products([product.id])
+    local_cache.publish_invalidation(product.id)
+
+
+def _evict_product(product_id):
+    product_cache.cache_missing(product_id)
+    search_index.remove_product(product_id)
+    stock.forget_product(product_id)
+    local_cache.publish_invalidation(product_id)
+
+
+@receiver(post_save, sender=Product)
+def refresh_cached_product(sender, instance, **kwargs):
+    transaction.on_commit(partial(_refresh_product, instance))
+
+
+@receiver(post_delete, sender=Product)
+def evict_cached_product(sender, instance, **kwargs):
+    transaction.on_commit(partial(_evict_product, instance.id))
+
+
+@receiver(post_save, sender=Category)
+def refresh_category_tree(sender, instance, **kwargs):
+    transaction.on_commit(partial(category_tree.update_category, instance))
+
+
+@receiver(post_delete, sender=Category)
+def remove_from_category_tree(sender, instance, **kwargs):
+    transaction.on_commit(partial(category_tree.remove_category, instance.id))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_catalog_version(sender, **kwargs):
+    # after commit: a request reading the new version must see the new rows
+    transaction.on_commit(response_cache.bump_catalog_version)
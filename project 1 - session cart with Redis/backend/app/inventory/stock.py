@@ -0,0 +1,327 @@
+# stock.py
+"""
+Stock counters in Redis, so that putting a product in a cart never takes a
+row lock in Postgres:
+
+    stock:{id}               string  units that can still be reserved
+    stock:hold:{sid}         hash    product_id -> units held by a cart
+    stock:holds              zset    stock:hold:{sid} -> expiry (ms)
+    stock:deltas             hash    product_id -> net change not yet in
+                                     Postgres
+    stock:deltas:flushing    hash    deltas being written to Postgres
+    stock:deltas:batch       string  id of the batch being written
+    stock:deltas:written     string  id of the last batch written and
+                                     cleared
+
+Only products with a Product.stock are tracked; NULL means unlimited and no
+counter. The cart scripts take units from the counters and give them back
+with reserve() below, atomically with the cart line (see set_qty() in
+cart/lua_scripts.py), and add every change to stock:deltas.
+
+Product.stock holds the units not held by any cart, so at all times
+
+    stock:{id} == Product.stock + pending deltas
+
+write_back() moves the pending deltas to Postgres with one set-based UPDATE
+per chunk. The batch id is stored in StockWriteBack in the same transaction,
+so a batch whose UPDATE committed is never applied twice, even if the
+process dies before clearing it from Redis.
+
+sync_products() rebuilds counters from the table (after a Product save
+commits, see signals.py, and with `python manage.py load_stock`). It reads
+Product.stock together with the last written batch, in one statement, to
+know whether the deltas being written are already in Product.stock; when a
+write-back finished in between, it reads the table again.
+
+Holds expire with their cart: touch() in the cart scripts keeps the expiry
+in stock:holds equal to the cart's, and reclaim_expired() gives the units of
+expired holds back (`python manage.py write_back_stock` runs it; the cart
+scripts also do before refusing a line).
+"""
+
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Subquery, Value, When
+
+from .models import Product, StockWriteBack
+
+r = settings.REDIS_CLIENT
+
+HOLDS_KEY = "stock:holds"
+DELTAS_KEY = "stock:deltas"
+FLUSHING_KEY = "stock:deltas:flushing"
+BATCH_KEY = "stock:deltas:batch"
+WRITTEN_KEY = "stock:deltas:written"
+
+# Returned by SYNC_STOCK when a write-back finished after Product.stock was
+# read; sync_products() reads it again, at most SYNC_ATTEMPTS times.
+STALE = "stale"
+SYNC_ATTEMPTS = 3
+
+
+def _stock_key(product_id):
+    return f"stock:{product_id}"
+
+
+def hold_key(session_id):
+    return f"stock:hold:{session_id}"
+
+
+# Shared with the cart scripts (cart/lua_scripts.py), which run it first.
+STOCK_HELPERS = f"""
+local STOCK_PREFIX = 'stock:'
+local HOLDS_KEY = '{HOLDS_KEY}'
+local DELTAS_KEY = '{DELTAS_KEY}'
+local FLUSHING_KEY = '{FLUSHING_KEY}'
+local BATCH_KEY = '{BATCH_KEY}'
+local WRITTEN_KEY = '{WRITTEN_KEY}'
+-- expired holds given back before refusing a cart line
+local RECLAIM_LIMIT = 100
+
+local function now_ms()
+    local time = redis.call('TIME')
+    return tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+end
+
+-- Give the units held by a cart back to the (still tracked) counters.
+local function release_hold(key)
+    local held = redis.call('HGETALL', key)
+    for i = 1, #held, 2 do
+        local stock_key = STOCK_PREFIX .. held[i]
+        if redis.call('EXISTS', stock_key) == 1 then
+            redis.call('INCRBY', stock_key, held[i + 1])
+            redis.call('HINCRBY', DELTAS_KEY, held[i], held[i + 1])
+        end
+    end
+    redis.call('DEL', key)
+    redis.call('ZREM', HOLDS_KEY, key)
+end
+
+local function reclaim_expired(limit)
+    local expired = redis.call(
+        'ZRANGEBYSCORE', HOLDS_KEY, '-inf', now_ms(), 'LIMIT', 0, limit
+    )
+    for _, key in ipairs(expired) do
+        release_hold(key)
+    end
+    return #expired
+end
+
+-- Move the expiry of a cart's hold, if it holds anything.
+local function refresh_hold(key, ttl)
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('ZADD', HOLDS_KEY, now_ms() + ttl * 1000, key)
+    end
+end
+
+-- Take (delta > 0) or give back (delta < 0) units of a product for the cart
+-- holding `key`. Returns false when fewer than `delta` units are available.
+local function reserve(key, pid, delta)
+    local stock_key = STOCK_PREFIX .. pid
+    local available = tonumber(redis.call('GET', stock_key))
+    if available == nil then
+        return true  -- stock not tracked
+    end
+    local held = tonumber(redis.call('HGET', key, pid)) or 0
+    if delta < 0 then
+        -- only what the cart holds, lines may predate the counter
+        delta = -math.min(-delta, held)
+    elseif available < delta and reclaim_expired(RECLAIM_LIMIT) > 0 then
+        available = tonumber(redis.call('GET', stock_key))
+    end
+    if delta == 0 then
+        return true
+    end
+    if available < delta then
+        return false
+    end
+
+    redis.call('DECRBY', stock_key, delta)
+    redis.call('HINCRBY', DELTAS_KEY, pid, -delta)
+    if held + delta > 0 then
+        redis.call('HSET', key, pid, held + delta)
+    else
+        redis.call('HDEL', key, pid)
+        if redis.call('EXISTS', key) == 0 then
+            redis.call('ZREM', HOLDS_KEY, key)
+        end
+    end
+    return true
+end
+"""
+
+# KEYS[1] stock:{id}, ARGV[1] product id, ARGV[2] Product.stock ("" if NULL),
+# ARGV[3] the last batch written to Postgres when it was read ("" if none)
+# Returns the counter, nil when the product is not tracked, or STALE.
+SYNC_STOCK = STOCK_HELPERS + f"""
+if ARGV[2] == '' then
+    redis.call('DEL', KEYS[1])
+    return nil
+end
+local pending = tonumber(redis.call('HGET', DELTAS_KEY, ARGV[1]) or 0)
+local written = redis.call('GET', WRITTEN_KEY)
+if redis.call('GET', BATCH_KEY) == ARGV[3] then
+    -- the batch being cleared is in Product.stock already
+elseif written and written ~= ARGV[3] then
+    return '{STALE}'
+else
+    pending = pending + tonumber(redis.call('HGET', FLUSHING_KEY, ARGV[1]) or 0)
+end
+local available = tonumber(ARGV[2]) + pending
+redis.call('SET', KEYS[1], available)
+return available
+"""
+
+# ARGV[1] max holds to release. Returns the number released.
+RECLAIM_HOLDS = STOCK_HELPERS + """
+return reclaim_expired(tonumber(ARGV[1]))
+"""
+
+# ARGV[1] id for a new batch
+# Moves the pending deltas aside as a new batch, unless a previous write-back
+# did not finish, and returns {batch id, deltas} ({} without deltas).
+TAKE_DELTAS = STOCK_HELPERS + """
+if redis.call('EXISTS', FLUSHING_KEY) == 0 then
+    if redis.call('EXISTS', DELTAS_KEY) == 0 then
+        return {}
+    end
+    redis.call('RENAME', DELTAS_KEY, FLUSHING_KEY)
+    redis.call('SET', BATCH_KEY, ARGV[1])
+end
+local batch = redis.call('GET', BATCH_KEY)
+if not batch then
+    batch = ARGV[1]
+    redis.call('SET', BATCH_KEY, batch)
+end
+return {batch, redis.call('HGETALL', FLUSHING_KEY)}
+"""
+
+# ARGV[1] batch id, written to Postgres
+FINISH_DELTAS = STOCK_HELPERS + """
+if redis.call('GET', BATCH_KEY) == ARGV[1] then
+    redis.call('DEL', FLUSHING_KEY, BATCH_KEY)
+    redis.call('SET', WRITTEN_KEY, ARGV[1])
+end
+"""
+
+_sync_stock_script = r.register_script(SYNC_STOCK)
+_reclaim_holds_script = r.register_script(RECLAIM_HOLDS)
+_take_deltas_script = r.register_script(TAKE_DELTAS)
+_finish_deltas_script = r.register_script(FINISH_DELTAS)
+
+
+def _read_stock(product_ids):
+    """(id, stock, last written batch) rows, from one snapshot of the table."""
+    last_batch = StockWriteBack.objects.order_by("-pk").values("batch")[:1]
+    return (
+        Product.objects.filter(pk__in=product_ids)
+        .annotate(last_batch=Subquery(last_batch))
+        .values_list("id", "stock", "last_batch")
+    )
+
+
+def sync_products(product_ids):
+    """
+    Reset the counters of the given products to Product.stock + the deltas
+    not in it yet: one query and one pipeline, again for the products a
+    write-back finished in between. Counters of products that are gone are
+    dropped. Returns {id: counter} of the tracked products.
+    """
+    product_ids = [int(product_id) for product_id in product_ids]
+    counters = {}
+    for _ in range(SYNC_ATTEMPTS):
+        if not product_ids:
+            return counters
+        rows = {pid: (stock, batch) for pid, stock, batch in _read_stock(product_ids)}
+
+        pipe = r.pipeline(transaction=False)
+        for product_id in product_ids:
+            stock, batch = rows.get(product_id, (None, None))
+            _sync_stock_script(
+                keys=[_stock_key(product_id)],
+                args=[product_id, "" if stock is None else stock, batch or ""],
+                client=pipe,
+            )
+
+        stale = []
+        for product_id, counter in zip(product_ids, pipe.execute()):
+            if counter == STALE:
+                stale.append(product_id)
+            elif counter is not None:
+                counters[product_id] = int(counter)
+        product_ids = stale
+
+    if product_ids:
+        raise RuntimeError(
+            f"Stock write-backs kept finishing while syncing products {product_ids}."
+        )
+    return counters
+
+
+def forget_product(product_id):
+    r.delete(_stock_key(product_id))
+
+
+def get_available(product_ids):
+    """{id: units available} for the tracked products among product_ids."""
+    product_ids = [int(product_id) for product_id in product_ids]
+    if not product_ids:
+        return {}
+    counters = r.mget([_stock_key(product_id) for product_id in product_ids])
+    return {
+        product_id: int(counter)
+        for product_id, counter in zip(product_ids, counters)
+        if counter is not None
+    }
+
+
+def reclaim_expired(chunk_size=1000):
+    """
+    Give back the units of every expired hold, `chunk_size` holds per script
+    so Redis is never blocked for long. Returns the number of holds released.
+    """
+    released = 0
+    while True:
+        count = _reclaim_holds_script(args=[chunk_size], client=r)
+        released += count
+        if count < chunk_size:
+            return released
+
+
+def write_back(chunk_size=1000):
+    """
+    Add the pending deltas to Product.stock, one UPDATE per `chunk_size`
+    products in a single transaction, and return them ({id: delta}).
+
+    The transaction also records the batch id. If the process dies before
+    the batch is cleared from Redis, the next call finds it recorded and
+    only clears it. Run one writer at a time.
+    """
+    taken = _take_deltas_script(args=[uuid.uuid4().hex], client=r)
+    if not taken:
+        return {}
+    batch, flat = taken
+    deltas = {
+        int(product_id): int(delta)
+        for product_id, delta in zip(flat[::2], flat[1::2])
+        if int(delta)
+    }
+    with transaction.atomic():
+        written, created = StockWriteBack.objects.get_or_create(batch=batch)
+        # only the last batch is ever looked up
+        StockWriteBack.objects.exclude(pk=written.pk).delete()
+        if created:
+            items = list(deltas.items())
+            for start in range(0, len(items), chunk_size):
+                chunk = items[start : start + chunk_size]
+                Product.objects.filter(pk__in=[pid for pid, _ in chunk]).update(
+                    stock=F("stock")
+                    + Case(
+                        *[When(pk=pid, then=Value(delta)) for pid, delta in chunk],
+                        default=Value(0),
+                    )
+                )
+    _finish_deltas_script(args=[batch], client=r)
+    return deltas
@@ -1,3 +1,649 @@
-from django.test import TestCase
+import io
+import json
+import time
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError
+from django.db.models.signals import post_delete, post_save
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from core import fast_json
+
+from . import (
+    catalog_loader,
+    category_tree,
+    local_cache,
+    product_cache,
+    response_cache,
+    search_index,
+    signals,
+    stock,
+    views,
+)
+from .management.commands import load_catalog
+from .models import Category, Product, StockWriteBack
+from .serializers import ProductSerializer
+
+
+class ProductCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        for patcher in (
+            mock.patch.object(product_cache, "r", self.redis),
+            mock.patch.object(stock, "r", self.redis),
+            mock.patch.object(response_cache, "r", self.redis),
+            mock.patch.object(search_index, "r", self.redis),
+            # no database here: run the after-commit hooks right away
+            mock.patch.object(
+                signals.transaction, "on_commit", side_effect=lambda func: func()
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        product_cache.mark_index_built()
+
+    def test_misses_are_loaded_from_db_and_cached(self):
+        product_cache.cache_products([(1, "Phone", Decimal("999.99"), True)])
+
+        with mock.patch.object(
+            product_cache,
+            "_fetch_from_db",
+            return_value=[(2, "Case", Decimal("5"), False)],
+        ) as fetch:
+            products = product_cache.get_products(["1", "2", "3"])
+
+        fetch.assert_called_once_with([2, 3])
+        self.assertEqual(
+            products,
+            {
+                1: {"name": "Phone", "price": 999.99, "is_active": True},
+                2: {"name": "Case", "price": 5.0, "is_active": False},
+            },
+        )
+        self.assertEqual(
+            self.redis.hgetall("product:2"),
+            {"name": "Case", "price": "5", "is_active": "0"},
+        )
+
+    def test_stale_index_version_falls_back_to_db(self):
+        product_cache.cache_products([(1, "Phone", Decimal("999.99"), True)])
+        self.redis.set(product_cache.INDEX_VERSION_KEY, product_cache.INDEX_VERSION - 1)
+
+        with mock.patch.object(
+            product_cache,
+            "_fetch_from_db",
+            return_value=[(1, "Phone", Decimal("899.99"), True)],
+        ) as fetch:
+            products = product_cache.get_products([1])
+
+        fetch.assert_called_once_with([1])
+        self.assertEqual(products[1]["price"], 899.99)
+
+    def test_signals_keep_the_cache_fresh(self):
+        product = Product(
+            id=1, name="Phone", price=Decimal("10.00"), is_active=True, stock=7
+        )
+
+        with mock.patch.object(stock, "_read_stock", return_value=[(1, 7, None)]):
+            post_save.send(sender=Product, instance=product, created=True)
+        self.assertEqual(self.redis.hget("product:1", "price"), "10.00")
+        self.assertEqual(stock.get_available([1]), {1: 7})
+
+        product.is_active = False
+        with mock.patch.object(stock, "_read_stock", return_value=[(1, 7, None)]):
+            post_save.send(sender=Product, instance=product, created=False)
+        self.assertEqual(self.redis.hget("product:1", "is_active"), "0")
+
+        post_delete.send(sender=Product, instance=product)
+        self.assertEqual(self.redis.hgetall("product:1"), {"is_active": "-"})
+        self.assertEqual(product_cache.get_products([1]), {})
+        self.assertEqual(stock.get_available([1]), {})
+
+    def test_signals_write_nothing_before_commit(self):
+        product = Product(id=1, name="Phone", price=Decimal("10"), is_active=True)
+
+        with mock.patch.object(signals.transaction, "on_commit") as on_commit:
+            post_save.send(sender=Product, instance=product, created=True)
+            post_delete.send(sender=Product, instance=product)
+
+        self.assertEqual(on_commit.call_count, 4)
+        self.assertEqual(
+            self.redis.keys("product:*"), [product_cache.INDEX_VERSION_KEY]
+        )
+
+    def test_miss_fills_do_not_overwrite_newer_entries(self):
+        # the row was read, then a save committed and its signal wrote first
+        def read_then_save(product_ids):
+            product_cache.cache_products([(1, "New", Decimal("2"), True)])
+            return [(1, "Old", Decimal("1"), True)]
+
+        with mock.patch.object(
+            product_cache, "_fetch_from_db", side_effect=read_then_save
+        ):
+            self.assertEqual(product_cache.get_products([1])[1]["name"], "Old")
+
+        self.assertEqual(product_cache.get_products([1])[1]["name"], "New")
+
+    def test_product_edits_keep_the_written_back_stock(self):
+        with mock.patch.object(stock, "_read_stock", return_value=[(1, 5, None)]):
+            stock.sync_products([1])
+        # read before a cart took 2 units, written back while it was edited
+        product = Product(id=1, name="Phone", price=Decimal("10.00"), stock=5)
+        product._state.adding = False
+        self.redis.incrby(stock._stock_key(1), -2)
+        self.redis.hincrby(stock.DELTAS_KEY, 1, -2)
+        with (
+            mock.patch.object(stock, "transaction"),
+            mock.patch.object(
+                StockWriteBack.objects,
+                "get_or_create",
+                return_value=(StockWriteBack(pk=1), True),
+            ) as get_or_create,
+            mock.patch.object(StockWriteBack.objects, "exclude"),
+            mock.patch.object(Product.objects, "filter"),
+        ):
+            stock.write_back()
+        batch = get_or_create.call_args.kwargs["batch"]
+
+        product.name = "Phone 2"
+        with mock.patch.object(Product, "save_base") as save_base:
+            product.save()
+        fields = save_base.call_args.kwargs["update_fields"]
+        self.assertIn("name", fields)
+        self.assertNotIn("stock", fields)
+
+        # the sync after commit reads the row as written back
+        with mock.patch.object(stock, "_read_stock", return_value=[(1, 3, batch)]):
+            post_save.send(sender=Product, instance=product, created=False)
+        self.assertEqual(stock.get_available([1]), {1: 3})
+
+
+class LRUCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = local_cache.LRUCache(max_size=2, ttl=10, clock=lambda: self.now)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.set_many({1: "a", 2: "b"})
+        self.cache.get(1)
+        self.cache.set(3, "c")
+
+        self.assertEqual(self.cache.get_many([1, 2, 3]), {1: "a", 3: "c"})
+        self.assertEqual(
+            self.cache.stats(),
+            {
+                "size": 2,
+                "max_size": 2,
+                "hits": 3,
+                "misses": 1,
+                "evictions": 1,
+                "expirations": 0,
+            },
+        )
+
+    def test_entries_expire_after_ttl(self):
+        self.cache.set(1, "a")
+        self.now = 10
+
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+
+    def test_values_loaded_before_an_invalidation_are_not_stored(self):
+        generation = self.cache.generation
+        self.cache.delete(1)
+
+        self.cache.set(1, "stale", if_generation=generation)
+
+        self.assertIsNone(self.cache.get(1))
+
+
+class LocalProductCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        for patcher in (
+            mock.patch.object(product_cache, "r", self.redis),
+            mock.patch.object(stock, "r", self.redis),
+            mock.patch.object(response_cache, "r", self.redis),
+            mock.patch.object(search_index, "r", self.redis),
+            # no database here: run the after-commit hooks right away
+            mock.patch.object(
+                signals.transaction, "on_commit", side_effect=lambda func: func()
+            ),
+            mock.patch.object(stock, "_read_stock", return_value=[]),
+            mock.patch.object(local_cache, "pubsub_r", self.redis),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(local_cache.stop_listener)
+        product_cache.mark_index_built()
+        product_cache.cache_products([(1, "Phone", Decimal("10"), True)])
+
+    def wait_until_dropped(self, key):
+        deadline = time.monotonic() + 2
+        while local_cache.cache.get(key) is not None:
+            self.assertLess(time.monotonic(), deadline, f"{key!r} still cached")
+            time.sleep(0.01)
+
+    def test_hits_do_not_read_redis(self):
+        local_cache.get_products([1])
+        self.redis.delete("product:1")
+
+        self.assertEqual(local_cache.get_products([1])[1]["name"], "Phone")
+
+    def test_signals_invalidate_every_worker(self):
+        local_cache.get_products([1])
+        product = Product(id=1, name="Phone", price=Decimal("12.00"), is_active=True)
+
+        post_save.send(sender=Product, instance=product, created=False)
+
+        self.wait_until_dropped(1)
+        self.assertEqual(local_cache.get_products([1])[1]["price"], 12.0)
+
+    def test_unreachable_redis_bypasses_the_local_cache(self):
+        with mock.patch.object(
+            self.redis, "pubsub", side_effect=local_cache.redis.ConnectionError
+        ):
+            local_cache.get_products([1])
+
+        self.assertEqual(local_cache.stats()["size"], 0)
+
+
+class ProductListViewTests(SimpleTestCase):
+    rows = [
+        (1, "Phone", Decimal("10.00")),
+        (2, "Café", Decimal("3.50")),
+        (3, "Case", Decimal("1.00")),
+    ]
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        self.load = mock.Mock(return_value=[{"id": 1, "name": "Café"}])
+        for patcher in (
+            mock.patch.object(response_cache, "r", self.redis),
+            mock.patch.object(Product.objects, "order_by"),
+            mock.patch.object(views.ProductListAPIView, "load_products", self.load),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        order_by = Product.objects.order_by
+        self.iterator = order_by.return_value.values_list.return_value.iterator
+        self.iterator.return_value = iter(self.rows)
+
+    def get(self, etag=None, **params):
+        headers = {"If-None-Match": etag} if etag else {}
+        request = APIRequestFactory().get("/api/products/", params, headers=headers)
+        return views.ProductListAPIView.as_view()(request)
+
+    def test_list_is_served_from_redis_until_the_catalog_changes(self):
+        first = self.get()
+        second = self.get()
+
+        self.load.assert_called_once()
+        self.assertEqual(json.loads(second.content), [{"id": 1, "name": "Café"}])
+        self.assertEqual(second["ETag"], first["ETag"])
+
+        response_cache.bump_catalog_version()
+        third = self.get()
+        self.assertEqual(self.load.call_count, 2)
+        self.assertNotEqual(third["ETag"], first["ETag"])
+
+    def test_matching_etag_is_answered_304_without_building(self):
+        etag = self.get()["ETag"]
+        self.load.reset_mock()
+
+        response = self.get(etag=f'W/"other", {etag}')
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.load.assert_not_called()
+
+    def test_pages_are_cached_separately(self):
+        with mock.patch.object(
+            views.ProductListAPIView,
+            "paginated_products",
+            side_effect=lambda request: {"page": request.GET["page_size"]},
+        ):
+            two = self.get(page_size=2)
+            three = self.get(page_size=3)
+            self.assertEqual(json.loads(self.get(page_size=2).content), {"page": "2"})
+
+        self.assertNotEqual(two["ETag"], three["ETag"])
+        self.assertEqual(json.loads(three.content), {"page": "3"})
+
+    def test_stream_matches_the_serializer(self):
+        chunks = list(views.stream_product_list(chunk_size=2))
+
+        self.iterator.assert_called_once_with(chunk_size=2)
+        self.assertEqual(len(chunks), 4)  # "[", 2 rows, 1 row, "]"
+        expected = ProductSerializer(
+            [Product(id=pid, name=name, price=price) for pid, name, price in self.rows],
+            many=True,
+        ).data
+        self.assertEqual(json.loads("".join(chunks)), expected)
+
+    def test_fast_json_path_renders_the_serializer_output(self):
+        queryset = mock.Mock()
+        queryset.values.return_value = [
+            {"id": pid, "name": name, "price": price} for pid, name, price in self.rows
+        ]
+        products = [
+            Product(id=pid, name=name, price=price) for pid, name, price in self.rows
+        ]
+        default = fast_json.render(views.serialize_products(products))
+
+        with override_settings(FAST_JSON_RESPONSES=True):
+            rows = views.product_rows(queryset)
+            fast = fast_json.render(views.serialize_products(rows))
+
+        queryset.values.assert_called_once_with("id", "name", "price")
+        self.assertEqual(fast, default)
+
+    @override_settings(PRODUCT_LIST_STREAM_CHUNK_SIZE=2)
+    def test_stream_mode_returns_a_streaming_response(self):
+        response = self.get(stream="1")
+
+        self.assertTrue(response.streaming)
+        body = b"".join(response.streaming_content)
+        self.assertEqual([p["id"] for p in json.loads(body)], [1, 2, 3])
+
+        self.assertEqual(self.get(etag=response["ETag"], stream="1").status_code, 304)
+
+
+class CategoryTreeTests(SimpleTestCase):
+    rows = [
+        (1, None, "electronics"),
+        (2, 1, "phones"),
+        (3, 1, "laptops"),
+        (4, 2, "smartphones"),
+        (5, None, "books"),
+    ]
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        self.fetch = mock.Mock(return_value=self.rows)
+        for patcher in (
+            mock.patch.object(category_tree, "r", self.redis),
+            mock.patch.object(response_cache, "r", self.redis),
+            mock.patch.object(category_tree, "_fetch_categories", self.fetch),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tree(self):
+        """Every key of the tree, to compare incremental updates with a build."""
+        tree = {}
+        for key in self.redis.scan_iter("category:*"):
+            kind = self.redis.type(key)
+            if kind == "set":
+                tree[key] = self.redis.smembers(key)
+            elif kind == "hash":
+                tree[key] = self.redis.hgetall(key)
+        return tree
+
+    def test_tree_is_built_on_first_read(self):
+        self.assertEqual(category_tree.subtree_ids("electronics"), [1, 2, 3, 4])
+        self.assertEqual(category_tree.subtree_ids("phones"), [2, 4])
+        self.assertIsNone(category_tree.subtree_ids("toys"))
+        self.fetch.assert_called_once()
+
+    def test_incremental_updates_match_a_full_build(self):
+        category_tree.build_tree()
+
+        # phones (and smartphones) move under books, laptops is renamed,
+        # a new leaf is added and one is deleted
+        category_tree.update_category(Category(id=2, parent_id=5, slug="phones"))
+        category_tree.update_category(Category(id=3, parent_id=1, slug="notebooks"))
+        category_tree.update_category(Category(id=6, parent_id=4, slug="android"))
+        category_tree.update_category(Category(id=7, parent_id=6, slug="pixel"))
+        category_tree.remove_category(7)
+        incremental = self.tree()
+
+        self.fetch.return_value = [
+            (1, None, "electronics"),
+            (2, 5, "phones"),
+            (3, 1, "notebooks"),
+            (4, 2, "smartphones"),
+            (5, None, "books"),
+            (6, 4, "android"),
+        ]
+        category_tree.build_tree()
+        self.assertEqual(incremental, self.tree())
+        self.assertEqual(category_tree.subtree_ids("books"), [2, 4, 5, 6])
+
+    def test_updates_wait_for_a_full_build(self):
+        category_tree.update_category(Category(id=2, parent_id=5, slug="phones"))
+
+        self.assertEqual(self.redis.keys("category:*"), [category_tree.VERSION_KEY])
+
+    def test_build_reads_again_after_a_concurrent_update(self):
+        moved = [(2, 5, "phones") if row[0] == 2 else row for row in self.rows]
+
+        def fetch():
+            if self.fetch.call_count == 1:
+                # committed after the read, applied before the MULTI
+                category_tree.update_category(
+                    Category(id=2, parent_id=5, slug="phones")
+                )
+                return self.rows
+            return moved
+
+        self.fetch.side_effect = fetch
+        self.assertEqual(category_tree.build_tree(), 5)
+
+        self.assertEqual(self.fetch.call_count, 2)
+        self.assertEqual(category_tree.subtree_ids("books"), [2, 4, 5])
+
+    def test_signals_wait_for_the_commit(self):
+        category_tree.build_tree()
+        phones = Category(id=2, parent_id=5, slug="phones")
+        laptops = Category(id=3, parent_id=1, slug="laptops")
+
+        with mock.patch.object(signals.transaction, "on_commit") as on_commit:
+            post_save.send(sender=Category, instance=phones, created=False)
+            post_delete.send(sender=Category, instance=laptops)
+        self.assertEqual(category_tree.subtree_ids("books"), [5])
+        self.assertEqual(category_tree.subtree_ids("laptops"), [3])
+
+        for call in on_commit.call_args_list:
+            call.args[0]()
+        self.assertEqual(category_tree.subtree_ids("books"), [2, 4, 5])
+        self.assertIsNone(category_tree.subtree_ids("laptops"))
+
+    def test_subtree_endpoint(self):
+        view = views.CategoryProductsAPIView.as_view()
+        with mock.patch.object(
+            views.CategoryProductsAPIView,
+            "paginated_products",
+            side_effect=lambda request, ids: {"categories": ids},
+        ):
+            request = APIRequestFactory().get("/api/categories/phones/products/")
+            response = view(request, slug="phones")
+            missing = view(request, slug="toys")
+
+        self.assertEqual(json.loads(response.content), {"categories": [2, 4]})
+        self.assertEqual(missing.status_code, 404)
+
+
+class SearchIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patcher = mock.patch.object(search_index, "r", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def index(self, *products):
+        search_index.index_products(
+            [(pid, name, f"product-{pid}", True) for pid, name in products]
+        )
+
+    def test_any_word_prefix_matches_once(self):
+        self.index((1, "Apple iPhone 15"), (2, "Crème Brûlée"), (3, "iPad Pro"))
+
+        self.assertEqual(
+            search_index.suggest("IPH"), [{"id": 1, "name": "Apple iPhone 15"}]
+        )
+        self.assertEqual(
+            search_index.suggest("i"),
+            [{"id": 3, "name": "iPad Pro"}, {"id": 1, "name": "Apple iPhone 15"}],
+        )
+        self.assertEqual(
+            search_index.suggest("creme  bru"), [{"id": 2, "name": "Crème Brûlée"}]
+        )
+        self.assertEqual(len(search_index.suggest("product-", limit=2)), 2)
+        self.assertEqual(search_index.suggest("  "), [])
+
+    def test_updates_replace_the_old_terms(self):
+        self.index((1, "Apple iPhone 15"))
+        search_index.index_products([(1, "Pixel 9", "pixel-9", True)])
+        self.assertEqual(search_index.suggest("iphone"), [])
+        self.assertEqual(search_index.suggest("9"), [{"id": 1, "name": "Pixel 9"}])
+
+        search_index.index_products([(1, "Pixel 9", "pixel-9", False)])
+        self.assertEqual(search_index.suggest("pixel"), [])
+
+        self.index((2, "Pixel 8"))
+        search_index.remove_product(2)
+        self.assertEqual(self.redis.keys("suggest:*"), [])
+
+    def test_rebuild_command_streams_active_products(self):
+        self.index((1, "Apple iPhone 15"), (9, "Gone"))
+        rows = [(1, "Pixel 9", "pixel-9", True), (2, "Pixel 8", "pixel-8", True)]
+        with mock.patch.object(Product.objects, "filter") as query:
+            query.return_value.values_list.return_value.iterator.return_value = rows
+            call_command("rebuild_search_index", "--chunk-size=1", stdout=mock.Mock())
+
+        self.assertEqual([s["id"] for s in search_index.suggest("pixel")], [2, 1])
+        self.assertEqual(search_index.suggest("gone"), [])
+        self.assertEqual(
+            sorted(self.redis.keys("suggest:*")),
+            [search_index.INDEX_KEY, search_index.MEMBERS_KEY],
+        )
+        self.assertEqual(self.redis.hkeys(search_index.MEMBERS_KEY), ["1", "2"])
+
+    def test_saves_during_a_rebuild_are_kept(self):
+        self.index((1, "Apple iPhone 15"), (2, "iPad Pro"))
+
+        search_index.start_rebuild()
+        search_index.index_products([(1, "Apple iPhone 15", "iphone", True)], True)
+        # renamed after its chunk, and before the chunk that read the old row
+        self.index((1, "Pixel 9"), (2, "Pixel 8"))
+        search_index.index_products([(2, "iPad Pro", "ipad", True)], True)
+        self.assertEqual(search_index.finish_rebuild(), 2)
+
+        self.assertEqual(search_index.suggest("iphone"), [])
+        self.assertEqual(search_index.suggest("ipad"), [])
+        self.assertEqual([s["id"] for s in search_index.suggest("pixel")], [2, 1])
+
+    def test_failed_or_timed_out_rebuilds_stop_the_double_writes(self):
+        self.index((1, "Apple iPhone 15"))
+        rows = mock.MagicMock()
+        rows.__iter__.side_effect = DatabaseError
+        with mock.patch.object(Product.objects, "filter") as query:
+            query.return_value.values_list.return_value.iterator.return_value = rows
+            with self.assertRaises(DatabaseError):
+                call_command("rebuild_search_index", stdout=mock.Mock())
+        self.assertEqual(
+            sorted(self.redis.keys("suggest:*")),
+            [search_index.INDEX_KEY, search_index.MEMBERS_KEY],
+        )
+
+        search_index.start_rebuild()
+        self.assertGreater(
+            self.redis.ttl(search_index.SAVED_KEY), search_index.REBUILD_TIMEOUT - 5
+        )
+        search_index.index_products([(2, "Pixel 9", "pixel-9", True)], True)
+        self.redis.delete(search_index.SAVED_KEY)  # expired
+        self.index((1, "Pixel 8"))
+        self.assertIsNone(search_index.finish_rebuild())
+        self.assertEqual([s["id"] for s in search_index.suggest("pixel")], [1])
+        self.assertEqual(
+            sorted(self.redis.keys("suggest:*")),
+            [search_index.INDEX_KEY, search_index.MEMBERS_KEY],
+        )
+
+    def test_suggest_endpoint(self):
+        self.index((1, "Apple iPhone 15"), (2, "Apple Watch"))
+        view = views.ProductSuggestAPIView.as_view()
+
+        response = view(APIRequestFactory().get("/api/products/suggest/?q=app&limit=1"))
+
+        self.assertEqual(response.data, [{"id": 1, "name": "Apple iPhone 15"}])
+
+
+class CatalogLoaderTests(SimpleTestCase):
+    def test_header_is_checked_against_the_table(self):
+        stream = io.BytesIO(b"id,name,slug,price\n1,Pen,pen,1.50\n")
+        self.assertEqual(
+            catalog_loader.read_header(stream, Product), ["id", "name", "slug", "price"]
+        )
+        self.assertEqual(stream.read(), b"1,Pen,pen,1.50\n")
+
+        for header in (b"id,colour\n", b"name,slug\n", b"id,name,name\n"):
+            with self.assertRaises(ValueError):
+                catalog_loader.read_header(io.BytesIO(header), Product)
+
+    def test_upsert_updates_only_the_feed_columns(self):
+        sql = catalog_loader.upsert_sql(Product, ["id", "price"], "staging")
+
+        self.assertIn(
+            '("id", "price", "is_digital", "is_active", "created_at") '
+            'SELECT "id", "price", false, false, NOW() FROM "staging"',
+            sql,
+        )
+        self.assertIn('ON CONFLICT (id) DO UPDATE SET "price" = EXCLUDED."price"', sql)
+        self.assertTrue(sql.endswith("RETURNING id"))
+
+        # stock is written back from Redis, a feed only sets it on new rows
+        sql = catalog_loader.upsert_sql(Product, ["id", "price", "stock"], "staging")
+        self.assertIn('DO UPDATE SET "price" = EXCLUDED."price" RETURNING', sql)
+
+    def test_load_streams_the_rows_through_copy(self):
+        cursor = mock.MagicMock()
+        cursor.fetchall.return_value = [(1,), (2,)]
+        copy = cursor.copy.return_value.__enter__.return_value
+        stream = io.BytesIO(b"id,name\n1,a\n2,b\n")
+
+        ids = catalog_loader.load(cursor, Category, stream, block_size=4)
+
+        self.assertEqual(ids, [1, 2])
+        self.assertIn("FROM STDIN", cursor.copy.call_args.args[0])
+        self.assertEqual(
+            b"".join(call.args[0] for call in copy.write.call_args_list), b"1,a\n2,b\n"
+        )
+        statements = [call.args[0] for call in cursor.execute.call_args_list]
+        self.assertTrue(statements[0].startswith("CREATE TEMPORARY TABLE"))
+        self.assertFalse(any("DROP TABLE" in sql for sql in statements))
+
+    def test_load_reports_rows_the_merge_refuses(self):
+        with (
+            mock.patch.object(load_catalog, "transaction"),
+            mock.patch.object(load_catalog, "connection"),
+            mock.patch.object(
+                catalog_loader, "load", side_effect=IntegrityError("duplicate slug")
+            ),
+        ):
+            with self.assertRaisesMessage(
+                CommandError, "was not loaded: duplicate slug"
+            ):
+                call_command("load_catalog", f"--products={__file__}")
+
+    def test_refresh_rewrites_the_redis_entries(self):
+        redis = fakeredis.FakeRedis(decode_responses=True)
+        rows = [(1, "Pen", Decimal("1.50"), True, "pen")]
+        with (
+            mock.patch.object(product_cache, "r", redis),
+            mock.patch.object(stock, "r", redis),
+            mock.patch.object(search_index, "r", redis),
+            mock.patch.object(Product.objects, "filter") as query,
+            mock.patch.object(stock, "_read_stock", return_value=[(1, 7, None)]),
+        ):
+            query.return_value.values_list.return_value = rows
+            catalog_loader.refresh_caches([1])
+
+            self.assertEqual(redis.hget("product:1", "name"), "Pen")
+            self.assertEqual(stock.get_available([1]), {1: 7})
+            self.assertEqual(search_index.suggest("pe"), [{"id": 1, "name": "Pen"}])
@@ -1,6 +1,12 @@
 from django.urls import path
-from .views import ProductListAPIView
+from .views import CategoryProductsAPIView, ProductListAPIView, ProductSuggestAPIView
 
 urlpatterns = [
     path("products/", ProductListAPIView.as_view(), name="product_list"),
+    path("products/suggest/", ProductSuggestAPIView.as_view(), name="product_suggest"),
+    path(
+        "categories/<slug:slug>/products/",
+        CategoryProductsAPIView.as_view(),
+        name="category_products",
+    ),
 ]
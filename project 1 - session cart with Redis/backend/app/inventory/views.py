@@ -1,11 +1,152 @@
+import json
+
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
+from rest_framework.pagination import CursorPagination
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from core import fast_json
+from . import category_tree, response_cache, search_index
 from .models import Product
 from .serializers import ProductSerializer
 
+PAGE_PARAMS = ("cursor", "page_size")
+PRODUCT_FIELDS = ("id", "name", "price")
+
+
+def product_rows(queryset):
+    """
+    The products of `queryset` with ProductSerializer's fields: plain dicts
+    from .values() on the fast JSON path (core/fast_json.py), else instances.
+    """
+    if fast_json.enabled():
+        return queryset.values(*PRODUCT_FIELDS)
+    return queryset.only(*PRODUCT_FIELDS)
+
+
+def serialize_products(products):
+    if fast_json.enabled():
+        return list(products)
+    return ProductSerializer(products, many=True).data
+
+
+class ProductCursorPagination(CursorPagination):
+    # keyset pagination: each page is `WHERE id > <last id> ORDER BY id LIMIT n`,
+    # as cheap on the last page as on the first
+    ordering = "id"
+    page_size = settings.PRODUCT_LIST_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.PRODUCT_LIST_MAX_PAGE_SIZE
+
+
+def stream_product_list(chunk_size):
+    """
+    The product list as JSON chunks, same fields as ProductSerializer. Rows
+    are read `chunk_size` at a time with a server-side cursor and encoded
+    without model instances, so memory does not grow with the catalog.
+    """
+    rows = (
+        Product.objects.order_by("id")
+        .values_list("id", "name", "price")
+        .iterator(chunk_size=chunk_size)
+    )
+    yield "["
+    separator = ""
+    chunk = []
+    for product_id, name, price in rows:
+        chunk.append(
+            json.dumps(
+                {"id": product_id, "name": name, "price": str(price)},
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+        )
+        if len(chunk) == chunk_size:
+            yield separator + ",".join(chunk)
+            separator = ","
+            chunk = []
+    if chunk:
+        yield separator + ",".join(chunk)
+    yield "]"
+
 
 class ProductListAPIView(APIView):
+    pagination_class = ProductCursorPagination
+
+    def get(self, request):
+        params = request.query_params
+        if params.get("stream") in ("1", "true"):
+            return self.streamed_products(request)
+        # rendered bodies are cached in Redis until the catalog changes, and
+        # revalidated with ETag / If-None-Match
+        variant = response_cache.variant_of(request, PAGE_PARAMS)
+        if any(name in params for name in PAGE_PARAMS):
+            return response_cache.cached_response(
+                request, variant, lambda: self.paginated_products(request)
+            )
+        return response_cache.cached_response(request, variant, self.load_products)
+
+    def streamed_products(self, request):
+        etag, not_modified = response_cache.check_not_modified(
+            request, response_cache.variant_of(request, ["stream"])
+        )
+        if not_modified:
+            return not_modified
+        return StreamingHttpResponse(
+            stream_product_list(settings.PRODUCT_LIST_STREAM_CHUNK_SIZE),
+            content_type="application/json",
+            headers={"ETag": etag},
+        )
+
+    def paginated_products(self, request):
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(
+            product_rows(Product.objects.all()), request, view=self
+        )
+        return paginator.get_paginated_response(serialize_products(page)).data
+
+    @staticmethod
+    def load_products():
+        return list(serialize_products(product_rows(Product.objects.all())))
+
+
+class CategoryProductsAPIView(APIView):
+    """Products of a category and all its subcategories, paginated by id."""
+
+    pagination_class = ProductCursorPagination
+
+    def get(self, request, slug):
+        # subtree ids from the Redis closure (category_tree.py), then a
+        # single category_id__in query per page
+        category_ids = category_tree.subtree_ids(slug)
+        if category_ids is None:
+            raise Http404("No such category.")
+        return response_cache.cached_response(
+            request,
+            response_cache.variant_of(request, PAGE_PARAMS),
+            lambda: self.paginated_products(request, category_ids),
+        )
+
+    def paginated_products(self, request, category_ids):
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(
+            product_rows(Product.objects.filter(category_id__in=category_ids)),
+            request,
+            view=self,
+        )
+        return paginator.get_paginated_response(serialize_products(page)).data
+
+
+class ProductSuggestAPIView(APIView):
+    """Type-ahead: active products with a word of name or slug starting with ?q=."""
+
     def get(self, request):
-        products = Product.objects.all()
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+        # a single ZRANGEBYLEX on the Redis autocomplete index, no Postgres
+        try:
+            limit = int(
+                request.query_params.get("limit", settings.PRODUCT_SUGGEST_LIMIT)
+            )
+        except ValueError:
+            limit = settings.PRODUCT_SUGGEST_LIMIT
+        limit = max(1, min(limit, settings.PRODUCT_SUGGEST_MAX_LIMIT))
+        return Response(search_index.suggest(request.query_params.get("q", ""), limit))
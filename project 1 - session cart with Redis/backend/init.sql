@@ -17,7 +17,13 @@ CREATE TABLE inventory_product (
     is_active BOOLEAN NOT NULL DEFAULT FALSE,
     created_at TIMESTAMP NOT NULL DEFAULT NOW(),
     updated_at TIMESTAMP,
-    price NUMERIC(10,2) NOT NULL
+    price NUMERIC(10,2) NOT NULL,
+    stock INTEGER NULL
+);
+CREATE TABLE inventory_stockwriteback (
+    id BIGSERIAL PRIMARY KEY,
+    batch VARCHAR(32) NOT NULL UNIQUE,
+    written_at TIMESTAMP NOT NULL DEFAULT NOW()
 );
 
 -- Load data into tables
@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
-import redis.asyncio as redis
+from A_core.redis_client import create_async_redis_client, create_redis_client
 import os
 from dotenv import load_dotenv  # if using python-dotenv
 
@@ -104,12 +104,54 @@ print("POSTGRES_PORT:", os.environ.get("POSTGRES_PORT"))
 print("#######################################")
 
 
-REDIS_CLIENT = redis.Redis(
-    host=os.environ.get("REDIS_HOST", "redis"),
-    port=int(os.environ.get("REDIS_PORT", 6379)),
-    db=int(os.environ.get("REDIS_DB", 0)),
-    decode_responses=os.environ.get("REDIS_DECODE_RESPONSES", "True") == "True",
+# Connection pool, timeouts, retries and health checks, see A_core/redis_client.py.
+# Commands wait up to REDIS_POOL_TIMEOUT seconds for a free connection once
+# all REDIS_MAX_CONNECTIONS are in use.
+REDIS_POOL_OPTIONS = {
+    "max_connections": int(os.environ.get("REDIS_MAX_CONNECTIONS", 50)),
+    "pool_timeout": float(os.environ.get("REDIS_POOL_TIMEOUT", 5)),
+    "socket_timeout": float(os.environ.get("REDIS_SOCKET_TIMEOUT", 2)),
+    "socket_connect_timeout": float(os.environ.get("REDIS_CONNECT_TIMEOUT", 2)),
+    "retries": int(os.environ.get("REDIS_RETRIES", 3)),
+    "health_check_interval": int(os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", 30)),
+}
+
+REDIS_OPTIONS = {
+    "host": os.environ.get("REDIS_HOST", "redis"),
+    "port": int(os.environ.get("REDIS_PORT", 6379)),
+    "db": int(os.environ.get("REDIS_DB", 0)),
+    "decode_responses": os.environ.get("REDIS_DECODE_RESPONSES", "True") == "True",
+    **REDIS_POOL_OPTIONS,
+}
+
+# redis.asyncio client, created lazily for each event loop it is used on
+REDIS_CLIENT = create_async_redis_client(**REDIS_OPTIONS)
+# for sync code (signals, management commands), which has no event loop to
+# reuse: async_to_sync would build a client per call
+REDIS_SYNC_CLIENT = create_redis_client(**REDIS_OPTIONS)
+# subscriptions of app_polls/services/poll_stream_services.py: no read
+# timeout, they wait for messages
+REDIS_PUBSUB_CLIENT = create_async_redis_client(
+    **{**REDIS_OPTIONS, "socket_timeout": None}
+)
+
+# Poll metadata cache (app_polls/services/poll_meta_services.py): Redis
+# entries live POLL_META_CACHE_TTL seconds (unknown ids POLL_META_MISSING_TTL),
+# and each worker keeps up to POLL_META_LOCAL_SIZE polls for
+# POLL_META_LOCAL_TTL seconds.
+POLL_META_CACHE_TTL = int(os.environ.get("POLL_META_CACHE_TTL", 3600))
+POLL_META_MISSING_TTL = int(os.environ.get("POLL_META_MISSING_TTL", 60))
+POLL_META_LOCAL_TTL = float(os.environ.get("POLL_META_LOCAL_TTL", 2))
+POLL_META_LOCAL_SIZE = int(os.environ.get("POLL_META_LOCAL_SIZE", 1000))
+# /polls/{id}/result is served from a per-worker snapshot at most this many
+# seconds old (e.g. 0.25); 0 reads the live tally on every request.
+POLL_RESULTS_MAX_STALENESS = float(os.environ.get("POLL_RESULTS_MAX_STALENESS", 0))
+# /polls/{id}/stream sends each client at most this many updates per second
+# per poll, and a keepalive comment after POLL_STREAM_KEEPALIVE idle seconds.
+POLL_STREAM_MAX_UPDATES_PER_SECOND = float(
+    os.environ.get("POLL_STREAM_MAX_UPDATES_PER_SECOND", 2)
 )
+POLL_STREAM_KEEPALIVE = float(os.environ.get("POLL_STREAM_KEEPALIVE", 15))
 
 
 # Password validation
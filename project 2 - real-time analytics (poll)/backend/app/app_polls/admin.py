@@ -6,5 +6,6 @@ from .models import Poll
 
 @admin.register(Poll)
 class PollAdmin(admin.ModelAdmin):
-    list_display = ("id", "question")
+    list_display = ("id", "question", "dedup_mode")
+    list_filter = ("dedup_mode",)
     search_fields = ("question",)
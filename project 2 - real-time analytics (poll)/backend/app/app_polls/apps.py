@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AppPollsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app_polls'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (registers the receivers)
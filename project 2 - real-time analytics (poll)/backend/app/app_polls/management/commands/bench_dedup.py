@@ -0,0 +1,118 @@
+import time
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app_polls.services.voter_dedup_services import (
+    bloom_false_positive_rate,
+    bloom_positions,
+    bloom_size,
+)
+
+KEY_PREFIX = "bench:dedup"
+BATCH = 10_000
+
+
+def voter(i: int) -> str:
+    return f"user-{i}"
+
+
+def bloom_bitmap(count: int, bits: int, hashes: int) -> bytearray:
+    """The bitmap SETBIT would build for `count` voters (bit 0 = first byte's MSB)."""
+    bitmap = bytearray((bits + 7) // 8)
+    for i in range(count):
+        for pos in bloom_positions(voter(i), bits, hashes):
+            bitmap[pos >> 3] |= 0x80 >> (pos & 7)
+    return bitmap
+
+
+def bloom_contains(bitmap: bytearray, item: str, bits: int, hashes: int) -> bool:
+    return all(
+        bitmap[pos >> 3] & (0x80 >> (pos & 7))
+        for pos in bloom_positions(item, bits, hashes)
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Memory and accuracy of the voter dedup modes (services/"
+        "voter_dedup_services.py) for polls of N voters, measured with MEMORY "
+        f"USAGE on the configured Redis, under {KEY_PREFIX}:* keys removed "
+        "afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--voters", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+        )
+        parser.add_argument("--error-rate", type=float, default=0.001)
+        parser.add_argument(
+            "--probes",
+            type=int,
+            default=100_000,
+            help="New voters checked against each Bloom filter",
+        )
+
+    def handle(self, *args, **options):
+        async_to_sync(self.run)(options)
+
+    async def run(self, options):
+        r = settings.REDIS_CLIENT
+        self.stdout.write(
+            f"{'voters':>10} {'mode':>6} {'bytes':>13} {'bytes/voter':>12} "
+            f"{'error':>22} {'seconds':>8}"
+        )
+        try:
+            for count in options["voters"]:
+                await self.bench_set(r, count)
+                await self.bench_bloom(r, count, options)
+                await self.bench_hll(r, count)
+        finally:
+            keys = [key async for key in r.scan_iter(f"{KEY_PREFIX}:*")]
+            if keys:
+                await r.delete(*keys)
+
+    def report(self, count, mode, size, error, started):
+        self.stdout.write(
+            f"{count:>10,} {mode:>6} {size:>13,} {size / count:>12.2f} "
+            f"{error:>22} {time.perf_counter() - started:>8.1f}"
+        )
+
+    async def bench_set(self, r, count):
+        started = time.perf_counter()
+        key = f"{KEY_PREFIX}:set:{count}"
+        for first in range(0, count, BATCH):
+            last = min(first + BATCH, count)
+            await r.sadd(key, *(voter(i) for i in range(first, last)))
+        size = await r.memory_usage(key, samples=0)
+        self.report(count, "set", size, "exact", started)
+
+    async def bench_bloom(self, r, count, options):
+        started = time.perf_counter()
+        key = f"{KEY_PREFIX}:bloom:{count}"
+        bits, hashes = bloom_size(count, options["error_rate"])
+        # built here and written at once: the same bitmap as count * hashes
+        # SETBITs, without as many commands
+        bitmap = bloom_bitmap(count, bits, hashes)
+        await r.set(key, bytes(bitmap))
+        size = await r.memory_usage(key, samples=0)
+
+        probes = options["probes"]
+        false_positives = sum(
+            bloom_contains(bitmap, f"new-{i}", bits, hashes) for i in range(probes)
+        )
+        expected = bloom_false_positive_rate(bits, hashes, count)
+        error = f"{false_positives / probes:.4%} fp (exp. {expected:.4%})"
+        self.report(count, "bloom", size, error, started)
+
+    async def bench_hll(self, r, count):
+        started = time.perf_counter()
+        key = f"{KEY_PREFIX}:hll:{count}"
+        for first in range(0, count, BATCH):
+            last = min(first + BATCH, count)
+            await r.pfadd(key, *(voter(i) for i in range(first, last)))
+        size = await r.memory_usage(key, samples=0)
+        estimate = await r.pfcount(key)
+        error = f"{(estimate - count) / count:+.2%} count"
+        self.report(count, "hll", size, error, started)
@@ -1,9 +1,11 @@
 import csv
 import json
 from datetime import datetime
+from django.core.exceptions import ValidationError
 from django.core.management.base import BaseCommand
 from django.db import connection
 from app_polls.models import Poll
+from app_polls.services.poll_meta_services import cache_polls_meta
 
 
 class Command(BaseCommand):
@@ -15,6 +17,7 @@ class Command(BaseCommand):
         try:
             with open(csv_file_path, "r", encoding="utf-8") as file:
                 reader = csv.DictReader(file)
+                polls = []
 
                 for row in reader:
                     try:
@@ -44,17 +47,43 @@ class Command(BaseCommand):
                                 )
                             )
 
+                    defaults = {
+                        "question": row["question"],
+                        "text": text_data,
+                        "is_active": is_active,
+                        "expire_at": expire_at,
+                    }
+                    # 🧮 Voter dedup mode, kept as is when the column is empty
+                    dedup_mode = row.get("dedup_mode", "").strip()
+                    if dedup_mode not in ("", *dict(Poll.DEDUP_CHOICES)):
+                        self.stdout.write(
+                            self.style.ERROR(
+                                f"⚠️ Invalid dedup_mode in row {row['id']}: '{dedup_mode}'"
+                            )
+                        )
+                        continue
+                    if dedup_mode:
+                        defaults["dedup_mode"] = dedup_mode
+                        existing = Poll.objects.filter(id=row["id"]).first()
+                        if existing and existing.dedup_mode != dedup_mode:
+                            existing.dedup_mode = dedup_mode
+                            try:
+                                existing.check_dedup_unchanged()
+                            except ValidationError as e:
+                                self.stdout.write(
+                                    self.style.ERROR(
+                                        f"⚠️ Cannot change dedup_mode in row {row['id']}: {e.messages[0]}"
+                                    )
+                                )
+                                continue
+
                     # 📦 Create or update Poll object
-                    Poll.objects.update_or_create(
-                        id=row["id"],
-                        defaults={
-                            "question": row["question"],
-                            "text": text_data,
-                            "is_active": is_active,
-                            "expire_at": expire_at,
-                        },
+                    poll, _ = Poll.objects.update_or_create(
+                        id=row["id"], defaults=defaults
                     )
 
+                    polls.append(poll)
+
                     self.stdout.write(
                         self.style.SUCCESS(f"✅ Loaded poll: {row['question']}")
                     )
@@ -65,6 +94,9 @@ class Command(BaseCommand):
                     "SELECT setval('app_polls_poll_id_seq', (SELECT MAX(id) FROM app_polls_poll))"
                 )
 
+            # 🚀 Fill the poll metadata cache, so the first votes skip Postgres
+            cache_polls_meta(polls)
+
             self.stdout.write(self.style.SUCCESS("🎉 Successfully loaded polls data"))
 
         except FileNotFoundError:
@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-18 10:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_polls", "0002_poll_expire_at_poll_is_active"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="poll",
+            name="bloom_capacity",
+            field=models.PositiveIntegerField(
+                default=1000000, help_text="Expected number of voters"
+            ),
+        ),
+        migrations.AddField(
+            model_name="poll",
+            name="bloom_error_rate",
+            field=models.FloatField(
+                default=0.001,
+                help_text="Share of new voters wrongly refused at capacity",
+            ),
+        ),
+        migrations.AddField(
+            model_name="poll",
+            name="dedup_mode",
+            field=models.CharField(
+                choices=[
+                    ("set", "Exact sets of voters"),
+                    ("bloom", "Bloom filter (approximate)"),
+                    ("hll", "No dedup, HyperLogLog count of voters"),
+                ],
+                default="set",
+                max_length=8,
+            ),
+        ),
+    ]
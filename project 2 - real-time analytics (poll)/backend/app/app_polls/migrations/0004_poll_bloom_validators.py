@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-18 11:21
+
+import app_polls.models
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app_polls", "0003_poll_bloom_capacity_poll_bloom_error_rate_and_more"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="poll",
+            name="bloom_capacity",
+            field=models.PositiveIntegerField(
+                default=1000000,
+                help_text="Expected number of voters",
+                validators=[django.core.validators.MinValueValidator(1)],
+            ),
+        ),
+        migrations.AlterField(
+            model_name="poll",
+            name="bloom_error_rate",
+            field=models.FloatField(
+                default=0.001,
+                help_text="Share of new voters wrongly refused at capacity",
+                validators=[app_polls.models.validate_error_rate],
+            ),
+        ),
+    ]
@@ -1,18 +1,81 @@
+from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator
 from django.db import models
 from django.utils import timezone
 
 # Create your models here.
 
 
+def validate_error_rate(value):
+    if not 0 < value < 1:
+        raise ValidationError("Must be between 0 and 1, both excluded.")
+
+
 class Poll(models.Model):
+    # How votes are deduplicated by user id and IP, see
+    # services/voter_dedup_services.py
+    DEDUP_SET = "set"
+    DEDUP_BLOOM = "bloom"
+    DEDUP_HLL = "hll"
+    DEDUP_CHOICES = [
+        (DEDUP_SET, "Exact sets of voters"),
+        (DEDUP_BLOOM, "Bloom filter (approximate)"),
+        (DEDUP_HLL, "No dedup, HyperLogLog count of voters"),
+    ]
+
     question = models.CharField(max_length=255)
     text = models.JSONField()
     is_active = models.BooleanField(default=True)
     expire_at = models.DateTimeField(null=True, blank=True)
+    dedup_mode = models.CharField(
+        max_length=8, choices=DEDUP_CHOICES, default=DEDUP_SET
+    )
+    # Bloom filter sizing, fixed once the poll has votes (see clean())
+    bloom_capacity = models.PositiveIntegerField(
+        default=1_000_000,
+        validators=[MinValueValidator(1)],
+        help_text="Expected number of voters",
+    )
+    bloom_error_rate = models.FloatField(
+        default=0.001,
+        validators=[validate_error_rate],
+        help_text="Share of new voters wrongly refused at capacity",
+    )
+
+    DEDUP_FIELDS = ("dedup_mode", "bloom_capacity", "bloom_error_rate")
 
     def __str__(self):
         return self.question
 
+    def clean(self):
+        super().clean()
+        self.check_dedup_unchanged()
+
+    def check_dedup_unchanged(self):
+        """
+        Refuse to change how voters are remembered once the poll has votes:
+        the existing sets or filter would be ignored, and a Bloom filter of
+        another size has other bit positions, so voters would be forgotten.
+        Run by clean() (admin forms) and load_polls, not on every save().
+        """
+        if self.pk is None:
+            return
+        # the services import this module
+        from .services.redis_poll_services import has_votes
+        from .services.voter_dedup_services import dedup_config
+
+        saved = Poll.objects.filter(pk=self.pk).values(*self.DEDUP_FIELDS).first()
+        if saved is None or dedup_config(Poll(**saved)) == dedup_config(self):
+            return
+        if has_votes(self.pk):
+            raise ValidationError(
+                {
+                    field: "Cannot be changed once the poll has votes."
+                    for field in self.DEDUP_FIELDS
+                    if saved[field] != getattr(self, field)
+                }
+            )
+
     def is_expired(self):
         """
         If expire_at is None, this returns None, which evaluates to
@@ -0,0 +1,150 @@
+"""
+Cache of the poll fields the vote and result endpoints need (question,
+options, is_active, expire_at, voter dedup mode), so that in steady state a
+vote touches only Redis:
+
+    in-process dict  ->  poll:{id}:meta (JSON in Redis)  ->  Postgres
+
+Entries are filled on first access and by `load_polls`, and invalidated
+after commit by the Poll signals (see signals.py), which also bump
+poll:{id}:meta_gen: a fill on first access only writes if that generation
+is still the one seen before Postgres was read, so an invalidation landing
+in between is not undone by the older row. Another worker's
+in-process copy can stay stale for up to settings.POLL_META_LOCAL_TTL
+seconds. Unknown poll ids are cached too (as null, for
+POLL_META_MISSING_TTL seconds), creating the poll clears the entry.
+"""
+
+import json
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils import timezone
+
+from ..models import Poll
+from .redis_poll_services import get_poll_key
+from .voter_dedup_services import dedup_config
+
+r = settings.REDIS_CLIENT
+sync_r = settings.REDIS_SYNC_CLIENT
+
+# KEYS[1] poll:{id}:meta, KEYS[2] poll:{id}:meta_gen
+# ARGV[1] generation read before Postgres ("" if none), ARGV[2] metadata,
+# ARGV[3] TTL
+FILL_META = """
+if (redis.call('GET', KEYS[2]) or '') == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+end
+"""
+
+_fill_meta_script = r.register_script(FILL_META)
+
+# poll_id -> (monotonic expiry, meta or None), oldest first
+_local = OrderedDict()
+
+
+def poll_meta(poll: Poll) -> dict:
+    expire_at = poll.expire_at
+    if expire_at and timezone.is_naive(expire_at):
+        # as Django stores it (e.g. parsed by load_polls)
+        expire_at = timezone.make_aware(expire_at)
+    return {
+        "id": poll.id,
+        "question": poll.question,
+        "text": poll.text,
+        "is_active": poll.is_active,
+        "expire_at": expire_at.timestamp() if expire_at else None,
+        "dedup": dedup_config(poll),
+    }
+
+
+def is_expired(meta: dict) -> bool:
+    """Same rule as Poll.is_expired(), on cached metadata."""
+    return meta["expire_at"] is not None and time.time() > meta["expire_at"]
+
+
+def _remember(poll_id: int, meta: dict | None) -> None:
+    _local[poll_id] = (time.monotonic() + settings.POLL_META_LOCAL_TTL, meta)
+    _local.move_to_end(poll_id)
+    while len(_local) > settings.POLL_META_LOCAL_SIZE:
+        _local.popitem(last=False)
+
+
+def forget_local(poll_id: int | None = None) -> None:
+    if poll_id is None:
+        _local.clear()
+    else:
+        _local.pop(poll_id, None)
+
+
+def get_local_meta(poll_id: int) -> tuple[bool, dict | None]:
+    """(found, metadata) from this worker's copy, without any I/O."""
+    entry = _local.get(poll_id)
+    if entry and entry[0] > time.monotonic():
+        return True, entry[1]
+    return False, None
+
+
+def meta_key(poll_id: int) -> str:
+    return get_poll_key(poll_id, "meta")
+
+
+def meta_gen_key(poll_id: int) -> str:
+    return get_poll_key(poll_id, "meta_gen")
+
+
+async def resolve_meta(poll_id: int, cached: str | None) -> dict | None:
+    """
+    Metadata from the raw value of poll:{id}:meta read by the caller (None
+    when missing, then Postgres is read and the entry filled unless it was
+    invalidated meanwhile).
+    """
+    if cached is not None:
+        meta = json.loads(cached)
+    else:
+        generation = await r.get(meta_gen_key(poll_id))
+        try:
+            meta = poll_meta(await Poll.objects.aget(pk=poll_id))
+        except Poll.DoesNotExist:
+            meta = None
+        ttl = settings.POLL_META_CACHE_TTL if meta else settings.POLL_META_MISSING_TTL
+        await _fill_meta_script(
+            keys=[meta_key(poll_id), meta_gen_key(poll_id)],
+            args=[generation or "", json.dumps(meta), ttl],
+            client=r,
+        )
+
+    _remember(poll_id, meta)
+    return meta
+
+
+async def get_poll_meta(poll_id: int) -> dict | None:
+    """Metadata of a poll, None if there is no such poll."""
+    found, meta = get_local_meta(poll_id)
+    if found:
+        return meta
+    return await resolve_meta(poll_id, await r.get(meta_key(poll_id)))
+
+
+def cache_polls_meta(polls) -> None:
+    """Write the metadata of `polls` to Redis in one pipeline (sync, for load_polls)."""
+    with sync_r.pipeline(transaction=False) as pipe:
+        for poll in polls:
+            pipe.set(
+                meta_key(poll.id),
+                json.dumps(poll_meta(poll)),
+                ex=settings.POLL_META_CACHE_TTL,
+            )
+        pipe.execute()
+
+
+def invalidate_poll_meta(poll_id: int) -> None:
+    """Sync, for the Poll signals: no event loop, hence no client, per call."""
+    forget_local(poll_id)
+    with sync_r.pipeline(transaction=True) as pipe:
+        pipe.incr(meta_gen_key(poll_id))
+        # outlives any fill in flight, which takes a Postgres read
+        pipe.expire(meta_gen_key(poll_id), settings.POLL_META_CACHE_TTL)
+        pipe.delete(meta_key(poll_id))
+        pipe.execute()
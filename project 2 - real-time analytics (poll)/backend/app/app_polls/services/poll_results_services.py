@@ -0,0 +1,123 @@
+"""
+Poll results computed from the cached poll metadata (poll_meta_services)
+and the live poll:{id}:votes hash, instead of a results cache that every
+vote has to invalidate.
+
+A result is one Redis round trip: HGETALL of the votes when this worker
+has the metadata, else a pipeline of GET poll:{id}:meta + HGETALL. Polls
+counting their voters in a HyperLogLog (dedup mode "hll") add a PFCOUNT
+to it, reported as "unique_voters".
+
+With settings.POLL_RESULTS_MAX_STALENESS > 0 (seconds), each worker keeps a
+snapshot per poll and serves it until it is that old; requests arriving
+while it is refreshed wait for the same read. Redis then sees at most one
+results read per poll, per worker and per interval, whatever the number of
+viewers or the vote rate.
+"""
+
+import asyncio
+import time
+
+from django.conf import settings
+
+from .poll_meta_services import get_local_meta, meta_key, resolve_meta
+from .redis_poll_services import get_poll_key, voters_hll_key
+from .voter_dedup_services import HLL, dedup_mode
+
+r = settings.REDIS_CLIENT
+
+SNAPSHOTS_KEPT = 1000
+
+# poll_id -> (monotonic time of the read, results), oldest first
+_snapshots = {}
+# poll_id -> task reading fresh results
+_refreshing = {}
+
+
+def build_results(meta: dict, votes: dict, voters: int | None = None) -> dict:
+    """
+    Ensures every poll option has a vote count, even if it's zero:
+    {"1": 12, "2": 8, "3": 0, "4": 0}
+    `voters` is the HyperLogLog count of an "hll" poll.
+    """
+    results = {option_id: int(count) for option_id, count in votes.items()}
+    for option_id in meta["text"]:
+        results.setdefault(option_id, 0)
+
+    data = {
+        "poll_id": meta["id"],
+        "question": meta["question"],
+        "options": [{"id": k, "text": v} for k, v in meta["text"].items()],
+        "results": results,
+        "total_votes": sum(results.values()),
+    }
+    if dedup_mode(meta) == HLL:
+        data["unique_voters"] = voters
+    return data
+
+
+async def get_poll_results(poll_id: int) -> dict | None:
+    """Current results of a poll, None if there is no such poll."""
+    votes_key = get_poll_key(poll_id, "votes")
+    voters = None
+    found, meta = get_local_meta(poll_id)
+    if found and meta is not None and dedup_mode(meta) == HLL:
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.hgetall(votes_key)
+            pipe.pfcount(voters_hll_key(poll_id))
+            votes, voters = await pipe.execute()
+    elif found:
+        votes = await r.hgetall(votes_key)
+    else:
+        # the mode is not known yet: PFCOUNT of a missing key is just 0
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.get(meta_key(poll_id))
+            pipe.hgetall(votes_key)
+            pipe.pfcount(voters_hll_key(poll_id))
+            cached, votes, voters = await pipe.execute()
+        meta = await resolve_meta(poll_id, cached)
+
+    if meta is None:
+        return None
+    return build_results(meta, votes, voters)
+
+
+async def _refresh(poll_id: int) -> dict | None:
+    read_at = time.monotonic()
+    results = await get_poll_results(poll_id)
+    _snapshots.pop(poll_id, None)
+    _snapshots[poll_id] = (read_at, results)
+    while len(_snapshots) > SNAPSHOTS_KEPT:
+        del _snapshots[next(iter(_snapshots))]
+    return results
+
+
+async def get_poll_results_snapshot(poll_id: int) -> dict | None:
+    """
+    Results at most settings.POLL_RESULTS_MAX_STALENESS seconds old, read
+    from Redis by at most one request of this worker at a time.
+    """
+    max_age = settings.POLL_RESULTS_MAX_STALENESS
+    if max_age <= 0:
+        return await get_poll_results(poll_id)
+
+    snapshot = _snapshots.get(poll_id)
+    if snapshot and time.monotonic() - snapshot[0] < max_age:
+        return snapshot[1]
+
+    task = _refreshing.get(poll_id)
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        task = asyncio.ensure_future(_refresh(poll_id))
+        _refreshing[poll_id] = task
+
+        def done(finished):
+            if _refreshing.get(poll_id) is finished:
+                del _refreshing[poll_id]
+
+        task.add_done_callback(done)
+    # shield: a client going away must not cancel the read others wait for
+    return await asyncio.shield(task)
+
+
+def forget_snapshots() -> None:
+    _snapshots.clear()
@@ -0,0 +1,147 @@
+"""
+Live poll results over server-sent events (GET /api/polls/{id}/stream).
+
+Every recorded vote is published on poll:{id}:updates (see cast_vote()).
+Each worker process holds one pub/sub connection, subscribed to the polls
+its clients watch, and fans updates out to all of them:
+
+    vote -> PUBLISH poll:{id}:updates -> worker hub -> N client queues
+
+Updates are coalesced per poll: the first message after a quiet period is
+sent at once, later ones are folded into at most one send per
+1 / settings.POLL_STREAM_MAX_UPDATES_PER_SECOND seconds. A send is one
+results read (poll_results_services) shared by every client of the worker,
+so 10k viewers cost one subscription and N reads per second per process
+instead of 10k polling requests. Slow clients only get the latest results.
+"""
+
+import asyncio
+import json
+
+import redis
+from django.conf import settings
+
+from .poll_results_services import get_poll_results
+from .redis_poll_services import updates_channel
+
+pubsub_r = settings.REDIS_PUBSUB_CLIENT
+
+
+def _offer(queue: asyncio.Queue, results) -> None:
+    """Put results on a one-slot queue, replacing what was not sent yet."""
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(results)
+
+
+async def _handle_exception(exc, pubsub):
+    # Updates published while disconnected are lost; the next get_message()
+    # reconnects and subscribes again, the next vote refreshes the clients.
+    await asyncio.sleep(1)
+
+
+class PollUpdateHub:
+    """Subscriptions and client queues of one worker (one event loop)."""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.pubsub = pubsub_r.pubsub(ignore_subscribe_messages=True)
+        self.viewers = {}  # poll_id -> set of client queues
+        self.flushers = {}  # poll_id -> task sending coalesced updates
+        self.pending = set()  # polls with votes not sent yet
+        self.listener = None
+
+    async def join(self, poll_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        viewers = self.viewers.setdefault(poll_id, set())
+        viewers.add(queue)
+        if len(viewers) == 1:
+            await self.pubsub.subscribe(
+                **{updates_channel(poll_id): self._handle_message}
+            )
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.create_task(
+                self.pubsub.run(exception_handler=_handle_exception)
+            )
+        return queue
+
+    async def leave(self, poll_id: int, queue: asyncio.Queue) -> None:
+        viewers = self.viewers.get(poll_id)
+        if viewers is None:
+            return
+        viewers.discard(queue)
+        if not viewers:
+            del self.viewers[poll_id]
+            self.pending.discard(poll_id)
+            await self.pubsub.unsubscribe(updates_channel(poll_id))
+
+    def _handle_message(self, message) -> None:
+        channel = message["channel"]
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        poll_id = int(channel.split(":")[1])
+        if poll_id not in self.viewers:
+            return
+        self.pending.add(poll_id)
+        if poll_id not in self.flushers:
+            self.flushers[poll_id] = asyncio.create_task(self._flush(poll_id))
+
+    async def _flush(self, poll_id: int) -> None:
+        interval = 1 / settings.POLL_STREAM_MAX_UPDATES_PER_SECOND
+        try:
+            while poll_id in self.pending:
+                self.pending.discard(poll_id)
+                try:
+                    results = await get_poll_results(poll_id)
+                except redis.RedisError:
+                    self.pending.add(poll_id)  # try again next interval
+                else:
+                    for queue in self.viewers.get(poll_id, ()):
+                        _offer(queue, results)
+                await asyncio.sleep(interval)
+        finally:
+            del self.flushers[poll_id]
+
+    async def close(self) -> None:
+        for task in [self.listener, *self.flushers.values()]:
+            if task is not None:
+                task.cancel()
+        await self.pubsub.aclose()
+
+
+_hub = None
+
+
+def get_hub() -> PollUpdateHub:
+    """The hub of the running event loop, created on first use."""
+    global _hub
+    if _hub is None or _hub.loop is not asyncio.get_running_loop():
+        _hub = PollUpdateHub()
+    return _hub
+
+
+def sse_event(results) -> str:
+    return f"event: results\ndata: {json.dumps(results)}\n\n"
+
+
+async def stream_poll_results(poll_id: int):
+    """
+    Server-sent events of a poll's results: the current results, then one
+    event per coalesced update, with a comment line as keepalive.
+    """
+    hub = get_hub()
+    queue = await hub.join(poll_id)
+    try:
+        # read after subscribing, so no vote falls in between
+        yield sse_event(await get_poll_results(poll_id))
+        while True:
+            try:
+                results = await asyncio.wait_for(
+                    queue.get(), settings.POLL_STREAM_KEEPALIVE
+                )
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield sse_event(results)
+    finally:
+        await hub.leave(poll_id, queue)
@@ -1,94 +1,170 @@
 from django.conf import settings
 import json
 
+from . import voter_dedup_services
+
 r = settings.REDIS_CLIENT
+sync_r = settings.REDIS_SYNC_CLIENT
 
 RATE_LIMIT_SECONDS = 5
-
-
-async def is_rate_limited(ip: str) -> bool:
-    key = f"rate_limit:{ip}"
-    """_
-    If key does not exist, Redis sets it to 1 and the key expires
-    after RATE_LIMIT_SECONDS seconds.
-    If key already exists, it does nothing — rate limit preserved.
-    
-    The return value added will be:
-    True: key was created (action allowed)
-    None: key already exists (action rate-limited)
-    """
-    added = await r.set(key, 1, ex=RATE_LIMIT_SECONDS, nx=True)
-    return added is None  # If key already exists, rate limited
+RECENT_VOTES_KEPT = 100
 
 
 def get_poll_key(poll_id: int, suffix: str) -> str:
     return f"poll:{poll_id}:{suffix}"
 
 
-async def increment_vote(poll_id: int, option_id: str) -> None:
-    """Increment the vote counter for an option"""
-    key = get_poll_key(poll_id, "votes")
-    # key = f"poll:{poll_id}"
-    await r.hincrby(key, option_id, 1)
-
-
-async def try_register_vote(poll_id: int, voter_id: str, suffix: str) -> bool:
+def updates_channel(poll_id: int) -> str:
+    """Pub/sub channel told about every vote of a poll (poll_stream_services.py)."""
+    return get_poll_key(poll_id, "updates")
+
+
+def has_votes(poll_id: int) -> bool:
+    """Sync, for Poll validation: whether the poll's tally has any vote."""
+    return bool(sync_r.exists(get_poll_key(poll_id, "votes")))
+
+
+# Outcomes of cast_vote()
+VOTE_RECORDED = 0
+RATE_LIMITED = 1
+USER_ALREADY_VOTED = 2
+IP_ALREADY_VOTED = 3
+
+# KEYS[1] rate_limit:{ip}, KEYS[2] / KEYS[3] where the poll's user ids / IPs
+# are remembered (see _dedup_keys()), KEYS[4] poll:{id}:votes,
+# KEYS[5] poll:{id}:recent_votes
+# ARGV[1] user id ("" for anonymous), ARGV[2] ip, ARGV[3] option id,
+# ARGV[4] rate limit seconds, ARGV[5] recent vote entry, ARGV[6] recent votes
+# kept, ARGV[7] "1" if the browser cookie says it already voted, ARGV[8] the
+# poll's updates channel, ARGV[9] dedup mode, ARGV[10] bloom hashes (k),
+# ARGV[11..10+k] bloom bits of the IP, ARGV[11+k..10+2k] of the user
+#
+# Every check runs before anything is registered, so a rejected vote leaves
+# no trace besides the rate limit. The keys span several hash slots: this
+# needs a single Redis, not a cluster.
+CAST_VOTE = """
+if not redis.call('SET', KEYS[1], 1, 'EX', ARGV[4], 'NX') then
+    return 1
+end
+local user_id, ip, mode = ARGV[1], ARGV[2], ARGV[9]
+local hashes = tonumber(ARGV[10])
+
+-- "hll" remembers no one, see voter_dedup_services.py
+local function seen(key, member, first)
+    if mode == 'set' then
+        return redis.call('SISMEMBER', key, member) == 1
+    elseif mode == 'bloom' then
+        for i = first, first + hashes - 1 do
+            if redis.call('GETBIT', key, ARGV[i]) == 0 then
+                return false
+            end
+        end
+        return true
+    end
+    return false
+end
+
+local function remember(key, member, first)
+    if mode == 'set' then
+        redis.call('SADD', key, member)
+    elseif mode == 'bloom' then
+        for i = first, first + hashes - 1 do
+            redis.call('SETBIT', key, ARGV[i], 1)
+        end
+    end
+end
+
+if user_id ~= '' and seen(KEYS[2], user_id, 11 + hashes) then
+    return 2
+end
+if seen(KEYS[3], ip, 11) or ARGV[7] == '1' then
+    return 3
+end
+
+if user_id ~= '' then
+    remember(KEYS[2], user_id, 11 + hashes)
+end
+remember(KEYS[3], ip, 11)
+if mode == 'hll' then
+    redis.call('PFADD', KEYS[2], user_id ~= '' and 'user:' .. user_id or 'ip:' .. ip)
+end
+redis.call('HINCRBY', KEYS[4], ARGV[3], 1)
+redis.call('LPUSH', KEYS[5], ARGV[5])
+redis.call('LTRIM', KEYS[5], 0, tonumber(ARGV[6]) - 1)
+redis.call('PUBLISH', ARGV[8], ARGV[3])
+return 0
+"""
+
+_cast_vote_script = r.register_script(CAST_VOTE)
+
+
+def voters_hll_key(poll_id: int) -> str:
+    return get_poll_key(poll_id, "voters_hll")
+
+
+def _dedup_keys(poll_id: int, mode: str) -> list[str]:
+    if mode == voter_dedup_services.BLOOM:
+        return [
+            get_poll_key(poll_id, "voted_user_bloom"),
+            get_poll_key(poll_id, "voted_ips_bloom"),
+        ]
+    if mode == voter_dedup_services.HLL:
+        return [voters_hll_key(poll_id)] * 2
+    return [get_poll_key(poll_id, "voted_user"), get_poll_key(poll_id, "voted_ips")]
+
+
+def _dedup_args(dedup: dict, user_id: str | None, ip: str) -> list:
+    if dedup["mode"] != voter_dedup_services.BLOOM:
+        return [dedup["mode"], 0]
+    bits, hashes = dedup["bits"], dedup["hashes"]
+    args = [
+        dedup["mode"],
+        hashes,
+        *voter_dedup_services.bloom_positions(ip, bits, hashes),
+    ]
+    if user_id:
+        args += voter_dedup_services.bloom_positions(user_id, bits, hashes)
+    return args
+
+
+async def cast_vote(
+    poll_id: int,
+    user_id: str | None,
+    ip: str,
+    option_id: str,
+    cookie_voted=False,
+    dedup: dict | None = None,
+) -> int:
     """
-    instead of using two functions with name register_user_vote &
-    has_user_voted, we can using only one function
-
-    Attempts to register an user vote,
-    returns True if successful and False if user has already voted
+    Rate limit, user and IP dedup, tally, recent vote and update
+    notification of one vote, atomically in a single round trip. Results
+    are computed from the live tally (poll_results_services.py), nothing to
+    invalidate.
+    `dedup` is the "dedup" entry of the poll metadata, exact sets when None.
+    Returns VOTE_RECORDED or the reason the vote was refused.
     """
-    # key = get_poll_key(poll_id, "voted_users")
-    key = get_poll_key(poll_id, suffix)
-    added = await r.sadd(key, voter_id)
-    return added == 1  # 1 => added , 0 => alredy exists
-
-
-# # register_user_vote and has_user_voted functions are replaced by try_register_vote
-# async def register_user_vote(poll_id: int, user_id: str) -> None:
-#     """Register a user as having voted"""
-#     key = get_poll_key(poll_id, "voted_users")
-#     await r.sadd(key, user_id)
-
-
-# # register_user_vote and has_user_voted functions are replaced by try_register_vote
-# async def has_user_voted(poll_id: int, user_id: str) -> bool:
-#     """Register a user as having voted"""
-#     key = get_poll_key(poll_id, "voted_users")
-#     return await r.sismember(key, user_id)
-
-
-async def record_vote(poll_id: int, voter_id: str, ip: str, option_id: str):
-    vote_key = get_poll_key(poll_id, "votes")
-    recent_key = get_poll_key(poll_id, "recent_votes")
-
-    vote_data = {"user_id": voter_id, "ip": ip, "option_id": option_id}
-
-    async with r.pipeline(transaction=True) as pipe:
-        pipe.hincrby(vote_key, option_id, 1)
-        pipe.lpush(recent_key, json.dumps(vote_data))
-        pipe.ltrim(recent_key, 0, 99)
-        await pipe.execute()
-
-    await delete_cache_poll_results(poll_id)
-
-
-# # track_recent_vote & get_recent_vote functions are replaced with record_vote
-# async def track_recent_vote(poll_id: int, user_id: str, ip: str, option_id: str):
-#     key = get_poll_key(poll_id, "recent_votes")
-#     vote_data = {"user_id": user_id, "ip": ip, "option_id": option_id}
-
-#     await r.lpush(key, json.dumps(vote_data))
-#     await r.ltrim(key, 0, 99)  # only last 100 entries will be kept
-
-
-# # track_recent_vote & get_recent_vote functions are replaced with record_vote
-# async def get_recent_vote(poll_id: int) -> list:
-#     key = get_poll_key(poll_id, "recent_votes")
-#     votes = await r.lrange(key, 0, 99)  # only last 100 entries
-#     return [json.loads(v) for v in votes]
+    dedup = dedup or {"mode": voter_dedup_services.SET}
+    vote_data = {"user_id": user_id or "anonymous", "ip": ip, "option_id": option_id}
+    return await _cast_vote_script(
+        keys=[
+            f"rate_limit:{ip}",
+            *_dedup_keys(poll_id, dedup["mode"]),
+            get_poll_key(poll_id, "votes"),
+            get_poll_key(poll_id, "recent_votes"),
+        ],
+        args=[
+            user_id or "",
+            ip,
+            option_id,
+            RATE_LIMIT_SECONDS,
+            json.dumps(vote_data),
+            RECENT_VOTES_KEPT,
+            int(bool(cookie_voted)),
+            updates_channel(poll_id),
+            *_dedup_args(dedup, user_id, ip),
+        ],
+        client=r,
+    )
 
 
 async def get_poll_vote_count(poll_id: int) -> dict:
@@ -99,23 +175,3 @@ async def get_poll_vote_count(poll_id: int) -> dict:
     key = get_poll_key(poll_id, "votes")
     raw = await r.hgetall(key)
     return {k: int(v) for k, v in raw.items()}
-
-
-async def get_cached_poll_results(poll_id: int) -> dict | None:
-    key = get_poll_key(poll_id, "results_data")
-    cached = await r.get(key)
-    if cached:
-        return json.loads(cached)
-    return None
-
-
-async def cache_poll_results(
-    poll_id: int, data: dict, expire_seconds: int = 3600
-) -> None:
-    key = get_poll_key(poll_id, "results_data")
-    await r.set(key, json.dumps(data), ex=expire_seconds)
-
-
-async def delete_cache_poll_results(poll_id: int) -> None:
-    key = get_poll_key(poll_id, "results_data")
-    await r.delete(key)
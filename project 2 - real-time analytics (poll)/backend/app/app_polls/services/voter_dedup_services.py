@@ -0,0 +1,73 @@
+"""
+How a poll remembers who already voted (Poll.dedup_mode), the memory
+against accuracy trade-off for polls with millions of voters:
+
+set    SADD of every user id and IP to poll:{id}:voted_user / voted_ips.
+       Exact, grows without bound: tens of bytes per voter, gigabytes for
+       tens of millions of voters.
+bloom  Bloom filters in Redis bitmaps, poll:{id}:voted_user_bloom /
+       voted_ips_bloom. Fixed size, from Poll.bloom_capacity and
+       Poll.bloom_error_rate (~1.8 MB per million voters at 0.1%), allocated
+       by the first vote. Never lets a repeat vote through, but refuses that
+       share of new voters; beyond the capacity that share grows quickly.
+hll    No dedup besides the rate limit and the vote cookie. Voters are only
+       counted, in a HyperLogLog (poll:{id}:voters_hll, 12 KB at most,
+       ~0.81% standard error), shown as "unique_voters" in the results.
+
+The bit positions are computed here and passed to the vote script (see
+cast_vote()). They depend on the sizing, so Poll refuses to change the dedup
+fields once the poll has votes (Poll.check_dedup_unchanged()). Measure the
+trade-off with `python manage.py bench_dedup`.
+"""
+
+import hashlib
+import math
+
+from ..models import Poll
+
+SET = Poll.DEDUP_SET
+BLOOM = Poll.DEDUP_BLOOM
+HLL = Poll.DEDUP_HLL
+
+# Redis strings, hence bitmaps, are at most 512 MB
+MAX_BLOOM_BITS = 2**32
+# error rates outside Poll's validators (rows written around them) are
+# clamped to these, so that a bad row cannot break the vote path
+MIN_ERROR_RATE = 1e-9
+MAX_ERROR_RATE = 0.5
+
+
+def bloom_size(capacity: int, error_rate: float) -> tuple[int, int]:
+    """(bits, hashes) of the smallest filter with `error_rate` at `capacity`."""
+    capacity = max(capacity, 1)
+    error_rate = min(max(error_rate, MIN_ERROR_RATE), MAX_ERROR_RATE)
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    bits = min(bits, MAX_BLOOM_BITS)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+def bloom_positions(item: str, bits: int, hashes: int) -> list[int]:
+    """Bit offsets of `item`, by double hashing one 128-bit digest."""
+    digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+def bloom_false_positive_rate(bits: int, hashes: int, count: int) -> float:
+    """Expected share of new items reported as seen after `count` inserts."""
+    return (1 - math.exp(-hashes * count / bits)) ** hashes
+
+
+def dedup_config(poll: Poll) -> dict:
+    """The part of the cached poll metadata that cast_vote() needs."""
+    if poll.dedup_mode == BLOOM:
+        bits, hashes = bloom_size(poll.bloom_capacity, poll.bloom_error_rate)
+        return {"mode": BLOOM, "bits": bits, "hashes": hashes}
+    return {"mode": poll.dedup_mode}
+
+
+def dedup_mode(meta: dict) -> str:
+    # metadata cached before dedup modes existed is of a "set" poll
+    return meta.get("dedup", {}).get("mode", SET)
@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Poll
+from .services.poll_meta_services import invalidate_poll_meta
+
+
+@receiver(post_save, sender=Poll)
+@receiver(post_delete, sender=Poll)
+def invalidate_cached_poll(sender, instance, **kwargs):
+    # after commit: a read refilling the cache must see the new row
+    poll_id = instance.id
+    transaction.on_commit(lambda: invalidate_poll_meta(poll_id))
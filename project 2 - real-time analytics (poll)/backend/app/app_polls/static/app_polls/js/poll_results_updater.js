@@ -11,38 +11,48 @@ document.addEventListener('DOMContentLoaded', async function () {
         return;
     }
 
+    function renderPollResults(data) {
+        if (data && data.results && data.options) {
+            let html = "<ul>";
+            for (const option of data.options) {
+                const count = data.results[option.id] || 0;
+                html += `<li><strong>${option.text}:</strong> ${count} vote(s)</li>`;
+            }
+            html += "</ul>";
+            html += `<p><strong>Total Votes:</strong> ${data.total_votes}</p>`;
+
+            if ('unique_voters' in data) {
+                html += `<p><strong>Unique Voters:</strong> ${data.unique_voters}</p>`;
+            }
+
+            resultsDiv.innerHTML = html;
+        } else {
+            resultsDiv.innerHTML = "<p>No results yet.</p>";
+        }
+    }
+
     async function fetchPollResults() {
         try {
             const response = await fetch(`/api/polls/${pollId}/result`);
-            const data = await response.json();
-
-            if (data.results && data.options) {
-                let html = "<ul>";
-                for (const option of data.options) {
-                    const count = data.results[option.id] || 0;
-                    html += `<li><strong>${option.text}:</strong> ${count} vote(s)</li>`;
-                }
-                html += "</ul>";
-                html += `<p><strong>Total Votes:</strong> ${data.total_votes}</p>`;
-
-                if ('unique_voters' in data) {
-                    html += `<p><strong>Unique Voters:</strong> ${data.unique_voters}</p>`;
-                }
-
-                resultsDiv.innerHTML = html;
-            } else {
-                resultsDiv.innerHTML = "<p>No results yet.</p>";
-            }
+            renderPollResults(await response.json());
         } catch (error) {
             console.error("Error fetching results:", error);
             resultsDiv.innerHTML = `<p>Error loading results: ${error.message}</p>`;
         }
     }
 
-    // Load results initially
-    fetchPollResults();
+    // Results are pushed by the server as votes come in (server-sent events);
+    // the browser reconnects by itself if the stream drops
+    if (window.EventSource) {
+        const source = new EventSource(`/api/polls/${pollId}/stream`);
+        source.addEventListener('results', function (event) {
+            renderPollResults(JSON.parse(event.data));
+        });
+        return;
+    }
 
-    // Optional: Auto-refresh every 30 seconds
+    // Fallback without EventSource: load results, then refresh every 30 seconds
+    fetchPollResults();
     setInterval(fetchPollResults, 30000);
 });
 
@@ -1,3 +1,385 @@
-from django.test import TestCase
+import asyncio
+import json
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models.signals import post_save
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from ninja.testing import TestAsyncClient
+
+from . import signals
+from .models import Poll
+from .services import (
+    poll_meta_services,
+    poll_results_services,
+    poll_stream_services,
+    voter_dedup_services,
+)
+from .services import redis_poll_services as services
+from .views import VOTE_ERRORS, router
+
+
+class RedisPollTestCase(SimpleTestCase):
+    def setUp(self):
+        server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        sync_redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+        for patcher in (
+            mock.patch.object(services, "r", self.redis),
+            mock.patch.object(services, "sync_r", sync_redis),
+            mock.patch.object(poll_meta_services, "r", self.redis),
+            mock.patch.object(poll_meta_services, "sync_r", sync_redis),
+            mock.patch.object(poll_results_services, "r", self.redis),
+            mock.patch.object(poll_stream_services, "pubsub_r", self.redis),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        poll_meta_services.forget_local()
+        poll_results_services.forget_snapshots()
+        self.addCleanup(poll_meta_services.forget_local)
+        self.addCleanup(poll_results_services.forget_snapshots)
+
+
+class CastVoteTests(RedisPollTestCase):
+    async def test_vote_is_recorded_and_deduplicated(self):
+        status = await services.cast_vote(1, "u1", "10.0.0.1", "2")
+
+        self.assertEqual(status, services.VOTE_RECORDED)
+        self.assertEqual(await services.get_poll_vote_count(1), {"2": 1})
+        self.assertEqual(await self.redis.llen("poll:1:recent_votes"), 1)
+
+        await self.redis.delete("rate_limit:10.0.0.1")
+        self.assertEqual(
+            await services.cast_vote(1, "u1", "10.0.0.2", "2"),
+            services.USER_ALREADY_VOTED,
+        )
+        self.assertEqual(
+            await services.cast_vote(1, None, "10.0.0.1", "2"),
+            services.IP_ALREADY_VOTED,
+        )
+
+    async def test_refused_votes_register_nothing(self):
+        await services.cast_vote(1, "u1", "10.0.0.1", "1")
+        self.assertEqual(
+            await services.cast_vote(1, "u2", "10.0.0.1", "1"), services.RATE_LIMITED
+        )
+        self.assertEqual(
+            await services.cast_vote(1, "u3", "10.0.0.3", "1", cookie_voted=True),
+            services.IP_ALREADY_VOTED,
+        )
+
+        self.assertEqual(await self.redis.smembers("poll:1:voted_user"), {"u1"})
+        self.assertEqual(await self.redis.smembers("poll:1:voted_ips"), {"10.0.0.1"})
+        self.assertEqual(await services.get_poll_vote_count(1), {"1": 1})
+
+
+class VoterDedupTests(RedisPollTestCase):
+    def test_bloom_size(self):
+        bits, hashes = voter_dedup_services.bloom_size(1_000_000, 0.001)
+
+        self.assertEqual(hashes, 10)
+        self.assertLess(bits / 8, 1_800_000)
+        self.assertAlmostEqual(
+            voter_dedup_services.bloom_false_positive_rate(bits, hashes, 1_000_000),
+            0.001,
+            places=5,
+        )
+
+    def test_bloom_sizing_is_validated(self):
+        poll = Poll(
+            question="?", text={"1": "yes"}, bloom_capacity=0, bloom_error_rate=1
+        )
+        with self.assertRaises(ValidationError) as raised:
+            poll.clean_fields()
+        self.assertEqual(
+            sorted(raised.exception.message_dict),
+            ["bloom_capacity", "bloom_error_rate"],
+        )
+
+        # rows saved around the validators still give a usable filter
+        for capacity, error_rate in [(0, 0.001), (100, 0), (100, 1), (100, -2)]:
+            bits, hashes = voter_dedup_services.bloom_size(capacity, error_rate)
+            self.assertGreater(bits, 0)
+            self.assertGreater(hashes, 0)
+
+    async def test_bloom_mode_refuses_repeat_voters(self):
+        poll = Poll(id=1, dedup_mode=Poll.DEDUP_BLOOM, bloom_capacity=100)
+        dedup = voter_dedup_services.dedup_config(poll)
+
+        status = await services.cast_vote(1, "u1", "10.0.0.1", "1", dedup=dedup)
+        self.assertEqual(status, services.VOTE_RECORDED)
+        await self.redis.delete("rate_limit:10.0.0.1")
+        self.assertEqual(
+            await services.cast_vote(1, "u1", "10.0.0.2", "1", dedup=dedup),
+            services.USER_ALREADY_VOTED,
+        )
+        self.assertEqual(
+            await services.cast_vote(1, None, "10.0.0.1", "1", dedup=dedup),
+            services.IP_ALREADY_VOTED,
+        )
+
+        positions = voter_dedup_services.bloom_positions(
+            "u1", dedup["bits"], dedup["hashes"]
+        )
+        for position in positions:
+            self.assertEqual(
+                await self.redis.getbit("poll:1:voted_user_bloom", position), 1
+            )
+        self.assertFalse(
+            await self.redis.exists("poll:1:voted_user", "poll:1:voted_ips")
+        )
+
+    async def test_hll_mode_counts_voters_without_dedup(self):
+        poll = Poll(id=1, question="?", text={"1": "yes"}, dedup_mode=Poll.DEDUP_HLL)
+        dedup = voter_dedup_services.dedup_config(poll)
+        for user_id in ("u1", "u1", "u2"):
+            await self.redis.delete("rate_limit:10.0.0.1")
+            status = await services.cast_vote(1, user_id, "10.0.0.1", "1", dedup=dedup)
+            self.assertEqual(status, services.VOTE_RECORDED)
+
+        with mock.patch.object(
+            Poll.objects, "aget", new_callable=mock.AsyncMock, return_value=poll
+        ):
+            results = await poll_results_services.get_poll_results(1)
+            cached = await poll_results_services.get_poll_results(1)
+
+        self.assertEqual(results["total_votes"], 3)
+        self.assertEqual(results["unique_voters"], 2)
+        self.assertEqual(cached, results)
+
+    async def test_bloom_sizing_is_fixed_once_voted(self):
+        saved = {
+            "dedup_mode": "bloom",
+            "bloom_capacity": 1000,
+            "bloom_error_rate": 0.01,
+        }
+        poll = Poll(id=1, question="?", text={}, **saved)
+        resized = Poll(id=1, question="?", text={}, **{**saved, "bloom_capacity": 10})
+        with mock.patch.object(Poll.objects, "filter") as query:
+            query.return_value.values.return_value.first.return_value = saved
+            await sync_to_async(resized.check_dedup_unchanged)()
+
+            dedup = voter_dedup_services.dedup_config(poll)
+            await services.cast_vote(1, "u1", "10.0.0.1", "2", dedup=dedup)
+            await sync_to_async(poll.clean)()
+            with self.assertRaises(ValidationError) as raised:
+                await sync_to_async(resized.clean)()
+
+        self.assertEqual(list(raised.exception.message_dict), ["bloom_capacity"])
+
+
+class VoteViewTests(RedisPollTestCase):
+    # a client of the router: the URLconf already built the URLs of its API
+    api_client = TestAsyncClient(router)
+
+    def setUp(self):
+        super().setUp()
+        self.poll = Poll(id=1, question="?", text={"1": "yes", "2": "no"})
+        patcher = mock.patch.object(
+            Poll.objects, "aget", new_callable=mock.AsyncMock, return_value=self.poll
+        )
+        self.aget = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_vote_statuses_map_to_error_responses(self):
+        headers = {"X-USER-ID": "u1"}
+        response = await self.api_client.post(
+            "/polls/1/vote", json={"option": "1"}, headers=headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("poll_voter", response.cookies)
+
+        response = await self.api_client.post(
+            "/polls/1/vote", json={"option": "1"}, headers=headers
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": VOTE_ERRORS[services.RATE_LIMITED]})
+
+    async def test_closed_polls_and_unknown_options_are_refused(self):
+        self.poll.expire_at = timezone.now() - timedelta(minutes=1)
+        response = await self.api_client.post("/polls/1/vote", json={"option": "1"})
+        self.assertEqual(response.json(), {"error": "This poll has expired"})
+
+        poll_meta_services.forget_local()
+        await self.redis.delete("poll:1:meta")
+        self.poll.expire_at = None
+        response = await self.api_client.post("/polls/1/vote", json={"option": "9"})
+        self.assertEqual(response.json(), {"error": "Invalid option ID"})
+
+
+class PollMetaTests(RedisPollTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(
+            Poll.objects,
+            "aget",
+            new_callable=mock.AsyncMock,
+            return_value=Poll(id=1, question="?", text={"1": "yes"}),
+        )
+        self.aget = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_postgres_is_read_once(self):
+        meta = await poll_meta_services.get_poll_meta(1)
+        self.assertEqual(await poll_meta_services.get_poll_meta(1), meta)
+
+        poll_meta_services.forget_local()
+        self.assertEqual(await poll_meta_services.get_poll_meta(1), meta)
+
+        self.aget.assert_awaited_once_with(pk=1)
+        self.assertEqual(meta["text"], {"1": "yes"})
+        self.assertTrue(meta["is_active"])
+
+    async def test_unknown_polls_are_cached_as_missing(self):
+        self.aget.side_effect = Poll.DoesNotExist
+
+        self.assertIsNone(await poll_meta_services.get_poll_meta(2))
+        poll_meta_services.forget_local()
+        self.assertIsNone(await poll_meta_services.get_poll_meta(2))
+
+        self.aget.assert_awaited_once()
+        self.assertLessEqual(
+            await self.redis.ttl("poll:2:meta"), settings.POLL_META_MISSING_TTL
+        )
+
+    async def test_save_and_delete_invalidate_after_commit(self):
+        await poll_meta_services.get_poll_meta(1)
+
+        with mock.patch.object(
+            signals.transaction, "on_commit", side_effect=lambda func: func()
+        ):
+            await sync_to_async(post_save.send)(
+                sender=Poll, instance=Poll(id=1), created=False
+            )
+
+        self.assertFalse(await self.redis.exists("poll:1:meta"))
+        await poll_meta_services.get_poll_meta(1)
+        self.assertEqual(self.aget.await_count, 2)
+
+    async def test_fill_is_dropped_after_an_invalidation(self):
+        # the poll is deactivated between the Postgres read and the fill
+        async def read_then_invalidate(pk):
+            await sync_to_async(poll_meta_services.invalidate_poll_meta)(1)
+            return Poll(id=1, question="?", text={"1": "yes"})
+
+        self.aget.side_effect = read_then_invalidate
+        self.assertTrue((await poll_meta_services.get_poll_meta(1))["is_active"])
+
+        self.assertFalse(await self.redis.exists("poll:1:meta"))
+
+
+class PollResultsTests(RedisPollTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(
+            Poll.objects,
+            "aget",
+            new_callable=mock.AsyncMock,
+            return_value=Poll(id=1, question="?", text={"1": "yes", "2": "no"}),
+        )
+        self.aget = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_results_follow_votes_without_invalidation(self):
+        await services.cast_vote(1, None, "10.0.0.1", "2")
+        first = await poll_results_services.get_poll_results(1)
+        await services.cast_vote(1, None, "10.0.0.2", "2")
+        second = await poll_results_services.get_poll_results(1)
+
+        self.assertEqual(first["results"], {"1": 0, "2": 1})
+        self.assertEqual(
+            second,
+            {
+                "poll_id": 1,
+                "question": "?",
+                "options": [{"id": "1", "text": "yes"}, {"id": "2", "text": "no"}],
+                "results": {"1": 0, "2": 2},
+                "total_votes": 2,
+            },
+        )
+        self.aget.assert_awaited_once()
+
+    async def test_unknown_poll(self):
+        self.aget.side_effect = Poll.DoesNotExist
+        self.assertIsNone(await poll_results_services.get_poll_results(5))
+
+    @override_settings(POLL_RESULTS_MAX_STALENESS=60)
+    async def test_snapshot_is_read_once_for_concurrent_requests(self):
+        await poll_meta_services.get_poll_meta(1)
+        with mock.patch.object(
+            self.redis, "hgetall", wraps=self.redis.hgetall
+        ) as hgetall:
+            results = await asyncio.gather(
+                *(poll_results_services.get_poll_results_snapshot(1) for _ in range(5))
+            )
+            await services.cast_vote(1, None, "10.0.0.1", "1")
+            later = await poll_results_services.get_poll_results_snapshot(1)
+
+        hgetall.assert_called_once()
+        self.assertEqual(later, results[0])
+        self.assertEqual(later["total_votes"], 0)
+
+
+@override_settings(POLL_STREAM_MAX_UPDATES_PER_SECOND=20)
+class PollStreamTests(RedisPollTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(
+            Poll.objects,
+            "aget",
+            new_callable=mock.AsyncMock,
+            return_value=Poll(id=1, question="?", text={"1": "yes", "2": "no"}),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_votes_are_pushed_to_every_viewer(self):
+        streams = [poll_stream_services.stream_poll_results(1) for _ in range(2)]
+        first = [await anext(stream) for stream in streams]
+        hub = poll_stream_services.get_hub()
+
+        await services.cast_vote(1, None, "10.0.0.1", "2")
+        events = [
+            await asyncio.wait_for(anext(stream), timeout=2) for stream in streams
+        ]
+
+        self.assertEqual(first[0], first[1])
+        self.assertIn('"total_votes": 0', first[0])
+        self.assertTrue(events[0].startswith("event: results\ndata: "))
+        self.assertEqual(
+            json.loads(events[1].split("data: ", 1)[1])["results"], {"1": 0, "2": 1}
+        )
+        self.assertEqual(len(hub.viewers[1]), 2)
+
+        for stream in streams:
+            await stream.aclose()
+        self.assertEqual(hub.viewers, {})
+        await hub.close()
+
+    async def test_updates_are_coalesced(self):
+        hub = poll_stream_services.get_hub()
+        queue = await hub.join(1)
+        message = {"channel": "poll:1:updates", "data": "1"}
+        with mock.patch.object(
+            poll_stream_services,
+            "get_poll_results",
+            new_callable=mock.AsyncMock,
+            side_effect=lambda poll_id: {"reads": read.await_count},
+        ) as read:
+            for _ in range(10):
+                hub._handle_message(message)
+            await asyncio.sleep(0.01)
+            for _ in range(10):
+                hub._handle_message(message)
+            await asyncio.sleep(0.15)
+
+        # one read right away, one for everything that came during the wait
+        self.assertEqual(read.await_count, 2)
+        self.assertEqual(queue.get_nowait(), {"reads": 2})
+        await hub.leave(1, queue)
+        await hub.close()
@@ -1,7 +1,7 @@
 from typing import List
 
 from asgiref.sync import sync_to_async
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from ninja import Header, Router
 
@@ -9,19 +9,27 @@ from .models import Poll
 from .schemas import CreatePoll, CreatePollOut, ErrorSchema, PollOut, VoteSchema
 from .services.cookie_services import has_cookie_voted, set_vote_cookie
 from .services.ip_services import get_client_ip
+from .services.poll_meta_services import get_poll_meta, is_expired
+from .services.poll_results_services import get_poll_results_snapshot
+from .services.poll_stream_services import stream_poll_results
 from .services.redis_poll_services import (
-    try_register_vote,
-    record_vote,
-    get_poll_vote_count,
-    is_rate_limited,
-    get_cached_poll_results,
-    cache_poll_results,
+    IP_ALREADY_VOTED,
+    RATE_LIMITED,
+    USER_ALREADY_VOTED,
+    VOTE_RECORDED,
+    cast_vote,
 )
 
 # Create your views here.
 
 router = Router()
 
+VOTE_ERRORS = {
+    RATE_LIMITED: "You are voting so quickly, please wait few seconds ...",
+    USER_ALREADY_VOTED: "User has already voted",
+    IP_ALREADY_VOTED: "This ip/browser has already voted",
+}
+
 
 @router.get("/polls", response=List[PollOut])
 async def poll_list(request):
@@ -52,44 +60,35 @@ async def vote(
 
     option_id = data.option
 
-    try:
-        poll = await Poll.objects.aget(pk=poll_id)
-    except Poll.DoesNotExist:
+    # cached metadata, Postgres is only read on a miss
+    poll = await get_poll_meta(poll_id)
+    if poll is None:
         return 404, {"error": "Poll not found"}
 
-    if not poll.is_active:
+    if not poll["is_active"]:
         return 400, {"error": "This poll is not active"}
 
-    if poll.expire_at and poll.is_expired():
+    if is_expired(poll):
         return 400, {"error": "This poll has expired"}
 
-    if option_id not in poll.text:
+    if option_id not in poll["text"]:
         return 400, {"error": "Invalid option ID"}
 
     ip = get_client_ip(request)
     user_id = request.headers.get("X-USER-ID")
 
-    if await is_rate_limited(ip):
-        return 400, {"error": "You are voting so quickly, please wait few seconds ..."}
-
-    if user_id:
-        success = await try_register_vote(poll_id, user_id, "voted_user")
-        if not success:
-            return 400, {"error": "User has already voted"}
-
-        # if await has_user_voted(poll_id, user_id):
-        #     return 400, {"error": "User has laready voted"}
-        # await register_user_vote(poll_id, user_id)
-
-    ip_already_voted = not await try_register_vote(poll_id, ip, "voted_ips")
-
-    if ip_already_voted or has_cookie_voted(request, poll_id):
-        return 400, {"error": "This ip/browser has already voted"}
-
-    # await increment_vote(poll_id, option_id)
-    # await track_recent_vote(poll_id, user_id or "anonymous", ip, option_id)
-
-    await record_vote(poll_id, user_id or "anonymous", ip, option_id)
+    # rate limit, user/ip dedup, tally and recent votes in one atomic Redis
+    # script
+    status = await cast_vote(
+        poll_id,
+        user_id,
+        ip,
+        option_id,
+        has_cookie_voted(request, poll_id),
+        dedup=poll.get("dedup"),
+    )
+    if status != VOTE_RECORDED:
+        return 400, {"error": VOTE_ERRORS[status]}
 
     response = JsonResponse({"message": f"Vote for option {option_id} is considered"})
     set_vote_cookie(response, request, poll_id)
@@ -101,35 +100,23 @@ async def vote(
 )
 async def pool_results(request, poll_id: int):
 
-    cached = await get_cached_poll_results(poll_id)
-    if cached:
-        return cached
-
-    try:
-        poll = await Poll.objects.aget(pk=poll_id)
-    except Poll.DoesNotExist:
+    # cached poll metadata + live tally in one Redis round trip, or a
+    # snapshot at most POLL_RESULTS_MAX_STALENESS seconds old
+    results = await get_poll_results_snapshot(poll_id)
+    if results is None:
         return {"error": "requested poll is not found"}
+    return results
 
-    results = await get_poll_vote_count(poll_id)
-
-    for option_id in poll.text.keys():
-        if option_id not in results:
-            """
-            Ensures every poll option has a vote count, even if it's zero:
-            {"1": 12,"2": 8, "3": 0,"4": 0}
-            """
-            results[option_id] = 0
 
-    total_votes = sum(results.values())
+@router.get("/polls/{poll_id}/stream", response={404: ErrorSchema})
+async def poll_results_stream(request, poll_id: int):
+    """Server-sent events with the poll results, pushed as votes come in."""
+    if await get_poll_meta(poll_id) is None:
+        return 404, {"error": "requested poll is not found"}
 
-    response = {
-        "poll_id": poll.id,
-        "question": poll.question,
-        "options": [{"id": k, "text": v} for k, v in poll.text.items()],
-        "results": results,
-        "total_votes": total_votes,
-    }
-
-    await cache_poll_results(poll_id, response)  # Cache if for next time
-
-    return response
+    # one pub/sub subscription per worker, updates coalesced per poll
+    return StreamingHttpResponse(
+        stream_poll_results(poll_id),
+        content_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )